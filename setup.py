@@ -27,9 +27,16 @@ setup(name='tycho',
           'pymongo',
           'orbital-core',
       ],
+      extras_require={
+          # brotli and zstd response compression, gzip is always available.
+          'compression': ['brotli', 'zstandard'],
+          # faster json encoding of the responses.
+          'json': ['orjson'],
+      },
       entry_points={
           'console_scripts': [
-              'create_indexes=tycho.scripts.create_indexes:main'
+              'create_indexes=tycho.scripts.create_indexes:main',
+              'backfill_events=tycho.scripts.backfill:main',
           ]
       },
       include_package_data=True,
@@ -1,9 +1,14 @@
+import asyncio
 import os
 import logging
 from aiohttp import web
 from aiohttp_transmute import TransmuteUrlDispatcher
 from .routes import add_routes
+from .routes.compression import compression_middleware
 from .db import init_db as init_db
+from .db.cache import create_cache
+from .db.tail import EventTail, close_tail
+from .db.watcher import stop_watching, watch_events
 from orbital_core import bootstrap_app
 
 
@@ -16,13 +21,25 @@ def create_app(config, **kwargs):
                   service_name="tycho",
                   service_description="A service for tracking operational change.")
     add_routes(app)
+    if config.compression.enabled:
+        app.middlewares.append(compression_middleware(config.compression))
     # add attributes
     app["config"] = config
     app.update(**kwargs)
     app.on_startup.append(lambda app: init_app(app, config))
+    app.on_shutdown.append(close_tail)
+    app.on_cleanup.append(stop_watching)
     return app
 
 
 async def init_app(app, config):
     if "db" not in app:
         app["db"] = init_db(config.mongo)  # pragma: no cover
+    app["db"].event.cache = create_cache(config.cache, "event_cache")
+    app["db"].event.tag_time = config.storage.tag_time
+    app["db"].event.tag_kv = config.storage.tag_kv
+    # every subscriber of this worker shares the same change stream.
+    app["event_tail"] = EventTail(app["db"].event)
+    if app["db"].event.cache is not None and config.cache.watch:
+        # every worker watches the changes made by the others.
+        app["event_watcher"] = asyncio.ensure_future(watch_events(app["db"].event))
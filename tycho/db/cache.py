@@ -0,0 +1,124 @@
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+from .. import metrics
+from .shared_cache import SharedCache
+
+
+class LRUCache:
+    """
+    A bounded in-process cache. Once max_size values are stored, the
+    least recently used one is evicted to make room for a new one, and
+    values expire ttl_seconds after they were stored.
+
+    Every value depends on a set of ids, e.g. the events it was built
+    from, and invalidating any of them drops the value.
+
+    Values read from the database may be stale by the time they are
+    stored, if a write invalidated them in the meantime. To avoid
+    this, get a token before reading, and pass it to set: the value is
+    only stored if nothing was invalidated since.
+
+    hits, misses, evictions and expirations are counted as metrics
+    prefixed by name.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, name: str = "cache",
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._clock = clock
+        # key -> (expiry, value, dependencies), least recently used first.
+        self._values = OrderedDict()
+        # id -> the keys of the values depending on it.
+        self._dependents = {}
+        self._invalidations = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def token(self) -> int:
+        return self._invalidations
+
+    def get(self, key):
+        """
+        returns the value stored under key, or None.
+        """
+        entry = self._values.get(key)
+        if entry is None:
+            self._count("misses")
+            return None
+        expiry, value, _ = entry
+        if expiry <= self._clock():
+            self._remove(key)
+            self._count("expirations")
+            self._count("misses")
+            return None
+        self._values.move_to_end(key)
+        self._count("hits")
+        return value
+
+    def set(self, key, value, token: int = None, depends_on: Iterable = ()):
+        if self.max_size <= 0:
+            return
+        if token is not None and token != self._invalidations:
+            return
+        self._remove(key)
+        dependencies = frozenset(depends_on)
+        self._values[key] = (self._clock() + self.ttl_seconds, value, dependencies)
+        for id in dependencies:
+            self._dependents.setdefault(id, set()).add(key)
+        while len(self._values) > self.max_size:
+            self._remove(next(iter(self._values)))
+            self._count("evictions")
+
+    def delete(self, *keys):
+        self._invalidations += 1
+        for key in keys:
+            self._remove(key)
+
+    def invalidate(self, *ids):
+        """
+        drops the values depending on any of ids.
+        """
+        self._invalidations += 1
+        for id in ids:
+            for key in list(self._dependents.get(id, ())):
+                self._remove(key)
+
+    def clear(self):
+        self._invalidations += 1
+        self._values.clear()
+        self._dependents.clear()
+
+    def _remove(self, key):
+        entry = self._values.pop(key, None)
+        if entry is None:
+            return
+        for id in entry[2]:
+            keys = self._dependents.get(id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[id]
+
+    def _count(self, counter):
+        metrics.increment("{0}.{1}".format(self.name, counter))
+
+
+def create_cache(cache_config, name: str):
+    """
+    returns the cache described by the config, or None
+    when caching is disabled.
+    """
+    if cache_config is None or not cache_config.enabled:
+        return None
+    if cache_config.backend == "shared":
+        return SharedCache(
+            "{0}-{1}".format(cache_config.shared_path, name),
+            cache_config.shared_size_mb * 1024 * 1024,
+            cache_config.shared_slot_kb * 1024,
+            cache_config.ttl_seconds, name=name)
+    return LRUCache(cache_config.max_size, cache_config.ttl_seconds, name=name)
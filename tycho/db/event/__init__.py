@@ -1,20 +1,47 @@
-import asyncio
+import bson
+import hashlib
 import pymongo
-import queue as q
-import random
 
-from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+from typing import Tuple
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from aiohttp.web import HTTPNotFound
 
-from ..utils import async_generator
+from ..utils import async_generator, async_list, recorded
+from ... import metrics
 from ...models.eventnode import EventNode
 from ...models.event import Event as ModelEvent
+from .deletion import EventDeletion, RETENTION
 from .deserialize import deserialize_db_event
+from .keyset import after_query, changes_after_query, encode_after, encode_changes_after
+from .ancestry import (
+    lineage_ids, repair_descendants_filter, repair_descendants_pipeline, resolve_ancestors)
+from .merge import merge_filter, merge_matches, merge_pipeline
+from .projection import projection
 from .serialize import serialize_to_db_event
+from .tag_kv import tag_kv_query, tags_query
+from .tag_time import tag_time_query
+from .version import (
+    UNVERSIONED, VersionConflict, replace_pipeline, version_filter)
+from .tree import build_tree, flatten_tree
 
 
 MAX_RECURSIVE_DEPTH = 100
-MAX_WAIT_TIME_SECONDS = 0.5
+# how many times a write losing a race is retried.
+MAX_WRITE_RETRIES = 1
+# children lists and trees with more events are not cached.
+MAX_CACHED_EVENTS = 1000
+# how far back changes are read again, in case they were in flight.
+CHANGES_OVERLAP = timedelta(seconds=5)
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+# the strategies get_tree and trace can use to walk the event graph:
+# - bfs walks the graph from python, one query per depth level
+# - graph_lookup lets MongoDB walk the graph with a single aggregation
+# - ancestors reads the ancestors materialized on every event
+# - source_id loads every event sharing the source id with a single query
+TRAVERSALS = ["bfs", "graph_lookup", "ancestors", "source_id"]
 
 
 class Event:
@@ -29,110 +56,814 @@ class Event:
     frame, will result in a scanning query, as MongoDB cannot build a compound index
     that includes both the tags and the update time. As such it is best to restrict time
     ranges to as short of a range as possible, and filter to a specific tag.
+
+    When tag_time is enabled, every event also stores each of its tags paired with
+    its start and end times in tag_time, which can be indexed together, and queries
+    on tags and a time range are bounded on both through that index instead.
+
+    When tag_kv is enabled, the tags are also stored as {k, v} subdocuments in tag_kv,
+    indexed on the key and then the value, and queries on tags go through that
+    index, where the values of a key are scanned apart from every other key, which
+    keeps matching a key by the prefix of its values selective.
+
+    Both indexes are sparse, so that they cost nothing until enabled, and events
+    written while they were not are covered by the backfill_events script.
+
+    The parent id is also stored as a top-level, indexed field, which lets MongoDB
+    walk parent-child relationships itself with $graphLookup. Documents written
+    before that field existed can be updated with the backfill_events script.
+
+    Every event also carries the ids of all of its ancestors, root first, along with
+    its depth in the tree. These are maintained on every write: when an event is
+    written before its parent, or moves to a new parent, the ancestors of its
+    descendants are rewritten as well. Finding all ancestors of an event, or all of
+    its descendants, is then a single indexed query.
     """
 
     _collection = "event"
 
     indexes = [
         {"unique": False, "keys": [("tags", pymongo.ASCENDING)]},
-        {"unique": False, "keys": [("time", pymongo.ASCENDING)]},
-        {"unique": False, "keys": [("update_time", pymongo.ASCENDING)]},
+        # _id breaks ties between events sorted by time.
+        {"unique": False, "keys": [("time", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]},
+        {"unique": False, "keys": [("update_time", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]},
+        {"unique": False, "keys": [("parent_id", pymongo.ASCENDING)]},
+        {"unique": False, "keys": [("ancestors", pymongo.ASCENDING)]},
+        {"unique": False, "sparse": True, "keys": [("tag_time.t", pymongo.ASCENDING),
+                                                   ("tag_time.time", pymongo.ASCENDING)]},
+        {"unique": False, "sparse": True, "keys": [("tag_kv.k", pymongo.ASCENDING),
+                                                   ("tag_kv.v", pymongo.ASCENDING)]},
     ]
 
     def __init__(self, collection):
         self.collection = collection
+        # whether events store tag_time, and find reads tags and
+        # times through its index.
+        self.tag_time = False
+        # whether events store tag_kv, and tags are queried through
+        # its index.
+        self.tag_kv = False
+        self.deletions = EventDeletion(
+            collection.database[EventDeletion._collection])
+        # raw DB events by id, encoded as BSON so that every read
+        # returns its own copy. see tycho.db.cache.
+        self.cache = None
+
+    def _serialize(self, event: ModelEvent):
+        # the DB event as written, with the fields enabled in storage.
+        return serialize_to_db_event(
+            event, with_tag_time=self.tag_time, with_tag_kv=self.tag_kv)
 
     async def save(self, data: ModelEvent):
-        new_db_format = serialize_to_db_event(data)
-        result = await self.collection.insert_one(new_db_format)
+        new_db_format = self._serialize(data)
+        await self.set_ancestors([new_db_format])
+        try:
+            result = await self.collection.insert_one(new_db_format)
+        finally:
+            self._invalidate(*lineage_ids(new_db_format))
+        await self.repair_descendants([new_db_format])
         return result
 
+    async def save_many(self, data):
+        """
+        insert events with a single unordered batch, so one failing
+        event does not prevent the others from being written.
+        returns the write errors reported by MongoDB, keyed by the
+        index of the event in data.
+        """
+        new_db_format = [self._serialize(event) for event in data]
+        if not new_db_format:
+            return {}
+        await self.set_ancestors(new_db_format)
+        errors = {}
+        try:
+            await self.collection.insert_many(new_db_format, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                errors[error["index"]] = error
+        finally:
+            self._invalidate(*_lineage_ids(new_db_format))
+        await self.repair_descendants(
+            [doc for i, doc in enumerate(new_db_format) if i not in errors]
+        )
+        return errors
+
     async def find_one(self) -> ModelEvent:
         result = await self.collection.find_one()
         return deserialize_db_event(result)
 
     async def find_by_id(self, id) -> ModelEvent:
-        document = None
-        cursor = self.collection.find({"_id": id})
-        while await cursor.fetch_next:
-            document = cursor.next_object()
+        document = await self._find_document(id)
         if document is None:
             raise HTTPNotFound(text="cannot find event {0}".format(id))
         return deserialize_db_event(document)
 
-    async def update_by_id(self, id, update_doc: ModelEvent, insert: bool = False):
-        new_data = serialize_to_db_event(update_doc)
+    async def find_by_id_with_version(self, id, cached: bool = True) -> Tuple[ModelEvent, int]:
+        """
+        return the event stored under id, along with its version.
+        pass cached=False to read the latest version, e.g. before
+        writing the event back.
+        """
+        if cached:
+            document = await self._find_document(id)
+        else:
+            document = await self.collection.find_one({"_id": id})
+        if document is None:
+            raise HTTPNotFound(text="cannot find event {0}".format(id))
+        return deserialize_db_event(document), document.get("version", UNVERSIONED)
 
-        retries = 1
-        while retries >= 0:
+    async def find_by_id_with_update_time(self, id) -> Tuple[ModelEvent, int, datetime]:
+        """
+        return the event stored under id, along with its version and
+        update time: an event deleted and written again starts over at
+        version 1, but not at the same update time.
+        """
+        document = await self._find_document(id)
+        if document is None:
+            raise HTTPNotFound(text="cannot find event {0}".format(id))
+        return (deserialize_db_event(document), document.get("version", UNVERSIONED),
+                document.get("update_time"))
+
+    async def _find_document(self, id):
+        """
+        return the DB event stored under id from the cache, or from
+        the database when it is not cached.
+        """
+        if self.cache is None:
+            return await self.collection.find_one({"_id": id})
+        key = "event:{0}".format(id)
+        data = self.cache.get(key)
+        if data is not None:
+            return bson.decode(data)
+        token = self.cache.token()
+        document = await self.collection.find_one({"_id": id})
+        if document is not None:
+            self.cache.set(key, bson.encode(document), token, depends_on=[id])
+        return document
+
+    def _invalidate(self, *ids):
+        """
+        drop what was cached about events that were just written.
+        pass the ids returned by lineage_ids, so that the children
+        and trees that now include the events are dropped as well.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(*ids)
+
+    async def update_by_id(self, id, update_doc: ModelEvent, insert: bool = False,
+                           version: int = None):
+        """
+        replace the event stored under id, and return it as it was
+        before. When version is passed, the event is only replaced if
+        it is still at that version, and VersionConflict is raised
+        otherwise.
+        """
+        new_data = self._serialize(update_doc)
+        await self.set_ancestors([new_data])
+        query = {"_id": id}
+        if version is not None:
+            query.update(version_filter(version))
+
+        retries = MAX_WRITE_RETRIES
+        while True:
             try:
-                result = await self.collection.find_one_and_replace(
-                    {"_id": id}, new_data, upsert=insert
+                result = await self.collection.find_one_and_update(
+                    query, replace_pipeline(new_data), upsert=insert
                 )
-                return result
+                break
             except DuplicateKeyError:
-                await asyncio.sleep(random.uniform(0.0, MAX_WAIT_TIME_SECONDS))
-                retries -= 1
-                if retries < 0:
+                # with a version, the stored event was at another one.
+                # otherwise, another request inserted the event first,
+                # and it can be replaced right away.
+                if version is not None:
+                    self._invalidate(id)
+                    raise VersionConflict(id, version)
+                if retries == 0:
                     raise
+                retries -= 1
+                metrics.increment("event.update.retries")
+        self._invalidate(*lineage_ids(new_data))
+        if result is None and version is not None and not insert:
+            if await self.collection.count_documents({"_id": id}, limit=1):
+                raise VersionConflict(id, version)
+        # the descendants only need new ancestors when the event is new,
+        # or was stored with other ancestors than the ones it now has.
+        if (result is None and insert) or \
+                (result is not None and result.get("ancestors") != new_data["ancestors"]):
+            await self.repair_descendants([new_data])
+        return result
 
-    async def find_by_parent_id(self, id):
-        cursor = self.collection.find({"tags": {"$in": ["parent_id:{0}".format(id)]}})
-        return async_generator(cursor, deserialize_db_event)
+    async def merge_by_id(self, id, data: ModelEvent, insert: bool = False,
+                          version: int = None):
+        """
+        merge data into the event stored under id with a single atomic
+        update, so concurrent merges of the same event all apply.
+        returns the merged event, or None when it does not exist and
+        insert is not set.
+        raises ValueError when the reserved keys of both events clash,
+        and VersionConflict when version is passed and the event is no
+        longer at that version.
+        """
+        new_data = self._serialize(data)
+        # only used when the stored event does not have a parent yet.
+        await self.set_ancestors([new_data])
+        query = {"_id": id}
+        query.update(merge_filter(data))
+        if version is not None:
+            query.update(version_filter(version))
+        pipeline = merge_pipeline(new_data)
+        try:
+            document = await self.collection.find_one_and_update(
+                query, pipeline, upsert=insert,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # either another request inserted the event first, or the
+            # stored event did not match the query.
+            metrics.increment("event.merge.retries")
+            document = await self.collection.find_one_and_update(
+                query, pipeline, return_document=ReturnDocument.AFTER
+            )
+        self._invalidate(*lineage_ids(document or {"_id": id}))
+        if document is None:
+            stored = await self.collection.find_one({"_id": id}, {"version": 1})
+            if stored is None:
+                return None
+            if version is not None and stored.get("version", UNVERSIONED) != version:
+                raise VersionConflict(id, version)
+            raise ValueError(
+                "Merge not possible: reserved keys of event {0} "
+                "have different values.".format(id))
+        # the stored parent is kept when there was one, in which case
+        # the lineage did not move. Otherwise the descendants that
+        # already agree with it are left as they are.
+        if data.parent_id and document.get("ancestors") == new_data["ancestors"]:
+            await self.repair_descendants([document])
+        return deserialize_db_event(document)
+
+    async def set_ancestors(self, docs):
+        """
+        fill in the ancestors and depth of DB events about to be written.
+        parents that are part of docs do not need to be written first.
+        """
+        docs_by_id = {doc["_id"]: doc for doc in docs}
+        parent_ids = {doc.get("parent_id") for doc in docs} - set(docs_by_id)
+        parent_ids.discard("")
+        parent_ids.discard(None)
+        stored_ancestors = {}
+        if parent_ids:
+            cursor = self.collection.find(
+                {"_id": {"$in": list(parent_ids)}}, {"ancestors": 1}
+            )
+            async for parent in cursor:
+                stored_ancestors[parent["_id"]] = parent.get("ancestors", [])
+        for doc in docs:
+            doc["ancestors"] = resolve_ancestors(
+                doc, docs_by_id, stored_ancestors, MAX_RECURSIVE_DEPTH - 1
+            )
+            doc["depth"] = len(doc["ancestors"])
+
+    async def repair_descendants(self, docs):
+        """
+        rewrite the ancestors of the descendants of DB events that
+        were just written, so they agree with their new ancestors.
+        """
+        if len(docs) > 1:
+            # find out which of the events have descendants at all
+            # with a single query, rather than one update per event.
+            ids = [doc["_id"] for doc in docs]
+            ancestor_ids = set(await self.collection.distinct(
+                "ancestors", {"ancestors": {"$in": ids}}
+            ))
+            docs = [doc for doc in docs if doc["_id"] in ancestor_ids]
+        for doc in docs:
+            await self.collection.update_many(
+                repair_descendants_filter(doc, MAX_RECURSIVE_DEPTH - 1),
+                repair_descendants_pipeline(doc, MAX_RECURSIVE_DEPTH - 1),
+            )
+
+    async def find_by_ids(self, ids):
+        """
+        return the events stored under any of ids with a single query,
+        keyed by their id.
+        """
+        result = {}
+        async for doc in self.collection.find({"_id": {"$in": list(ids)}}):
+            event = deserialize_db_event(doc)
+            result[event.id] = event
+        return result
+
+    async def find_by_ids_with_version(self, ids):
+        """
+        return the events stored under any of ids with a single query,
+        along with their version, keyed by their id.
+        """
+        result = {}
+        async for doc in self.collection.find({"_id": {"$in": list(ids)}}):
+            result[doc["_id"]] = (deserialize_db_event(doc),
+                                  doc.get("version", UNVERSIONED))
+        return result
+
+    async def update_many_by_id(self, data, insert: bool = False, versions=None):
+        """
+        replace events with a single unordered bulk write, inserting
+        the ones that do not exist yet when insert is set. Without
+        insert, only events known to exist should be passed, as the
+        ancestors of their descendants are rewritten.
+        with versions, the version every event of data was read at,
+        an event is only replaced if it is still at that version, and
+        the other ones are reported with "conflict" set.
+        returns the write errors reported by MongoDB, keyed by the
+        index of the event in data.
+        """
+        new_db_format = [self._serialize(event) for event in data]
+        if not new_db_format:
+            return {}
+        await self.set_ancestors(new_db_format)
+        queries = [{"_id": doc["_id"]} for doc in new_db_format]
+        if versions is not None:
+            for query, version in zip(queries, versions):
+                query.update(version_filter(version))
+        try:
+            details = await self._bulk_write([
+                UpdateOne(query, replace_pipeline(doc), upsert=insert)
+                for query, doc in zip(queries, new_db_format)
+            ])
+        finally:
+            self._invalidate(*_lineage_ids(new_db_format))
+        errors = {error["index"]: error for error in details["writeErrors"]}
+        if versions is not None:
+            for error in errors.values():
+                if error.get("code") == DUPLICATE_KEY_ERROR_CODE:
+                    # inserted by someone else since it was read.
+                    error["conflict"] = True
+            if _unapplied_count(details, len(new_db_format)):
+                await self._find_version_conflicts(
+                    new_db_format, versions, details, errors)
+        await self.repair_descendants(
+            [doc for i, doc in enumerate(new_db_format) if i not in errors]
+        )
+        return errors
+
+    async def _find_version_conflicts(self, docs, versions, details, errors):
+        """
+        add the replacements of a bulk write that did not apply, as the
+        event was no longer at the version expected, to errors: a bulk
+        write only tells how many of them applied.
+        """
+        upserted = {upsert["index"] for upsert in details["upserted"]}
+        indexes = [i for i in range(len(docs)) if i not in errors and i not in upserted]
+        cursor = self.collection.find(
+            {"_id": {"$in": [docs[i]["_id"] for i in indexes]}},
+            {"version": 1, "update_time": 1})
+        stored = {doc["_id"]: doc async for doc in cursor}
+        for i in indexes:
+            doc = stored.get(docs[i]["_id"], {})
+            # MongoDB only keeps the milliseconds of the update time.
+            update_time = docs[i]["update_time"]
+            update_time = update_time.replace(
+                microsecond=update_time.microsecond // 1000 * 1000)
+            if doc.get("version") != versions[i] + 1 or \
+                    doc.get("update_time") != update_time:
+                errors[i] = {"index": i, "conflict": True, "errmsg": str(
+                    VersionConflict(docs[i]["_id"], versions[i]))}
+
+    async def merge_many_by_id(self, data, insert: bool = False):
+        """
+        merge every event of data into the one stored under its id,
+        with unordered bulk writes of the atomic updates of merge_by_id,
+        so concurrent merges of the same events all apply. Events of
+        data sharing an id are merged in order, with one bulk write per
+        occurrence: usually a single one.
+        returns the status of every event of data, "created", "merged",
+        "not_found", or "invalid" when its reserved keys clash with the
+        stored event's, along with the write errors reported by
+        MongoDB, keyed by the index of the event in data.
+        """
+        new_db_format = [self._serialize(event) for event in data]
+        statuses = [None] * len(data)
+        errors = {}
+        if not new_db_format:
+            return statuses, errors
+        # only used when the stored events do not have a parent yet.
+        await self.set_ancestors(new_db_format)
+        stored_tags = await self._find_tags({doc["_id"] for doc in new_db_format})
+        lineage_moved = []
+        try:
+            for indexes in _occurrences(new_db_format):
+                merged = []
+                for i in indexes:
+                    tags = stored_tags.get(new_db_format[i]["_id"])
+                    if tags is None and not insert:
+                        statuses[i] = "not_found"
+                    elif tags is not None and not merge_matches(tags, data[i]):
+                        statuses[i] = "invalid"
+                    else:
+                        statuses[i] = "merged" if tags is not None else "created"
+                        merged.append(i)
+                await self._bulk_merge(new_db_format, data, merged, insert,
+                                       statuses, errors)
+                for i in merged:
+                    if i in errors or statuses[i] not in ("merged", "created"):
+                        continue
+                    doc = new_db_format[i]
+                    tags = stored_tags.get(doc["_id"], [])
+                    # the parent is only set on events that did not have one.
+                    if data[i].parent_id and not any(
+                            tag.startswith("parent_id:") for tag in tags):
+                        lineage_moved.append(doc)
+                    stored_tags[doc["_id"]] = tags + [
+                        tag for tag in doc["tags"] if tag not in tags]
+        finally:
+            self._invalidate(*_lineage_ids(new_db_format))
+        await self.repair_descendants(lineage_moved)
+        return statuses, errors
+
+    async def _bulk_merge(self, docs, data, indexes, insert, statuses, errors):
+        """
+        merge the events of data at indexes with a single bulk write.
+        fills in errors, and the statuses of the merges that did not
+        apply because the stored events changed since they were read.
+        """
+        if not indexes:
+            return
+        details = await self._bulk_write([
+            UpdateOne(dict({"_id": docs[i]["_id"]}, **merge_filter(data[i])),
+                      merge_pipeline(docs[i]), upsert=insert)
+            for i in indexes
+        ])
+        retried = []
+        for error in details["writeErrors"]:
+            i = indexes[error["index"]]
+            if insert and error.get("code") == DUPLICATE_KEY_ERROR_CODE:
+                # either another request inserted the event first, or
+                # the stored event did not match the query.
+                retried.append(i)
+            else:
+                errors[i] = error
+        if retried:
+            metrics.increment("event.merge.retries", len(retried))
+            for i in retried:
+                statuses[i] = "merged"
+            await self._bulk_merge(docs, data, retried, False, statuses, errors)
+        applied = [i for i in indexes if i not in errors and i not in retried]
+        if _unapplied_count(details, len(indexes)) <= 0:
+            return
+        # deleted, or given clashing reserved keys, since they were read.
+        stored_tags = await self._find_tags({docs[i]["_id"] for i in applied})
+        for i in applied:
+            tags = stored_tags.get(docs[i]["_id"])
+            if tags is None:
+                statuses[i] = "not_found"
+            elif not merge_matches(tags, data[i]):
+                statuses[i] = "invalid"
+
+    async def _find_tags(self, ids):
+        """
+        return the tags of the events stored under any of ids, keyed
+        by their id.
+        """
+        cursor = self.collection.find({"_id": {"$in": list(ids)}}, {"tags": 1})
+        return {doc["_id"]: doc.get("tags", []) async for doc in cursor}
+
+    async def _bulk_write(self, operations):
+        """
+        run operations with a single unordered bulk write, so that one
+        failing operation does not prevent the others. returns the
+        result reported by MongoDB, along with its write errors.
+        """
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            return e.details
+        return result.bulk_api_result
+
+    async def find_by_parent_id(self, id, fields=None):
+        """
+        return the children of id. With fields, only what is needed to
+        return those public fields is read, see projection.
+        """
+        cursor = self.collection.find(
+            {"tags": {"$in": ["parent_id:{0}".format(id)]}}, projection(fields))
+        if self.cache is None:
+            return async_generator(cursor, deserialize_db_event)
+        key = "children:{0}".format(id)
+        data = self.cache.get(key)
+        if data is not None:
+            return async_generator(
+                async_list(bson.decode(data)["events"]), deserialize_db_event)
+        if fields:
+            # only whole children are cached.
+            return async_generator(cursor, deserialize_db_event)
+        token = self.cache.token()
+
+        def store(docs):
+            self.cache.set(
+                key, bson.encode({"events": docs}), token,
+                depends_on=[id] + [doc["_id"] for doc in docs])
+
+        # larger children lists are streamed without being kept.
+        return async_generator(
+            recorded(cursor, store, MAX_CACHED_EVENTS), deserialize_db_event)
 
     async def find(
-        self, tags=None, frm=None, to=None, use_update_time=False, count=100, page=1
+        self, tags=None, frm=None, to=None, use_update_time=False, count=100, page=1,
+        after=None, fields=None, tag_prefixes=None
     ):
+        """
+        return events matching all tags, and for every key:prefix in
+        tag_prefixes, a value of that key starting with prefix, most
+        recent first.
+
+        pages can either be selected by number, or with the after cursor
+        returned by next_after for the previous page. The cursor resumes
+        from the last event returned, so deep pages do not require
+        skipping over every event before them.
+
+        with fields, only what is needed to return those public fields
+        is read, see projection.
+        """
         if count < 0:
             raise ValueError("Count must be greater than or equal to zero.")
 
         if page < 1:
             raise ValueError("Page count must be greater than or equal to one.")
 
+        if after is not None and page != 1:
+            raise ValueError("Page can not be combined with an after cursor.")
+
         time_field = "update_time" if use_update_time else "time"
 
         query = {}
-        if tags is not None:
-            query["tags"] = {"$all": tags}
-
-        # optimize common use case
-        # https://docs.mongodb.com/manual/core/multikey-index-bounds/
-        if frm and to and not use_update_time:
-            query[time_field] = {"$elemMatch": {"$gte": frm, "$lt": to,}}
+        if (tags or tag_prefixes) and (frm or to) and not use_update_time and self.tag_time:
+            # both the first tag and the time bound the index scan.
+            query = tag_time_query(tags, frm, to, tag_prefixes)
         else:
-            if frm is not None:
-                query[time_field] = {"$gte": frm}
-            if to is not None:
-                if query.get(time_field) is None:
-                    query[time_field] = {"$lt": to}
-                else:
-                    query[time_field]["$lt"] = to
+            if tags is not None or tag_prefixes:
+                query.update(self.tags_query(tags, tag_prefixes))
+
+            # optimize common use case
+            # https://docs.mongodb.com/manual/core/multikey-index-bounds/
+            if frm and to and not use_update_time:
+                query[time_field] = {"$elemMatch": {"$gte": frm, "$lt": to,}}
+            else:
+                if frm is not None:
+                    query[time_field] = {"$gte": frm}
+                if to is not None:
+                    if query.get(time_field) is None:
+                        query[time_field] = {"$lt": to}
+                    else:
+                        query[time_field]["$lt"] = to
+
+        if after is not None:
+            time_condition, after_condition = after_query(after, time_field)
+            query.setdefault(time_field, {}).update(time_condition)
+            query.update(after_condition)
 
         cursor = (
-            self.collection.find(query)
-            .sort([(time_field, -1)])
+            self.collection.find(query, projection(fields))
+            .sort([(time_field, -1), ("_id", -1)])
             .skip((page - 1) * count)
             .limit(count)
         )
         return async_generator(cursor, deserialize_db_event)
 
-    async def get_tree(self, id):
+    def tags_query(self, tags=None, tag_prefixes=None):
+        """
+        return the query of events matching all tags, and a value
+        starting with prefix for every key:prefix in tag_prefixes.
+        """
+        if self.tag_kv:
+            return tag_kv_query(tags, tag_prefixes)
+        return tags_query(tags, tag_prefixes)
+
+    @staticmethod
+    def next_after(docs, use_update_time=False):
+        """
+        return the cursor to the page following the events already
+        read from docs, as returned by find.
+        """
+        time_field = "update_time" if use_update_time else "time"
+        return encode_after(docs.last_document, time_field)
+
+    async def find_by_parent_ids(self, ids, fields=None):
+        """
+        return the children of every event in ids with a single query.
+        """
+        tags = ["parent_id:{0}".format(id) for id in ids]
+        cursor = self.collection.find({"tags": {"$in": tags}}, projection(fields))
+        return async_generator(cursor, deserialize_db_event)
+
+    async def fingerprint(self, query):
+        """
+        return a digest of the events matching query, which changes
+        whenever any of them is written or deleted, or when events
+        start or stop matching. Only the database reads the events.
+        """
+        return _digest(await self._summarize(query))
+
+    async def _summarize(self, query):
+        pipeline = [
+            {"$match": query},
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "update_time": {"$max": "$update_time"},
+                # every write increments the version of the event.
+                "versions": {"$sum": {"$ifNull": ["$version", UNVERSIONED]}},
+                "depth": {"$max": "$depth"},
+            }},
+        ]
+        summary = {"count": 0, "update_time": None, "versions": 0, "depth": None}
+        async for doc in self.collection.aggregate(pipeline):
+            summary = doc
+        return summary
+
+    async def fingerprint_children(self, id):
+        """
+        return the fingerprint of the children of id.
+        """
+        return await self.fingerprint({"tags": "parent_id:{0}".format(id)})
+
+    async def fingerprint_tree(self, id):
+        """
+        return the fingerprint of the event and of all of its
+        descendants, or None when the ancestors stored do not list
+        every descendant.
+        """
+        # events written before ancestors were stored, and not
+        # backfilled yet, may be anywhere in the tree.
+        if await self.collection.find_one({"ancestors": {"$exists": False}}, {"_id": 1}):
+            return None
+        summary = await self._summarize({"$or": [{"_id": id}, {"ancestors": id}]})
+        # the children of the deepest events only keep their closest
+        # ancestors, which may no longer include id.
+        if (summary["depth"] or 0) >= MAX_RECURSIVE_DEPTH - 1:
+            return None
+        return _digest(summary)
+
+    async def fingerprint_trace(self, id):
+        """
+        return the fingerprint of the event and of all of its
+        ancestors, or None when its ancestors are not stored.
+        """
+        doc = await self.collection.find_one({"_id": id}, {"ancestors": 1})
+        if doc is None or "ancestors" not in doc:
+            return None
+        return await self.fingerprint({"_id": {"$in": [id] + doc["ancestors"]}})
+
+    async def find_descendants(self, id, fields=None):
+        """
+        return every event below id in the tree, with a single query.
+        """
+        cursor = self.collection.find({"ancestors": id}, projection(fields))
+        return async_generator(cursor, deserialize_db_event)
+
+    async def get_tree(self, id, traversal="bfs", fields=None):
+        """
+        build the impact tree rooted at id, using one of TRAVERSALS.
+
+        with fields, only what is needed to return those public fields
+        of the descendants is read, see projection. The root is always
+        read whole.
+        """
+        _check_traversal(traversal)
+        if self.cache is None:
+            return await self._get_tree(id, traversal, fields)
+        key = "tree:{0}:{1}".format(traversal, id)
+        data = self.cache.get(key)
+        if data is not None:
+            events = [deserialize_db_event(doc) for doc in bson.decode(data)["events"]]
+            return build_tree(events[0], events[1:])
+        if fields:
+            # only whole trees are cached.
+            return await self._get_tree(id, traversal, fields)
+        token = self.cache.token()
+        tree = await self._get_tree(id, traversal)
+        events = flatten_tree(tree)
+        if len(events) <= MAX_CACHED_EVENTS:
+            # the tree changes when any of its events does, or when
+            # a new event is written below any of them.
+            self.cache.set(
+                key,
+                bson.encode({"events": [serialize_to_db_event(e) for e in events]}),
+                token, depends_on=[event.id for event in events])
+        return tree
+
+    async def _get_tree(self, id, traversal, fields=None):
+        if traversal == "graph_lookup":
+            return await self._get_tree_with_graph_lookup(id, fields)
+        if traversal == "ancestors":
+            return await self._get_tree_with_ancestors(id, fields)
+        if traversal == "source_id":
+            return await self._get_tree_with_source_id(id, fields)
+        return await self._get_tree_by_level(id, fields)
+
+    async def _get_tree_by_level(self, id, fields=None):
+        """
+        the tree is walked one depth level at a time: the children of
+        every node in the current frontier are fetched with a single
+        query, so the number of round trips grows with the depth of the
+        tree rather than the number of events in it.
+        """
         root_event = await self.find_by_id(id)
         root_event_node = EventNode(event=root_event)
-        queue = q.Queue()
-        queue.put(root_event_node)
-        while not queue.empty():
-            event_node = queue.get()
-            children = await self.find_by_parent_id(event_node.event.id)
+        visited = {root_event.id}
+        frontier = {root_event.id: root_event_node}
+        while frontier:
+            next_frontier = {}
+            children = await self.find_by_parent_ids(list(frontier), fields)
             async for child in children:
+                # an event already in the tree can only be reached
+                # again through a cycle in the parent ids.
+                if child.id in visited:
+                    continue
+                visited.add(child.id)
                 child_node = EventNode(event=child)
-                if child_node not in event_node.children:
-                    event_node.children.append(child_node)
-                queue.put(child_node)
+                frontier[child.parent_id].children.append(child_node)
+                next_frontier[child.id] = child_node
+            frontier = next_frontier
         return root_event_node
 
-    async def trace(self, event_id):
+    async def _get_tree_with_graph_lookup(self, id, fields=None):
+        """
+        MongoDB collects every descendant of the root in a single
+        aggregation, and the tree is assembled from them in memory.
+        Siblings are ordered by their start time.
+        """
+        root_event = await self.find_by_id(id)
+        pipeline = [
+            {"$match": {"_id": root_event.id}},
+            {"$graphLookup": {
+                "from": self.collection.name,
+                "startWith": "$_id",
+                "connectFromField": "_id",
+                "connectToField": "parent_id",
+                "as": "descendant",
+            }},
+            # unwinding straight after the $graphLookup lets MongoDB
+            # stream the descendants, rather than collecting them into
+            # a single document bound by the 16MB document limit.
+            {"$unwind": "$descendant"},
+            {"$replaceRoot": {"newRoot": "$descendant"}},
+            {"$sort": {"time": 1, "_id": 1}},
+        ]
+        if fields:
+            pipeline.append({"$project": projection(fields)})
+        cursor = self.collection.aggregate(pipeline, allowDiskUse=True)
+        descendants = []
+        async for doc in cursor:
+            descendants.append(deserialize_db_event(doc))
+        return build_tree(root_event, descendants)
+
+    async def _get_tree_with_ancestors(self, id, fields=None):
+        """
+        every descendant of the root is fetched with a single query
+        against the materialized ancestors, and the tree is assembled
+        from them in memory. Siblings are ordered by their start time.
+        """
+        root_event = await self.find_by_id(id)
+        descendants = []
+        async for event in await self.find_descendants(root_event.id, fields):
+            descendants.append(event)
+        descendants.sort(key=lambda event: (event.start_time, event.id))
+        return build_tree(root_event, descendants)
+
+    async def find_by_source_id(self, source_id, fields=None):
+        """
+        return the source event and every event that shares its source id.
+        """
+        cursor = self.collection.find({"$or": [
+            {"_id": source_id},
+            {"tags": "source_id:{0}".format(source_id)},
+        ]}, projection(fields))
+        return async_generator(cursor, deserialize_db_event)
+
+    async def _get_tree_with_source_id(self, id, fields=None):
+        """
+        every event sharing the source id of the root is fetched with
+        a single query, and the tree is assembled from them in memory.
+        Descendants that carry a different source id are not included.
+        """
+        root_event = await self.find_by_id(id)
+        family = []
+        async for event in await self.find_by_source_id(
+                root_event.source_id or root_event.id, fields):
+            family.append(event)
+        return build_tree(root_event, family)
+
+    async def trace(self, event_id, traversal="bfs"):
         """ return back the root-level parent id of the event """
+        _check_traversal(traversal)
+        if traversal == "graph_lookup":
+            return await self._trace_with_graph_lookup(event_id)
+        if traversal == "ancestors":
+            return await self._trace_with_ancestors(event_id)
+        if traversal == "source_id":
+            return await self._trace_with_source_id(event_id)
+        return await self._trace_by_walk(event_id)
+
+    async def _trace_by_walk(self, event_id):
         result = []
 
         currId = event_id
@@ -147,8 +878,175 @@ class Event:
                 currId = None
         return result
 
+    async def _trace_with_graph_lookup(self, event_id):
+        """
+        fetch the event and all of its ancestors with a single aggregation.
+        """
+        pipeline = [
+            {"$match": {"_id": event_id}},
+            {"$graphLookup": {
+                "from": self.collection.name,
+                "startWith": "$parent_id",
+                "connectFromField": "parent_id",
+                "connectToField": "_id",
+                "as": "lineage",
+                "depthField": "distance",
+                # the event itself takes up one level of the trace.
+                "maxDepth": MAX_RECURSIVE_DEPTH - 2,
+            }},
+        ]
+        result = []
+        async for doc in self.collection.aggregate(pipeline):
+            lineage = sorted(doc.pop("lineage"), key=lambda d: d["distance"])
+            result.append(deserialize_db_event(doc))
+            result.extend(deserialize_db_event(d) for d in lineage)
+        return result
+
+    async def _trace_with_ancestors(self, event_id):
+        """
+        fetch the event, then all of its ancestors with a single
+        lookup of the ids materialized on the event.
+        """
+        document = await self.collection.find_one({"_id": event_id})
+        if document is None:
+            return []
+        if "ancestors" not in document:
+            # stored before ancestors were materialized.
+            return await self._trace_by_walk(event_id)
+        ancestors_by_id = {}
+        cursor = self.collection.find({"_id": {"$in": document["ancestors"]}})
+        async for ancestor in cursor:
+            ancestors_by_id[ancestor["_id"]] = ancestor
+        result = [deserialize_db_event(document)]
+        for ancestor_id in reversed(document["ancestors"]):
+            # like the walk, the trace ends at the first missing parent.
+            if ancestor_id not in ancestors_by_id:
+                break
+            result.append(deserialize_db_event(ancestors_by_id[ancestor_id]))
+        return result
+
+    async def _trace_with_source_id(self, event_id):
+        """
+        fetch the event, then every event sharing its source id with a
+        single query, and follow the parent ids in memory. Parents
+        outside of that family are looked up one at a time.
+        """
+        try:
+            event = await self.find_by_id(event_id)
+        except HTTPNotFound:
+            return []
+        family = {}
+        if event.source_id:
+            async for member in await self.find_by_source_id(event.source_id):
+                family[member.id] = member
+        result = [event]
+        while event.parent_id and len(result) < MAX_RECURSIVE_DEPTH:
+            if event.parent_id in family:
+                event = family[event.parent_id]
+            else:
+                try:
+                    event = await self.find_by_id(event.parent_id)
+                except HTTPNotFound:
+                    break
+            result.append(event)
+        return result
+
     async def delete_by_id(self, id) -> bool:
         """ deletes event with provided id and returns True otherwise False"""
-        result_map = {0: False, 1: True, None: False}
-        result = await self.collection.delete_one({"_id": id})
-        return result_map[result.deleted_count]
+        doc = await self.collection.find_one_and_delete(
+            {"_id": id}, {"tags": 1, "parent_id": 1, "ancestors": 1})
+        self._invalidate(id)
+        if doc is None:
+            return False
+        await self.deletions.record(doc, with_tag_kv=self.tag_kv)
+        return True
+
+    async def find_changes(self, query, since, count=0, fields=None, after=None):
+        """
+        return the events matching query written at or after since,
+        oldest first, and the ids of the ones deleted since. Also return
+        the time to pass as since to get the changes that follow.
+
+        That time is a little before the changes were read, so that
+        writes still in flight are not missed: clients may see the same
+        change twice. When count events are returned, it is the time
+        of the last one instead, and only the deletions up to then are
+        returned. The cursor to pass as after, along with that time, is
+        then returned as well, so that the next page starts right after
+        the last event even when many events share its update_time.
+        """
+        if since.tzinfo is not None:
+            # times are stored as naive UTC.
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        if not self.deletions.remembers(since):
+            raise ValueError(
+                "since must be at most {0} days ago.".format(RETENTION.days))
+        until = datetime.utcnow() - CHANGES_OVERLAP
+        changed_query = dict(query)
+        if after is not None:
+            changed_query.update(changes_after_query(after))
+        else:
+            changed_query["update_time"] = {"$gte": since}
+        cursor = (
+            self.collection.find(changed_query, projection(fields))
+            .sort([("update_time", 1), ("_id", 1)])
+            .limit(count)
+        )
+        docs = []
+        async for doc in cursor:
+            docs.append(doc)
+        next_after = None
+        if count and len(docs) == count:
+            until = docs[-1]["update_time"]
+            next_after = encode_changes_after(docs[-1])
+
+        # like events, deletions are read up to now, unless the page
+        # is full: the ones after the last event come with the next page.
+        deleted_until = until if next_after is not None else None
+        update_times = {doc["_id"]: doc["update_time"] for doc in docs}
+        deleted = []
+        async for tombstone in await self.deletions.find(query, since, deleted_until):
+            # an event deleted and then written again only counts as written.
+            if update_times.get(tombstone["_id"], tombstone["time"]) <= tombstone["time"]:
+                deleted.append(tombstone["_id"])
+        return [deserialize_db_event(doc) for doc in docs], deleted, until, next_after
+
+
+def _check_traversal(traversal):
+    if traversal not in TRAVERSALS:
+        raise ValueError("traversal must be one of {0}, {1} passed".format(
+            ", ".join(TRAVERSALS), traversal))
+
+
+def _lineage_ids(docs):
+    return [id for doc in docs for id in lineage_ids(doc)]
+
+
+def _occurrences(docs):
+    """
+    returns the indexes of the first DB event of every id, then of the
+    second one of the ids sent more than once, and so on.
+    """
+    rounds = []
+    seen = {}
+    for i, doc in enumerate(docs):
+        occurrence = seen.get(doc["_id"], 0)
+        seen[doc["_id"]] = occurrence + 1
+        if occurrence == len(rounds):
+            rounds.append([])
+        rounds[occurrence].append(i)
+    return rounds
+
+
+def _unapplied_count(details, count):
+    """
+    returns how many of the count updates of a bulk write matched no
+    event, and inserted none either.
+    """
+    return count - len(details["writeErrors"]) - details["nMatched"] - details["nUpserted"]
+
+
+def _digest(summary):
+    return hashlib.sha1("{0}:{1}:{2}".format(
+        summary["count"], summary["update_time"], summary["versions"]
+    ).encode("utf-8")).hexdigest()
@@ -0,0 +1,84 @@
+from typing import Dict, List
+
+
+def resolve_ancestors(doc: Dict, docs_by_id: Dict, stored_ancestors: Dict,
+                      max_length: int) -> List[str]:
+    """
+    Returns the ids of the ancestors of a DB event, root first.
+
+    Parents that are being written together with doc are looked up in
+    docs_by_id, while parents already in the database contribute their
+    own materialized ancestors through stored_ancestors. A parent that
+    does not exist yet only contributes its id: its ancestors are filled
+    in once it is written (see repair_descendants_pipeline).
+    """
+    lineage = []
+    parent_id = doc.get("parent_id")
+    while parent_id and parent_id != doc["_id"] and parent_id not in lineage:
+        lineage.append(parent_id)
+        if parent_id in docs_by_id:
+            parent_id = docs_by_id[parent_id].get("parent_id")
+            continue
+        for ancestor_id in reversed(stored_ancestors.get(parent_id, [])):
+            # an ancestor that is already part of the lineage
+            # can only be reached again through a cycle.
+            if ancestor_id == doc["_id"] or ancestor_id in lineage:
+                break
+            lineage.append(ancestor_id)
+        break
+    return list(reversed(lineage[:max_length]))
+
+
+def repair_descendants_filter(doc: Dict, max_length: int) -> Dict:
+    """
+    Returns the query on the descendants of doc whose ancestors do not
+    start with the ones doc was just written with, and so need the
+    repair_descendants_pipeline.
+    """
+    prefix = doc["ancestors"] + [doc["_id"]]
+    query = {"ancestors": doc["_id"]}
+    if len(prefix) <= max_length:
+        query["$nor"] = [{
+            "ancestors.{0}".format(index): ancestor_id
+            for index, ancestor_id in enumerate(prefix)
+        }]
+    return query
+
+
+def repair_descendants_pipeline(doc: Dict, max_length: int) -> List[Dict]:
+    """
+    Returns the update pipeline that rewrites the ancestors of the
+    descendants of doc, so that everything above doc matches the
+    ancestors doc was just written with.
+    """
+    prefix = doc["ancestors"] + [doc["_id"]]
+    below = {"$slice": [
+        "$ancestors",
+        {"$add": [
+            {"$indexOfArray": ["$ancestors", {"$literal": doc["_id"]}]}, 1
+        ]},
+        max_length,
+    ]}
+    ancestors = {"$slice": [
+        {"$concatArrays": [{"$literal": prefix}, below]}, -max_length
+    ]}
+    return [
+        {"$set": {"ancestors": ancestors}},
+        # a cycle in the parent ids can lead a document back to itself.
+        {"$set": {"ancestors": {"$filter": {
+            "input": "$ancestors", "cond": {"$ne": ["$$this", "$_id"]}
+        }}}},
+        {"$set": {"depth": {"$size": "$ancestors"}}},
+    ]
+
+
+def lineage_ids(doc: Dict) -> List[str]:
+    """
+    Returns the ids of a DB event and of every event above it: the
+    events whose children or impact tree change when doc is written.
+    """
+    ids = [doc["_id"]]
+    if doc.get("parent_id"):
+        ids.append(doc["parent_id"])
+    ids.extend(doc.get("ancestors", []))
+    return ids
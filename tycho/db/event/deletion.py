@@ -0,0 +1,71 @@
+import pymongo
+from datetime import datetime, timedelta
+from typing import Dict
+
+from ..utils import async_generator
+from .tag_kv import tag_kv
+
+# how long deleted events are remembered for.
+RETENTION = timedelta(days=7)
+
+
+class EventDeletion:
+    """
+    Tycho keeps a tombstone of every deleted event for a while, so that
+    clients asking for the events changed since some time also learn
+    about the ones deleted since. MongoDB removes tombstones once they
+    are older than RETENTION.
+
+    Tombstones keep the fields events are queried by, so that the same
+    queries select the events and the tombstones.
+    """
+
+    _collection = "event_deletion"
+
+    indexes = [
+        {"unique": False, "keys": [("time", pymongo.ASCENDING)],
+         "expireAfterSeconds": int(RETENTION.total_seconds())},
+        {"unique": False, "keys": [("tags", pymongo.ASCENDING)]},
+        {"unique": False, "keys": [("parent_id", pymongo.ASCENDING)]},
+        {"unique": False, "keys": [("ancestors", pymongo.ASCENDING)]},
+        # sparse, as tombstones only have tag_kv once it is enabled.
+        {"unique": False, "sparse": True, "keys": [("tag_kv.k", pymongo.ASCENDING),
+                                                   ("tag_kv.v", pymongo.ASCENDING)]},
+    ]
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def record(self, doc: Dict, with_tag_kv: bool = False):
+        """
+        remember that the DB event doc was just deleted, along with
+        its tags as tag_kv when with_tag_kv is set.
+        """
+        tombstone = {
+            "tags": doc.get("tags", []),
+            "parent_id": doc.get("parent_id", ""),
+            "ancestors": doc.get("ancestors", []),
+            "time": datetime.utcnow(),
+        }
+        if with_tag_kv:
+            # computed from the tags, as the event may not have it yet.
+            tombstone["tag_kv"] = tag_kv(tombstone["tags"])
+        await self.collection.replace_one({"_id": doc["_id"]}, tombstone, upsert=True)
+
+    async def find(self, query: Dict, frm: datetime, to: datetime = None):
+        """
+        return the tombstones matching query of the events
+        deleted since frm, and up to to when it is passed.
+        """
+        time = {"$gte": frm}
+        if to is not None:
+            time["$lte"] = to
+        cursor = self.collection.find(dict(query, time=time), {"time": 1})
+        return async_generator(cursor, lambda doc: doc)
+
+    @staticmethod
+    def remembers(time: datetime) -> bool:
+        """
+        whether every deletion since time is still remembered.
+        """
+        return time >= datetime.utcnow() - RETENTION
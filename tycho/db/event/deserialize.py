@@ -1,16 +1,46 @@
+import pytz
+from datetime import datetime
 from typing import Dict, List
 
-from ...models.event import Event, DOT_CONSTANT, DOT_CONVERTER
+from ...models.event import (
+    Event, DOT_CONSTANT, DOT_CONVERTER, ignore_microseconds)
 
 _reserved_fields_in_eventdb_tag = {
     "source_id", "parent_id"
 }
 
 
-def deserialize_db_event(eventdb: Dict) -> Event:
+def deserialize_db_event(eventdb: Dict, trusted: bool = True) -> Event:
     """
     Transforms DB event format to Public event format
+
+    Events are validated and normalized when they are written, so the
+    ones read back are trusted by default: they are built without
+    running the validators and converters of Event again. Pass
+    trusted=False to run them.
     """
+    if not trusted or not eventdb or "_id" not in eventdb or not eventdb.get("time"):
+        # the defaults of Event are needed.
+        return Event(**_extract_fields(eventdb))
+
+    fields = _extract_tags(eventdb.get("tags"))
+    times = _extract_time(eventdb["time"])
+    detail_urls = eventdb.get("detail_urls", {})
+    if any(DOT_CONVERTER in key for key in detail_urls):
+        detail_urls = _extract_detail_urls(detail_urls)
+    return Event.from_trusted(
+        id=str(eventdb["_id"]),
+        source_id=fields.get("source_id", ""),
+        parent_id=fields.get("parent_id", ""),
+        start_time=_utc(times["start_time"]),
+        end_time=_utc(times["end_time"]),
+        description=eventdb.get("description", ""),
+        detail_urls=dict(detail_urls),
+        tags=fields.get("tags", {}),
+    )
+
+
+def _extract_fields(eventdb: Dict) -> Dict:
     new_event = {}
 
     if eventdb:
@@ -25,37 +55,52 @@ def deserialize_db_event(eventdb: Dict) -> Event:
             new_event["id"] = str(eventdb["_id"])
 
         if "detail_urls" in eventdb:
-            new_event["detail_urls"] = {}
-            for key, value in eventdb["detail_urls"].items():
-                key = key.replace(DOT_CONVERTER, DOT_CONSTANT)
-                new_event["detail_urls"][key] = value
+            new_event["detail_urls"] = _extract_detail_urls(eventdb["detail_urls"])
 
         if "description" in eventdb:
             new_event["description"] = eventdb["description"]
 
-    return Event(**new_event)
+    return new_event
+
+
+def _extract_detail_urls(detail_urls: Dict) -> Dict:
+    return {key.replace(DOT_CONVERTER, DOT_CONSTANT): value
+            for key, value in detail_urls.items()}
+
+
+def _utc(value: datetime) -> datetime:
+    """
+    MongoDB stores times in UTC, to the millisecond, so the ones it
+    returns only need a timezone. Other times are normalized by Event.
+    """
+    if value.tzinfo is None and value.microsecond % 1000 == 0:
+        return value.replace(tzinfo=pytz.utc)
+    return ignore_microseconds(value)
 
 
 def _extract_tags(tags: Dict) -> Dict:
     """
-    Transforms list of key-value pair as strings to a
-    dictionary of key-value pairs.
+    Transforms list of key-value pair as strings, or as {k, v}
+    subdocuments, to a dictionary of key-value pairs.
     """
     new_event = {}
     tagged_fields = {}
 
     if tags:
         for doc in tags:
-            key, value = doc.split(':', 1)
+            if isinstance(doc, str):
+                key, value = doc.split(':', 1)
+            else:
+                key, value = doc["k"], doc["v"]
             # not a tag key
             if key in _reserved_fields_in_eventdb_tag:
                 new_event[key] = value
-            # key already present, no need to initialize.
             else:
-                if key in tagged_fields:
-                    tagged_fields[key].append(value)
-                else:
+                values = tagged_fields.get(key)
+                if values is None:
                     tagged_fields[key] = [value]
+                else:
+                    values.append(value)
 
     if len(tagged_fields) > 0:
         new_event["tags"] = tagged_fields
@@ -0,0 +1,74 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Dict, Tuple
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+# the field of the cursors of find_changes, which can not be passed
+# to the listings sorted on update_time in descending order.
+CHANGES = "changes"
+
+
+def encode_after(document: Dict, time_field: str) -> str:
+    """
+    Returns an opaque cursor pointing right after a DB event, for
+    listings sorted on time_field and _id in descending order.
+    """
+    value = document[time_field]
+    if isinstance(value, list):
+        # descending sorts on an array use its largest element.
+        value = max(value)
+    return _encode(time_field, value, document["_id"])
+
+
+def _encode(field: str, value: datetime, id: str) -> str:
+    cursor = {"f": field, "t": value.strftime(TIME_FORMAT), "id": id}
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+
+
+def decode_after(after: str, time_field: str) -> Tuple[datetime, str]:
+    """
+    Returns the sort key a cursor returned by encode_after points to.
+    """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(after.encode("ascii")))
+        value = datetime.strptime(cursor["t"], TIME_FORMAT)
+        id = cursor["id"]
+        field = cursor["f"]
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError):
+        raise ValueError("after is not a valid cursor: {0}".format(after))
+    if field != time_field:
+        raise ValueError("after cursor was not created for a {0} listing".format(time_field))
+    return value, id
+
+
+def after_query(after: str, time_field: str) -> Tuple[Dict, Dict]:
+    """
+    Returns the conditions on time_field and the top-level query that
+    select the events sorted after the cursor.
+    """
+    value, id = decode_after(after, time_field)
+    # the events whose sort key is at most the cursor's, except the
+    # ones sharing the cursor's sort key that were already returned.
+    # for the multikey time field, the sort key is the latest time,
+    # so none of the times may be after the cursor.
+    return {"$not": {"$gt": value}}, {"$nor": [{time_field: value, "_id": {"$gte": id}}]}
+
+
+def encode_changes_after(document: Dict) -> str:
+    """
+    Returns an opaque cursor pointing right after a DB event, for
+    changes sorted on update_time and _id in ascending order.
+    """
+    return _encode(CHANGES, document["update_time"], document["_id"])
+
+
+def changes_after_query(after: str) -> Dict:
+    """
+    Returns the query that selects the changes sorted after the
+    cursor, including the ones sharing its update_time.
+    """
+    value, id = decode_after(after, CHANGES)
+    return {"update_time": {"$gte": value},
+            "$nor": [{"update_time": value, "_id": {"$lte": id}}]}
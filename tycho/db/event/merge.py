@@ -0,0 +1,128 @@
+import re
+from typing import Dict, List
+
+from ...models.event import Event
+from .tag_kv import tag_kv_expression
+from .tag_time import tag_time_expression
+from .version import next_version
+
+# only the reserved keys set on the new event are compared.
+_reserved_fields_in_eventdb_tag = ["source_id", "parent_id"]
+
+
+def merge_filter(event: Event) -> Dict:
+    """
+    Returns the conditions a stored event must meet to be merged with
+    event: reserved keys set on both must have the same value.
+    """
+    conditions = []
+    for key in _reserved_fields_in_eventdb_tag:
+        value = getattr(event, key)
+        if value:
+            conditions.append({"$or": [
+                {"tags": "{0}:{1}".format(key, value)},
+                {"tags": {"$not": re.compile("^{0}:".format(key))}},
+            ]})
+    return {"$and": conditions} if conditions else {}
+
+
+def merge_matches(stored_tags: List[str], event: Event) -> bool:
+    """
+    Returns whether a stored event with stored_tags meets merge_filter.
+    """
+    for key in _reserved_fields_in_eventdb_tag:
+        value = getattr(event, key)
+        if value and "{0}:{1}".format(key, value) not in stored_tags and any(
+                tag.startswith("{0}:".format(key)) for tag in stored_tags):
+            return False
+    return True
+
+
+def merge_pipeline(new_db_event: Dict) -> List[Dict]:
+    """
+    Returns the update pipeline that merges a DB event into the
+    stored one:
+
+    - the start time is the earliest of the two, and the end time the latest
+    - the new description is appended, unless it is already part of it
+    - detail urls are overlaid with the new ones
+    - tags are the union of both
+
+    Every expression of the first stage reads the stored event as it
+    was before the update, and the second one pairs the merged tags
+    and times, and splits the merged tags into keys and values, for
+    those of tag_time and tag_kv the DB event has. The others are
+    removed, as they would no longer match the tags.
+
+    The whole merge is applied atomically. When the event does not
+    exist yet, the result is the new event itself.
+    """
+    time = new_db_event["time"]
+    no_parent = {"$eq": [{"$ifNull": ["$parent_id", ""]}, ""]}
+    return [{"$set": {
+        "time": [
+            {"$min": [{"$arrayElemAt": ["$time", 0]}, _literal(time[0])]},
+            {"$max": [{"$arrayElemAt": ["$time", -1]}, _literal(time[-1])]},
+        ],
+        "description": _merge_description(new_db_event.get("description", "")),
+        "detail_urls": {"$mergeObjects": [
+            {"$ifNull": ["$detail_urls", {}]},
+            _literal(new_db_event.get("detail_urls", {})),
+        ]},
+        "tags": {"$concatArrays": [
+            {"$ifNull": ["$tags", []]},
+            {"$filter": {
+                "input": _literal(new_db_event["tags"]),
+                "cond": {"$not": [{"$in": ["$$this", {"$ifNull": ["$tags", []]}]}]},
+            }},
+        ]},
+        # the parent, and with it the ancestors, can only be set
+        # on a stored event that did not have one yet.
+        "parent_id": {"$cond": [
+            no_parent, _literal(new_db_event["parent_id"]), "$parent_id"
+        ]},
+        "ancestors": {"$cond": [
+            no_parent,
+            _literal(new_db_event["ancestors"]),
+            {"$ifNull": ["$ancestors", _literal(new_db_event["ancestors"])]},
+        ]},
+        "depth": {"$cond": [
+            no_parent,
+            new_db_event["depth"],
+            {"$ifNull": ["$depth", new_db_event["depth"]]},
+        ]},
+        "update_time": _literal(new_db_event["update_time"]),
+        "version": next_version(),
+    }}] + _derived_fields(new_db_event)
+
+
+def _derived_fields(new_db_event: Dict) -> List[Dict]:
+    expressions = {"tag_time": tag_time_expression, "tag_kv": tag_kv_expression}
+    stored = {field: expression() for field, expression in expressions.items()
+              if field in new_db_event}
+    removed = [field for field in expressions if field not in stored]
+    return ([{"$set": stored}] if stored else []) + \
+        ([{"$unset": removed}] if removed else [])
+
+
+def _merge_description(description: str) -> Dict:
+    existing = {"$ifNull": ["$description", ""]}
+    if not description:
+        return existing
+    stripped = description.strip()
+    if not stripped:
+        merged = existing
+    else:
+        existing_stripped = {"$trim": {"input": existing}}
+        merged = {"$cond": [
+            {"$eq": [{"$indexOfCP": [existing_stripped, _literal(stripped)]}, -1]},
+            # Adding new line as a separator of events description
+            {"$concat": [existing_stripped, "\n", _literal(stripped)]},
+            existing,
+        ]}
+    return {"$cond": [{"$eq": [existing, ""]}, _literal(description), merged]}
+
+
+def _literal(value):
+    # values starting with a $ would otherwise be read as field paths.
+    return {"$literal": value}
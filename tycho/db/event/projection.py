@@ -0,0 +1,64 @@
+from typing import Dict, List, Optional
+
+# the fields of a public event, and the DB fields they are read from.
+# the source and parent ids are read from the tags, see projection.
+EVENT_FIELDS = {
+    "id": [],
+    "parent_id": [],
+    "start_time": [],
+    "end_time": [],
+    "source_id": [],
+    "description": ["description"],
+    "detail_urls": ["detail_urls"],
+    "tags": ["tags"],
+}
+# prefix of the fields selecting a single tag key, e.g. tags.environment.
+TAG_FIELD_PREFIX = "tags."
+
+# always read: sorting and paging rely on them.
+REQUIRED_PROJECTION = {"_id": 1, "time": 1, "update_time": 1}
+# the parent id is always read from the tags as well, as trees are
+# assembled from it.
+REQUIRED_TAG_PREFIXES = ["parent_id:"]
+
+
+def check_fields(fields: List[str]):
+    for field in fields:
+        if field in EVENT_FIELDS:
+            continue
+        if field.startswith(TAG_FIELD_PREFIX) and len(field) > len(TAG_FIELD_PREFIX):
+            continue
+        raise ValueError("fields must be among {0}, or tags.<key>: {1} passed".format(
+            ", ".join(EVENT_FIELDS), field))
+
+
+def projection(fields: Optional[List[str]]) -> Optional[Dict]:
+    """
+    returns the MongoDB projection reading only what is needed to
+    return the public fields of the events, or None to read them whole.
+
+    Tags are stored as a single array, so selecting a few tag keys, or
+    the source id, reads the matching elements of that array only.
+    """
+    if not fields:
+        return None
+    check_fields(fields)
+    result = dict(REQUIRED_PROJECTION)
+    for field in fields:
+        for db_field in EVENT_FIELDS.get(field, []):
+            result[db_field] = 1
+    if "tags" in result:
+        return result
+    prefixes = list(REQUIRED_TAG_PREFIXES)
+    prefixes.extend("{0}:".format(field[len(TAG_FIELD_PREFIX):])
+                    for field in fields if field.startswith(TAG_FIELD_PREFIX))
+    if "source_id" in fields:
+        prefixes.append("source_id:")
+    result["tags"] = {"$filter": {
+        "input": {"$ifNull": ["$tags", []]},
+        "cond": {"$or": [
+            {"$eq": [{"$substrCP": ["$$this", 0, len(prefix)]}, prefix]}
+            for prefix in prefixes
+        ]},
+    }}
+    return result
@@ -2,12 +2,17 @@ from datetime import datetime
 from typing import Dict, List
 
 from ...models.event import Event, DOT_CONVERTER, DOT_CONSTANT
+from .tag_kv import tag_kv
+from .tag_time import tag_time
 
 
-def serialize_to_db_event(event: Event) -> Dict:
+def serialize_to_db_event(event: Event, with_tag_time: bool = False,
+                          with_tag_kv: bool = False) -> Dict:
     """
     Transforms public event format to DB event format.
     Ignores key and value with NoneType.
+    The tag_time and tag_kv fields are only added when with_tag_time
+    and with_tag_kv are set, see Storage in tycho.models.config.
     """
 
     new_event = {}
@@ -22,6 +27,14 @@ def serialize_to_db_event(event: Event) -> Dict:
             new_event["tags"].append(
                 "{key}:{value}".format(key=key, value=getattr(event, key)))
 
+    # stored outside of the tags as well, so that $graphLookup
+    # can follow parent-child relationships.
+    new_event["parent_id"] = event.parent_id
+
+    if with_tag_kv:
+        # the same tags, as {k, v} subdocuments.
+        new_event["tag_kv"] = tag_kv(new_event["tags"])
+
     if event.id is not None:
         new_event["_id"] = str(event.id)
 
@@ -31,6 +44,9 @@ def serialize_to_db_event(event: Event) -> Dict:
         if getattr(event, key) is not None:
             new_event["time"].append(getattr(event, key))
 
+    if with_tag_time:
+        new_event["tag_time"] = tag_time(new_event["tags"], new_event["time"])
+
     if getattr(event, "description") is not None:
         new_event["description"] = event.description
 
@@ -42,6 +58,9 @@ def serialize_to_db_event(event: Event) -> Dict:
 
     new_event["update_time"] = datetime.utcnow()
 
+    # the version of a new event, see tycho.db.event.version.
+    new_event["version"] = 1
+
     return new_event
 
 
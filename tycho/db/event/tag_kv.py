@@ -0,0 +1,70 @@
+import re
+from typing import Dict, List, Tuple
+
+from ...models.eventdb import tag_kv
+
+__all__ = ["tag_kv", "tag_kv_expression", "tag_kv_query", "tags_query",
+           "prefix_regex", "split_tag"]
+
+
+def split_tag(tag: str) -> Tuple[str, str]:
+    """
+    Returns the key and value of a key:value tag.
+    """
+    key, separator, value = tag.partition(":")
+    if not separator:
+        raise ValueError("tags must be formatted as key:value: {0} passed".format(tag))
+    return key, value
+
+
+def prefix_regex(prefix: str):
+    """
+    Returns the anchored regular expression matching the strings
+    starting with prefix, which MongoDB bounds on the index.
+    """
+    return re.compile("^" + re.escape(prefix))
+
+
+def tag_kv_expression() -> Dict:
+    """
+    Returns the aggregation expression computing the tag_kv field
+    from the tags field of a stored event, the same way tag_kv does.
+    """
+    return {"$map": {"input": {"$ifNull": ["$tags", []]}, "in": {"$let": {
+        "vars": {"separator": {"$indexOfCP": ["$$this", ":"]}},
+        "in": {
+            "k": {"$substrCP": ["$$this", 0, "$$separator"]},
+            "v": {"$substrCP": [
+                "$$this",
+                {"$add": ["$$separator", 1]},
+                {"$strLenCP": "$$this"},
+            ]},
+        },
+    }}}}
+
+
+def tag_kv_query(tags: List[str] = None, prefixes: List[str] = None) -> Dict:
+    """
+    Returns the query of events having all tags, and for every
+    key:prefix in prefixes, a value of that key starting with prefix.
+    Every condition is bounded on both the key and the value by the
+    tag_kv index.
+    """
+    conditions = []
+    for tag in tags or []:
+        key, value = split_tag(tag)
+        conditions.append({"$elemMatch": {"k": key, "v": value}})
+    for prefix in prefixes or []:
+        key, value = split_tag(prefix)
+        conditions.append({"$elemMatch": {"k": key, "v": prefix_regex(value)}})
+    return {"tag_kv": {"$all": conditions}}
+
+
+def tags_query(tags: List[str] = None, prefixes: List[str] = None) -> Dict:
+    """
+    Returns the same query as tag_kv_query, on the tags field.
+    """
+    for prefix in prefixes or []:
+        split_tag(prefix)
+    return {"tags": {"$all": list(tags or []) + [
+        prefix_regex(prefix) for prefix in prefixes or []]}}
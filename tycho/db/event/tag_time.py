@@ -0,0 +1,43 @@
+from datetime import datetime
+from typing import Dict, List
+
+from ...models.eventdb import tag_time
+from .tag_kv import prefix_regex, split_tag
+
+__all__ = ["tag_time", "tag_time_expression", "tag_time_query"]
+
+
+def tag_time_expression() -> Dict:
+    """
+    Returns the aggregation expression computing the tag_time field
+    from the tags and time fields of a stored event, the same way
+    tag_time does, up to the order of the pairs.
+    """
+    tags = {"$ifNull": ["$tags", []]}
+    return {"$setUnion": [
+        {"$map": {"input": tags, "in": {
+            "t": "$$this", "time": {"$arrayElemAt": ["$time", 0]}}}},
+        {"$map": {"input": tags, "in": {
+            "t": "$$this", "time": {"$arrayElemAt": ["$time", -1]}}}},
+    ]}
+
+
+def tag_time_query(tags: List[str], frm: datetime = None, to: datetime = None,
+                   prefixes: List[str] = None) -> Dict:
+    """
+    Returns the query of events having all tags, and a tag starting
+    with every key:prefix in prefixes, with a start or end time
+    between frm and to. It matches the same events as a $all on
+    the tags along with an $elemMatch on the time, but MongoDB bounds
+    the scan of the tag_time index on both the first tag and the time.
+    """
+    time = {}
+    if frm is not None:
+        time["$gte"] = frm
+    if to is not None:
+        time["$lt"] = to
+    conditions = [{"$elemMatch": {"t": tag, "time": time}} for tag in tags or []]
+    for prefix in prefixes or []:
+        split_tag(prefix)
+        conditions.append({"$elemMatch": {"t": prefix_regex(prefix), "time": time}})
+    return {"tag_time": {"$all": conditions}}
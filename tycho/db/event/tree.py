@@ -0,0 +1,50 @@
+from typing import Iterable, List
+
+from ...models.event import Event
+from ...models.eventnode import EventNode
+
+
+def build_tree(root_event: Event, events: Iterable[Event]) -> EventNode:
+    """
+    Assembles the impact tree of root_event from a flat collection of
+    its descendants. Children keep the order in which they appear in
+    events. Events that are not reachable from the root are ignored.
+    """
+    children_by_parent_id = {}
+    for event in events:
+        if event.parent_id:
+            children_by_parent_id.setdefault(event.parent_id, []).append(event)
+
+    root_event_node = EventNode(event=root_event)
+    visited = {root_event.id}
+    frontier = [root_event_node]
+    while frontier:
+        next_frontier = []
+        for event_node in frontier:
+            for child in children_by_parent_id.get(event_node.event.id, []):
+                # an event already in the tree can only be reached
+                # again through a cycle in the parent ids.
+                if child.id in visited:
+                    continue
+                visited.add(child.id)
+                child_node = EventNode(event=child)
+                event_node.children.append(child_node)
+                next_frontier.append(child_node)
+        frontier = next_frontier
+    return root_event_node
+
+
+def flatten_tree(root_event_node: EventNode) -> List[Event]:
+    """
+    Returns the events of a tree, level by level. build_tree
+    assembles the same tree back from them.
+    """
+    events = []
+    frontier = [root_event_node]
+    while frontier:
+        next_frontier = []
+        for event_node in frontier:
+            events.append(event_node.event)
+            next_frontier.extend(event_node.children)
+        frontier = next_frontier
+    return events
@@ -0,0 +1,44 @@
+from typing import Dict, List
+
+# the version of events written before versions were stored.
+UNVERSIONED = 0
+
+
+class VersionConflict(Exception):
+    """
+    raised when an event was written by someone else since
+    the version that was expected.
+    """
+
+    def __init__(self, id, version):
+        super().__init__(
+            "event {0} is no longer at version {1}".format(id, version))
+        self.id = id
+        self.version = version
+
+
+def version_filter(version: int) -> Dict:
+    """
+    Returns the query matching stored events at version.
+    """
+    if version == UNVERSIONED:
+        return {"version": {"$exists": False}}
+    return {"version": version}
+
+
+def next_version() -> Dict:
+    """
+    Returns the expression of the version following the one
+    of the stored event, for update pipelines.
+    """
+    return {"$add": [{"$ifNull": ["$version", UNVERSIONED]}, 1]}
+
+
+def replace_pipeline(doc: Dict) -> List[Dict]:
+    """
+    Returns the update pipeline that replaces the stored event
+    with doc, moving it to the next version.
+    """
+    return [{"$replaceWith": {"$mergeObjects": [
+        {"$literal": doc}, {"version": next_version()}
+    ]}}]
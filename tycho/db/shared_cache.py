@@ -0,0 +1,257 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Iterable
+
+from .. import metrics
+
+MAGIC = b"TYCHOC01"
+# magic, number of sets, ways per set, slot size, number of
+# generations, invalidation counter, epoch.
+_HEADER = struct.Struct("<8sIIIIQQ")
+HEADER_SIZE = 64
+_COUNTER_OFFSET = 24
+_EPOCH_OFFSET = 32
+_UINT64 = struct.Struct("<Q")
+# key hash, epoch, expiry, last use, value length, number of dependencies.
+_SLOT_HEADER = struct.Struct("<QQddII")
+# generation index, generation.
+_DEPENDENCY = struct.Struct("<IQ")
+
+WAYS = 8
+GENERATIONS = 65536
+
+
+class SharedCache:
+    """
+    A bounded cache of bytes, shared by every process on the host that
+    opens the same file. It has the same interface as
+    tycho.db.cache.LRUCache, so every gunicorn worker can read the
+    events, children lists and trees cached by the others, without
+    holding its own copy of them.
+
+    The file is memory-mapped and split into fixed-size slots, grouped
+    into sets of WAYS slots. A key can only be stored in the set its
+    hash points to, and the least recently used slot of the set is
+    evicted to make room for it. Values are compressed, and the ones
+    that do not fit in a slot are not cached. Sets are locked with
+    fcntl while they are read or written.
+
+    Rather than keeping track of the keys depending on each id,
+    invalidating an id increments a generation counter that the id
+    hashes to. Every value records the generations of its dependencies
+    when it is stored, and is dropped when it is read if any of them
+    changed since. Clearing the cache increments the epoch, which the
+    values record as well.
+    """
+
+    def __init__(self, path: str, size_bytes: int, slot_size: int,
+                 ttl_seconds: float, name: str = "cache", ways: int = WAYS,
+                 generations: int = GENERATIONS, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self.ways = ways
+        self.slot_size = slot_size
+        self.generations = generations
+        self.nsets = max(size_bytes // (slot_size * ways), 1)
+        self._clock = clock
+        self._sets_offset = HEADER_SIZE + generations * _UINT64.size
+        self._set_size = ways * slot_size
+        size = self._sets_offset + self.nsets * self._set_size
+        # processes configured differently use different files, so
+        # none of them ever resizes a file another one has mapped.
+        self.path = "{0}.{1}x{2}x{3}".format(path, self.nsets, ways, slot_size)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        header = _HEADER.pack(MAGIC, self.nsets, ways, slot_size, generations, 0, 0)
+        with self._locked(0, self._sets_offset):
+            if os.pread(self._fd, len(MAGIC), 0) != MAGIC or \
+                    os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, header, 0)
+        self._map = mmap.mmap(self._fd, size)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def __len__(self):
+        now = self._clock()
+        epoch = self._read_uint64(_EPOCH_OFFSET)
+        count = 0
+        for set_index in range(self.nsets):
+            for offset in self._slots(set_index):
+                key_hash, slot_epoch, expiry, _, _, _ = \
+                    _SLOT_HEADER.unpack_from(self._map, offset)
+                if key_hash and slot_epoch == epoch and expiry > now:
+                    count += 1
+        return count
+
+    def token(self) -> int:
+        with self._locked(0, self._sets_offset, shared=True):
+            return self._read_uint64(_COUNTER_OFFSET)
+
+    def get(self, key):
+        """
+        returns the value stored under key, or None.
+        """
+        key_hash = _hash(key)
+        set_index = key_hash % self.nsets
+        with self._locked_set(set_index):
+            for offset in self._slots(set_index):
+                slot_hash, epoch, expiry, _, length, ndeps = \
+                    _SLOT_HEADER.unpack_from(self._map, offset)
+                if slot_hash != key_hash:
+                    continue
+                if expiry <= self._clock():
+                    self._clear_slot(offset)
+                    self._count("expirations")
+                    break
+                if not self._is_current(offset, epoch, ndeps):
+                    self._clear_slot(offset)
+                    break
+                _SLOT_HEADER.pack_into(self._map, offset, slot_hash, epoch, expiry,
+                                       self._clock(), length, ndeps)
+                start = offset + _SLOT_HEADER.size + ndeps * _DEPENDENCY.size
+                value = zlib.decompress(self._map[start:start + length])
+                self._count("hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value: bytes, token: int = None, depends_on: Iterable = ()):
+        data = zlib.compress(value, 1)
+        indexes = sorted({_hash(id) % self.generations for id in depends_on})
+        if _SLOT_HEADER.size + len(indexes) * _DEPENDENCY.size + len(data) > self.slot_size:
+            self._count("too_large")
+            return
+        key_hash = _hash(key)
+        set_index = key_hash % self.nsets
+        with self._locked_set(set_index):
+            with self._locked(0, self._sets_offset, shared=True):
+                if token is not None and token != self._read_uint64(_COUNTER_OFFSET):
+                    return
+                epoch = self._read_uint64(_EPOCH_OFFSET)
+                dependencies = [(index, self._generation(index)) for index in indexes]
+            offset = self._find_slot(set_index, key_hash, epoch)
+            now = self._clock()
+            _SLOT_HEADER.pack_into(self._map, offset, key_hash, epoch,
+                                   now + self.ttl_seconds, now, len(data),
+                                   len(dependencies))
+            position = offset + _SLOT_HEADER.size
+            for index, generation in dependencies:
+                _DEPENDENCY.pack_into(self._map, position, index, generation)
+                position += _DEPENDENCY.size
+            self._map[position:position + len(data)] = data
+
+    def delete(self, *keys):
+        self._bump(_COUNTER_OFFSET)
+        for key in keys:
+            key_hash = _hash(key)
+            set_index = key_hash % self.nsets
+            with self._locked_set(set_index):
+                for offset in self._slots(set_index):
+                    if _UINT64.unpack_from(self._map, offset)[0] == key_hash:
+                        self._clear_slot(offset)
+
+    def invalidate(self, *ids):
+        """
+        drops the values depending on any of ids.
+        """
+        with self._locked(0, self._sets_offset):
+            self._increment(_COUNTER_OFFSET)
+            for id in ids:
+                self._increment(self._generation_offset(_hash(id) % self.generations))
+
+    def clear(self):
+        with self._locked(0, self._sets_offset):
+            self._increment(_COUNTER_OFFSET)
+            self._increment(_EPOCH_OFFSET)
+
+    def _find_slot(self, set_index, key_hash, epoch):
+        """
+        returns the slot to store key_hash in: the one already holding
+        it, a free one, or the least recently used one.
+        """
+        now = self._clock()
+        free = None
+        least_recently_used = None
+        oldest_use = None
+        for offset in self._slots(set_index):
+            slot_hash, slot_epoch, expiry, last_use, _, _ = \
+                _SLOT_HEADER.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset
+            if not slot_hash or slot_epoch != epoch or expiry <= now:
+                free = offset if free is None else free
+            elif oldest_use is None or last_use < oldest_use:
+                least_recently_used, oldest_use = offset, last_use
+        if free is not None:
+            return free
+        self._count("evictions")
+        return least_recently_used
+
+    def _is_current(self, offset, epoch, ndeps):
+        position = offset + _SLOT_HEADER.size
+        with self._locked(0, self._sets_offset, shared=True):
+            if epoch != self._read_uint64(_EPOCH_OFFSET):
+                return False
+            for _ in range(ndeps):
+                index, generation = _DEPENDENCY.unpack_from(self._map, position)
+                if self._generation(index) != generation:
+                    return False
+                position += _DEPENDENCY.size
+        return True
+
+    def _slots(self, set_index):
+        start = self._sets_offset + set_index * self._set_size
+        return range(start, start + self._set_size, self.slot_size)
+
+    def _clear_slot(self, offset):
+        _SLOT_HEADER.pack_into(self._map, offset, 0, 0, 0, 0, 0, 0)
+
+    def _generation_offset(self, index):
+        return HEADER_SIZE + index * _UINT64.size
+
+    def _generation(self, index):
+        return self._read_uint64(self._generation_offset(index))
+
+    def _read_uint64(self, offset):
+        return _UINT64.unpack_from(self._map, offset)[0]
+
+    def _increment(self, offset):
+        _UINT64.pack_into(self._map, offset, self._read_uint64(offset) + 1)
+
+    def _bump(self, offset):
+        with self._locked(0, self._sets_offset):
+            self._increment(offset)
+
+    @contextmanager
+    def _locked_set(self, set_index):
+        with self._locked(self._sets_offset + set_index * self._set_size,
+                          self._set_size):
+            yield
+
+    @contextmanager
+    def _locked(self, start, length, shared=False):
+        # sets are always locked before the header, never after.
+        fcntl.lockf(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX,
+                    length, start)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def _count(self, counter):
+        metrics.increment("{0}.{1}".format(self.name, counter))
+
+
+def _hash(key) -> int:
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    # 0 marks free slots.
+    return _UINT64.unpack(digest)[0] or 1
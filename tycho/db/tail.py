@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from typing import Dict, Iterable
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .. import metrics
+from .event.deserialize import deserialize_db_event
+from .watcher import RETRY_SECONDS
+
+LOG = logging.getLogger(__name__)
+
+# how many events can wait for a subscriber before it is dropped.
+QUEUE_SIZE = 1000
+
+CHANGE_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+    {"$project": {"fullDocument": 1}},
+]
+
+
+class Subscription:
+    """
+    The events written since a client subscribed, and matching all of
+    its tags. Read them with 'async for': the iteration ends when the
+    subscription is closed, or when the client falls too far behind.
+    """
+
+    def __init__(self, tags: Iterable[str] = (), queue_size: int = QUEUE_SIZE):
+        self.tags = set(tags)
+        self.overflowed = False
+        self._queue = asyncio.Queue(maxsize=queue_size)
+
+    def matches(self, tags: Iterable[str]) -> bool:
+        return self.tags.issubset(tags)
+
+    def put(self, event) -> bool:
+        """
+        queues event, or returns False when the subscriber is too far behind.
+        """
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+        return True
+
+    def close(self):
+        """
+        ends the subscription, dropping the events not read yet.
+        """
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self, timeout: float = None):
+        """
+        returns the next event, or None once the subscription is closed.
+        Raises asyncio.TimeoutError when no event comes within timeout.
+        """
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+class EventTail:
+    """
+    Fans the events written to the event collection out to every
+    subscriber of this process, from a single change stream. The stream
+    is opened with the first subscription, and closed with the last one,
+    so that any number of clients only cost one server-side cursor.
+
+    The stream resumes where it stopped when it fails, so that
+    subscribers do not miss the events written in the meantime.
+    """
+
+    def __init__(self, event_db, queue_size: int = QUEUE_SIZE):
+        self.event_db = event_db
+        self.queue_size = queue_size
+        self.subscriptions = set()
+        self._task = None
+        self._resume_token = None
+
+    def subscribe(self, tags: Iterable[str] = ()) -> Subscription:
+        subscription = Subscription(tags, self.queue_size)
+        self.subscriptions.add(subscription)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._watch())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        if not self.subscriptions and self._task is not None:
+            self._task.cancel()
+            self._task = None
+            # events written while nobody listens are not needed.
+            self._resume_token = None
+
+    async def close(self):
+        for subscription in list(self.subscriptions):
+            subscription.close()
+        self.subscriptions.clear()
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def dispatch(self, document: Dict):
+        """
+        queues the DB event document for every subscription it matches.
+        """
+        metrics.increment("event_tail.changes")
+        tags = set(document.get("tags", []))
+        event = None
+        for subscription in list(self.subscriptions):
+            if not subscription.matches(tags):
+                continue
+            if event is None:
+                event = deserialize_db_event(document)
+            if not subscription.put(event):
+                # a slow client must not hold every event in memory.
+                metrics.increment("event_tail.overflows")
+                self.subscriptions.discard(subscription)
+                subscription.close()
+
+    async def _watch(self):
+        while True:
+            try:
+                async with self.event_db.collection.watch(
+                    CHANGE_PIPELINE, full_document="updateLookup",
+                    resume_after=self._resume_token
+                ) as stream:
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        if change.get("fullDocument") is not None:
+                            self.dispatch(change["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # most likely, the oplog no longer goes back to the token.
+                LOG.warning("event tail failed, restarting in %s seconds: %s",
+                            RETRY_SECONDS, e)
+                self._resume_token = None
+            except PyMongoError as e:
+                LOG.warning("event tail failed, resuming in %s seconds: %s",
+                            RETRY_SECONDS, e)
+            await asyncio.sleep(RETRY_SECONDS)
+
+
+async def close_tail(app):
+    tail = app.get("event_tail")
+    if tail is not None:
+        await tail.close()
@@ -10,12 +10,42 @@ class async_generator:
     def __init__(self, cursor, map):
         self.cursor = cursor
         self.map = map
+        # the raw document behind the last value returned.
+        self.last_document = None
 
     def __aiter__(self):
         return self
 
     async def __anext__(self):
         async for doc in self.cursor:
+            self.last_document = doc
             return self.map(doc)
         else:
             raise StopAsyncIteration
+
+
+async def async_list(items):
+    '''
+        Iterates on values already in memory the same
+        way as on a cursor.
+    '''
+    for item in items:
+        yield item
+
+
+async def recorded(cursor, on_end, limit=None):
+    '''
+        Iterates on cursor, and passes every document read
+        to on_end once the cursor is exhausted. Past limit
+        documents, they are no longer kept and on_end is
+        not called.
+    '''
+    docs = []
+    async for doc in cursor:
+        if docs is not None:
+            docs.append(doc)
+            if limit is not None and len(docs) > limit:
+                docs = None
+        yield doc
+    if docs is not None:
+        on_end(docs)
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+from pymongo.errors import PyMongoError
+
+from .event.ancestry import lineage_ids
+
+LOG = logging.getLogger(__name__)
+
+# how long to wait before reopening a change stream that failed.
+RETRY_SECONDS = 5
+
+# only what is needed to know which cached values a change affects.
+CHANGE_PROJECTION = {"$project": {
+    "operationType": 1,
+    "documentKey": 1,
+    "fullDocument._id": 1,
+    "fullDocument.parent_id": 1,
+    "fullDocument.ancestors": 1,
+}}
+
+
+async def watch_events(event_db):
+    """
+    tails a change stream on the event collection, and drops what the
+    cache of event_db holds about every event written, whichever
+    process wrote it.
+
+    changes that happen while the stream is down can not be known, so
+    the whole cache is dropped whenever the stream is (re)opened.
+    """
+    while True:
+        try:
+            async with event_db.collection.watch(
+                [CHANGE_PROJECTION], full_document="updateLookup"
+            ) as stream:
+                event_db.cache.clear()
+                async for change in stream:
+                    ids = changed_ids(change)
+                    if ids is None:
+                        event_db.cache.clear()
+                    else:
+                        event_db.cache.invalidate(*ids)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            LOG.warning("event change stream failed, retrying in %s seconds: %s",
+                        RETRY_SECONDS, e)
+        event_db.cache.clear()
+        await asyncio.sleep(RETRY_SECONDS)
+
+
+def changed_ids(change: Dict) -> List[str]:
+    """
+    returns the ids whose cached values a change makes stale, or None
+    when the whole collection changed.
+    """
+    if "documentKey" not in change:
+        # drop, rename and invalidate events.
+        return None
+    document = change.get("fullDocument")
+    if document is None:
+        # a deleted event only affects the values it is part of.
+        return [change["documentKey"]["_id"]]
+    document.setdefault("_id", change["documentKey"]["_id"])
+    return lineage_ids(document)
+
+
+async def stop_watching(app):
+    watcher = app.get("event_watcher")
+    if watcher is not None:
+        watcher.cancel()
+        try:
+            await watcher
+        except asyncio.CancelledError:
+            pass
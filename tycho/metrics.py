@@ -0,0 +1,19 @@
+"""
+counters of what happened within this process, exposed on /api/v1/metrics.
+"""
+from collections import Counter
+from typing import Dict
+
+_counters = Counter()
+
+
+def increment(name: str, value: int = 1):
+    _counters[name] += value
+
+
+def get_metrics() -> Dict[str, int]:
+    return dict(_counters)
+
+
+def reset():
+    _counters.clear()
@@ -1,5 +1,5 @@
 from schematics.models import Model
-from schematics.types import StringType, IntType, BooleanType
+from schematics.types import StringType, IntType, BooleanType, FloatType
 from schematics.types.compound import ModelType
 
 
@@ -16,6 +16,52 @@ class application(Model):
     port = IntType(required=True)
 
 
+class Cache(Model):
+    """ the in-process cache of events, children lists and impact trees. """
+    # opt-in: without a change stream to watch, writes made by other
+    # workers are only seen once what is cached expires.
+    enabled = BooleanType(required=False, default=False)
+    max_size = IntType(required=False, default=10000, min_value=0)
+    # bounds how long a stale event may be served when changes
+    # from other processes are not watched, or the watch is down.
+    ttl_seconds = FloatType(required=False, default=5.0, min_value=0)
+    # drop what is cached about events written by other processes,
+    # by watching a change stream. requires a replica set.
+    watch = BooleanType(required=False, default=True)
+    # "memory" keeps a cache in every process, "shared" keeps one in
+    # a memory-mapped file shared by every process on the host.
+    backend = StringType(required=False, default="memory",
+                         choices=["memory", "shared"])
+    shared_path = StringType(required=False, default="/dev/shm/tycho-cache")
+    shared_size_mb = IntType(required=False, default=256, min_value=1)
+    # values larger than a slot, once compressed, are not cached.
+    shared_slot_kb = IntType(required=False, default=16, min_value=1)
+
+
+class Storage(Model):
+    """ how events are stored and queried. """
+    # store tag_time on every event written, and query tags along with
+    # a time range through its index, rather than through either the
+    # tags or the time index. Run backfill_events before enabling it
+    # on existing databases, and once more after.
+    tag_time = BooleanType(required=False, default=False)
+    # store the tags of every event written as {k, v} subdocuments in
+    # tag_kv, and query them through its index rather than through the
+    # tags index. Run backfill_events before enabling it on existing
+    # databases, and once more after.
+    tag_kv = BooleanType(required=False, default=False)
+
+
+class Compression(Model):
+    """ the compression of the responses, see tycho.routes.compression. """
+    enabled = BooleanType(required=False, default=True)
+    # smaller bodies are sent as they are.
+    min_size = IntType(required=False, default=1024, min_value=0)
+    # larger bodies are compressed off the event loop.
+    executor_min_size = IntType(required=False, default=64 * 1024, min_value=0)
+    level = IntType(required=False, default=5, min_value=1, max_value=22)
+
+
 class Config(Model):
     """ a config object that the app accepts. """
     environment = StringType(required=False)
@@ -24,3 +70,11 @@ class Config(Model):
     # a configuration parameter to define whether events should be
     # logged any time an event is added/updated
     log_events = BooleanType(required=False, default=True)
+    # the default strategy used to walk the event graph for the impact
+    # and trace apis, see tycho.db.event.TRAVERSALS.
+    traversal = StringType(required=False, default="bfs",
+                           choices=["bfs", "graph_lookup",
+                                    "ancestors", "source_id"])
+    cache = ModelType(Cache, required=False, default={})
+    compression = ModelType(Compression, required=False, default={})
+    storage = ModelType(Storage, required=False, default={})
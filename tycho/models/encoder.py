@@ -0,0 +1,100 @@
+import json
+from typing import Any, Dict, List
+
+from .event import Event
+from .eventnode import EventNode
+from .events_with_count import EventListWithCount
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# prefix of the fields selecting a single tag key, e.g. tags.environment.
+TAG_FIELD_PREFIX = "tags."
+
+
+def event_to_primitive(event: Event, fields: List[str] = None) -> Dict:
+    """
+    returns the same dict as event.to_primitive(), without going
+    through the generic cattrs dispatch for every field.
+
+    with fields, only the id and those fields are returned.
+    """
+    primitive = {
+        "id": event.id,
+        "source_id": event.source_id,
+        "parent_id": event.parent_id,
+        "start_time": event.start_time.isoformat(),
+        "end_time": event.end_time.isoformat(),
+        "description": event.description,
+        "detail_urls": event.detail_urls,
+        "tags": event.tags,
+    }
+    if fields:
+        return _select(primitive, fields)
+    return primitive
+
+
+def _select(primitive: Dict, fields: List[str]) -> Dict:
+    selected = {"id": primitive["id"]}
+    tag_keys = []
+    for field in fields:
+        if field.startswith(TAG_FIELD_PREFIX):
+            tag_keys.append(field[len(TAG_FIELD_PREFIX):])
+        elif field in primitive:
+            selected[field] = primitive[field]
+    if tag_keys and "tags" not in selected:
+        tags = primitive["tags"]
+        selected["tags"] = {key: tags[key] for key in tag_keys if key in tags}
+    return selected
+
+
+def to_primitive(value: Any, fields: List[str] = None) -> Any:
+    """
+    returns the json-serializable form of an Event, an EventNode, an
+    EventListWithCount, or a list of them. With fields, events only
+    have their id and those fields.
+    """
+    if isinstance(value, Event):
+        return event_to_primitive(value, fields)
+    if isinstance(value, EventNode):
+        return _node_to_primitive(value, fields)
+    if isinstance(value, EventListWithCount):
+        return {
+            "count": value.count,
+            "result": [to_primitive(event, fields) for event in value.result],
+            "after": value.after,
+        }
+    if isinstance(value, (list, tuple)):
+        return [to_primitive(item, fields) for item in value]
+    return value
+
+
+def _node_to_primitive(root_node: EventNode, fields: List[str] = None) -> Dict:
+    root = {"event": event_to_primitive(root_node.event, fields), "children": []}
+    frontier = [(root_node, root)]
+    while frontier:
+        node, primitive = frontier.pop()
+        for child in node.children:
+            child_primitive = {"event": event_to_primitive(child.event, fields),
+                               "children": []}
+            primitive["children"].append(child_primitive)
+            frontier.append((child, child_primitive))
+    return root
+
+
+def dumps(value: Any, fields: List[str] = None) -> bytes:
+    """
+    encodes an Event, an EventNode, an EventListWithCount, or a list of
+    them, as utf-8 json.
+    """
+    primitive = to_primitive(value, fields)
+    if orjson is not None:
+        try:
+            return orjson.dumps(primitive)
+        except orjson.JSONEncodeError:
+            # trees nested deeper than orjson supports.
+            pass
+    return json.dumps(primitive, ensure_ascii=False).encode("utf-8")
@@ -112,6 +112,18 @@ class Event(object):
     tags = attr.ib(type=Dict[str, List[str]], default=attr.Factory(dict),
                    validator=[field_validator(200)])
 
+    @classmethod
+    def from_trusted(cls, **fields):
+        """
+        builds an event from the values of every field, without running
+        the validators and converters again. Only for values that went
+        through them already, such as the ones of an event read back
+        from the database.
+        """
+        event = cls.__new__(cls)
+        event.__dict__.update(fields)
+        return event
+
     @staticmethod
     def from_dict(d):
         return CATTRS_CONVERTER.structure(d, Event)
@@ -8,6 +8,27 @@ def ignore_microseconds_list(value):
     return [ignore_microseconds(d) for d in value]
 
 
+def tag_time(tags: List[str], time: List[datetime]) -> List[Dict]:
+    """
+    pairs every tag with the start and the end time, so that a
+    single compound index bounds both the tag and the time of a query.
+    """
+    pairs = sorted({(tag, t) for tag in tags for t in time})
+    return [{"t": tag, "time": t} for tag, t in pairs]
+
+
+def tag_kv(tags: List[str]) -> List[Dict]:
+    """
+    splits every key:value tag into a {k, v} subdocument, so that the
+    values of a single key can be indexed and queried on their own.
+    """
+    result = []
+    for tag in tags:
+        key, value = tag.split(":", 1)
+        result.append({"k": key, "v": value})
+    return result
+
+
 @attr.s
 class EventDB:
     """ This model represents event data format in DB """
@@ -15,8 +36,14 @@ class EventDB:
     time = attr.ib(type=List[datetime], converter=ignore_microseconds_list)
     update_time = attr.ib(type=datetime)
     tags = attr.ib(type=List[str], default=attr.Factory(list))
+    parent_id = attr.ib(type=str, default="")
     detail_urls = attr.ib(type=Dict[str, str], default=attr.Factory(dict))
     description = attr.ib(type=str, default="")
+    version = attr.ib(type=int, default=1)
+    tag_time = attr.ib(type=List[Dict], default=attr.Factory(
+        lambda self: tag_time(self.tags, self.time), takes_self=True))
+    tag_kv = attr.ib(type=List[Dict], default=attr.Factory(
+        lambda self: tag_kv(self.tags), takes_self=True))
 
     def asdict(self):
         eventdb_dict = attr.asdict(self)
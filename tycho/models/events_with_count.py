@@ -8,6 +8,8 @@ class EventListWithCount:
     """
     :param result : the list of events
     :param count : the number of events in result
+    :param after : the cursor to the next page, if there may be one
     """
     count = attr.ib(type=int)
     result = attr.ib(type=List[Event], default=attr.Factory(list))
+    after = attr.ib(type=str, default=None)
@@ -1,9 +1,15 @@
 from .event import (add_event_api, add_statics)
+from .bulk import add_bulk_api
+from .metrics import add_metrics_api
+from .tail import add_tail_api
 from aiohttp_transmute import add_swagger
 
 
 def add_routes(app):
     # add apis
     add_event_api(app)
+    add_bulk_api(app)
+    add_metrics_api(app)
+    add_tail_api(app)
     add_statics(app)
     add_swagger(app, "/api/swagger.json", "/api/")
@@ -0,0 +1,249 @@
+import json
+import logging
+from copy import deepcopy
+from aiohttp import web
+from cattrs.errors import ClassValidationError
+
+from ..models.event import Event
+from .. import metrics
+from ..db.event.version import UNVERSIONED
+from .event import MAX_UPDATE_RETRIES, _update
+from .streaming import NDJSON_CONTENT_TYPE
+
+LOG = logging.getLogger(__name__)
+
+MAX_BULK_EVENTS = 10000
+DUPLICATE_KEY_ERROR_CODE = 11000
+
+
+async def put_events(request):
+    """
+    stores a batch of new events on the database with a single write.
+
+    the body is either a json list of events, an object with the list
+    under "events", or newline-delimited json with one event per line.
+    Every event is validated and written on its own: the response lists
+    the outcome for each of them, in the order they were sent.
+    """
+    try:
+        items, _ = await _read_items(request)
+    except ValueError as e:
+        return _error_response(str(e))
+
+    results, events, positions = _parse_events(items)
+    errors = await request.app["db"].event.save_many(events)
+    for index, (event, i) in enumerate(zip(events, positions)):
+        error = errors.get(index)
+        if error is None:
+            results[i] = {"id": event.id, "status": "created"}
+            if request.app["config"].log_events:
+                LOG.info(json.dumps(event.to_primitive()))
+        elif error.get("code") == DUPLICATE_KEY_ERROR_CODE:
+            results[i] = _result(
+                event, "duplicate", f"Error: id '{event.id}' already exists")
+        else:
+            results[i] = _result(event, "error", error.get("errmsg"))
+
+    return _results_response(results, ["created"])
+
+
+async def post_events(request):
+    """
+    merges or updates a batch of events.
+
+    the body is the same as for put_events. operation ("merge" or
+    "update") and insert are passed as query parameters, or alongside
+    "events" when the body is a json object. Events that do not exist
+    are only written when insert is set. Every event is handled on its
+    own: the response lists the outcome for each of them, in the order
+    they were sent.
+    """
+    try:
+        items, options = await _read_items(request)
+    except ValueError as e:
+        return _error_response(str(e))
+    operation = options.get("operation", request.query.get("operation", "merge"))
+    insert = options.get("insert", request.query.get("insert", "false"))
+    if isinstance(insert, str):
+        insert = insert.lower() == "true"
+    if operation != "merge" and operation != "update":
+        return _error_response(
+            "only update and merge operation are supported, {0} passed".format(operation))
+
+    results, events, positions = _parse_events(items)
+    if operation == "merge":
+        await _merge_events(request, events, positions, results, insert)
+    else:
+        await _update_events(request, events, positions, results, insert)
+    return _results_response(results, ["created", "merged", "updated", "conflict"])
+
+
+async def _merge_events(request, events, positions, results, insert):
+    """
+    merges the events with a single read of the stored events and a
+    single bulk write of atomic updates, see merge_many_by_id, so that
+    concurrent merges of the same events all apply.
+    """
+    statuses, errors = await request.app["db"].event.merge_many_by_id(events, insert)
+    for index, (event, i) in enumerate(zip(events, positions)):
+        error = errors.get(index)
+        if error is not None:
+            results[i] = _result(event, "error", error.get("errmsg"))
+        elif statuses[index] == "invalid":
+            results[i] = _result(event, "invalid", (
+                "Merge not possible: reserved keys of event {0} "
+                "have different values.").format(event.id))
+        else:
+            results[i] = {"id": event.id, "status": statuses[index]}
+            if statuses[index] != "not_found" and request.app["config"].log_events:
+                LOG.info(json.dumps(event.to_primitive()))
+
+
+async def _update_events(request, events, positions, results, insert):
+    """
+    updates the events with a single read of the existing events and
+    a single bulk write. Events are only written if nobody else wrote
+    them since they were read: the others are read and updated again,
+    up to MAX_UPDATE_RETRIES times, and reported as a conflict after that.
+    """
+    pending = list(zip(events, positions))
+    retries = MAX_UPDATE_RETRIES
+    while pending:
+        existing_events = await request.app["db"].event.find_by_ids_with_version(
+            {event.id for event, _ in pending})
+
+        # events sent more than once in the batch are applied in order.
+        touched = {}
+        versions = {}
+        touched_items = {}
+        for event, i in pending:
+            if event.id in touched:
+                existing_event = touched[event.id]
+            elif event.id in existing_events:
+                existing_event, versions[event.id] = existing_events[event.id]
+            elif insert:
+                existing_event, versions[event.id] = None, UNVERSIONED
+            else:
+                results[i] = {"id": event.id, "status": "not_found"}
+                continue
+            if existing_event is None:
+                existing_event = event
+                status = "created"
+            else:
+                # an update can fail half way through, after changing
+                # some of the fields of the event.
+                existing_event = deepcopy(existing_event)
+                try:
+                    _update(existing_event, event)
+                except ValueError as e:
+                    results[i] = _result(event, "invalid", e)
+                    continue
+                status = "updated"
+            if request.app["config"].log_events and retries == MAX_UPDATE_RETRIES:
+                LOG.info(json.dumps(event.to_primitive()))
+            touched[event.id] = existing_event
+            touched_items.setdefault(event.id, []).append((event, i))
+            results[i] = {"id": event.id, "status": status}
+
+        ids = list(touched)
+        errors = await request.app["db"].event.update_many_by_id(
+            [touched[id] for id in ids], insert, [versions[id] for id in ids])
+        pending = []
+        for index, error in errors.items():
+            items = touched_items[ids[index]]
+            if error.get("conflict") and retries > 0:
+                metrics.increment("event.update.version_conflicts")
+                pending.extend(items)
+                continue
+            status = "conflict" if error.get("conflict") else "error"
+            for event, i in items:
+                results[i] = _result(touched[ids[index]], status, error.get("errmsg"))
+        # retried in the order they were sent.
+        pending.sort(key=lambda item: item[1])
+        retries -= 1
+
+
+async def _read_items(request):
+    """
+    returns the events in the body of the request, along with the
+    other fields of the body when it is a json object.
+    """
+    body = await request.text()
+    options = {}
+    if request.content_type == NDJSON_CONTENT_TYPE:
+        try:
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError:
+            raise ValueError("body must contain one json event per line")
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise ValueError("body must be a json list of events")
+        if isinstance(items, dict):
+            options = items
+            items = options.pop("events", None)
+        if not isinstance(items, list):
+            raise ValueError("body must be a json list of events")
+    if len(items) > MAX_BULK_EVENTS:
+        raise ValueError(
+            "at most {0} events can be sent at once, {1} passed".format(
+                MAX_BULK_EVENTS, len(items)))
+    return items, options
+
+
+def _parse_events(items):
+    """
+    validates every item as an event. returns the results list with
+    the invalid items filled in, the valid events, and their positions
+    in items.
+    """
+    results = [None] * len(items)
+    events = []
+    positions = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = _result(item, "invalid", "event must be a json object")
+            continue
+        try:
+            event = Event.from_dict(item)
+        except ClassValidationError as e:
+            # report what was wrong, rather than the exception group.
+            results[i] = _result(item, "invalid", "; ".join(
+                str(exception) for exception in e.exceptions))
+            continue
+        except (ValueError, TypeError) as e:
+            results[i] = _result(item, "invalid", e)
+            continue
+        events.append(event)
+        positions.append(i)
+    return results, events, positions
+
+
+def _result(item, status, error):
+    if isinstance(item, Event):
+        id = item.id
+    else:
+        id = item.get("id") if isinstance(item, dict) else None
+    return {"id": id, "status": status, "error": str(error)}
+
+
+def _results_response(results, statuses):
+    """
+    returns the results, along with how many of them ended
+    with each of the statuses.
+    """
+    response = {"count": len(results), "results": results}
+    for status in statuses:
+        response[status] = sum(1 for r in results if r["status"] == status)
+    return web.json_response(response)
+
+
+def _error_response(message):
+    # the same shape as the errors returned by the transmute routes.
+    return web.json_response({"success": False, "result": message}, status=400)
+
+
+def add_bulk_api(app):
+    app.router.add_route('PUT', "/api/v1/event/bulk", put_events)
+    app.router.add_route('POST', "/api/v1/event/bulk", post_events)
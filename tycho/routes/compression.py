@@ -0,0 +1,156 @@
+import asyncio
+import gzip
+from typing import Optional
+
+from aiohttp import hdrs, web
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# the content types worth compressing.
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson",
+                      "application/javascript", "image/svg+xml", "text/")
+
+
+def _gzip(body: bytes, level: int) -> bytes:
+    return gzip.compress(body, compresslevel=min(level, 9))
+
+
+def _brotli(body: bytes, level: int) -> bytes:
+    return brotli.compress(body, quality=min(level, 11))
+
+
+def _zstd(body: bytes, level: int) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(body)
+
+
+# the encodings supported, from the most to the least preferred when
+# the client accepts several of them equally.
+ENCODINGS = [(name, compress) for name, compress, module in [
+    ("zstd", _zstd, zstandard),
+    ("br", _brotli, brotli),
+    ("gzip", _gzip, gzip),
+] if module is not None]
+
+# the encodings a strong ETag may have been suffixed with.
+ENCODING_NAMES = ("zstd", "br", "gzip")
+
+
+def compression_middleware(compression_config):
+    """
+    returns a middleware compressing the responses larger than
+    min_size bytes, with the best encoding the client accepts.
+
+    bodies larger than executor_min_size are compressed in the default
+    executor, so that compressing a large impact tree does not hold
+    up the other requests. Streamed responses are compressed with
+    gzip by aiohttp as they are written.
+    """
+    @web.middleware
+    async def compress_responses(request, handler):
+        response = await handler(request)
+        if not _is_compressible(response):
+            return response
+        response.headers.add(hdrs.VARY, hdrs.ACCEPT_ENCODING)
+        accept_encoding = request.headers.get(hdrs.ACCEPT_ENCODING, "")
+        body = response.body
+        if body is None:
+            return response
+        if not isinstance(body, (bytes, bytearray)):
+            # a streamed body, of unknown size.
+            if _accepts(accept_encoding, "gzip"):
+                response.enable_compression(web.ContentCoding.gzip)
+                _encode_etag(response, "gzip")
+            return response
+        if len(body) < compression_config.min_size:
+            return response
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            return response
+        name, compress = encoding
+        level = compression_config.level
+        if len(body) >= compression_config.executor_min_size:
+            body = await asyncio.get_event_loop().run_in_executor(
+                None, compress, body, level)
+        else:
+            body = compress(body, level)
+        response.body = body
+        response.headers[hdrs.CONTENT_ENCODING] = name
+        _encode_etag(response, name)
+        return response
+
+    return compress_responses
+
+
+def without_encoding(etag: str) -> str:
+    """
+    returns etag without the content encoding the middleware added to
+    it, so that it can be compared to the ETag of the identity body.
+    """
+    for name in ENCODING_NAMES:
+        suffix = '-{0}"'.format(name)
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def _encode_etag(response, name: str):
+    # a strong ETag identifies the bytes sent, so each encoding needs
+    # its own. Weak ones are left alone.
+    etag = response.headers.get(hdrs.ETAG)
+    if etag is not None and not etag.startswith("W/") and etag.endswith('"'):
+        response.headers[hdrs.ETAG] = '{0}-{1}"'.format(etag[:-1], name)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[tuple]:
+    """
+    returns the (name, compress function) of the encoding to use for
+    the Accept-Encoding header, or None to send the body as it is.
+    """
+    qualities = _parse_accept_encoding(accept_encoding)
+    best = None
+    best_quality = 0
+    for name, compress in ENCODINGS:
+        quality = qualities.get(name, qualities.get("*", 0))
+        if quality > best_quality:
+            best, best_quality = (name, compress), quality
+    return best
+
+
+def _accepts(accept_encoding: str, name: str) -> bool:
+    qualities = _parse_accept_encoding(accept_encoding)
+    return qualities.get(name, qualities.get("*", 0)) > 0
+
+
+def _parse_accept_encoding(accept_encoding: str) -> dict:
+    qualities = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        qualities[name.strip().lower()] = quality
+    return qualities
+
+
+def _is_compressible(response) -> bool:
+    if not isinstance(response, web.Response) or response.prepared:
+        return False
+    if response.status < 200 or response.status in (204, 304):
+        return False
+    if hdrs.CONTENT_ENCODING in response.headers:
+        return False
+    return response.content_type.startswith(COMPRESSIBLE_TYPES)
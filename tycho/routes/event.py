@@ -1,5 +1,6 @@
 import aiohttp_transmute
 import attr
+import hashlib
 import json
 import os
 import logging
@@ -7,16 +8,28 @@ from pymongo.errors import DuplicateKeyError
 from aiohttp import web
 from aiohttp.web import HTTPNotFound
 from aiohttp_transmute import (APIException, add_route, route)
-from datetime import datetime
+from transmute_core import Response
+from datetime import datetime, timezone
 from ..models.eventnode import EventNode
 from ..models.events_with_count import EventListWithCount
 from ..models.event import Event
+from ..models import encoder
+from ..db.event import TRAVERSALS
+from ..db.event.projection import check_fields
+from ..db.event.version import UNVERSIONED, VersionConflict
+from .. import metrics
 
 from ..templates import get_template
+from .compression import without_encoding
+from .streaming import stream_events, wants_stream
 
 
 LOG = logging.getLogger(__name__)
 
+# how many times an update is applied again when the event
+# was written by someone else in the meantime.
+MAX_UPDATE_RETRIES = 5
+
 
 @aiohttp_transmute.describe(methods="GET", paths="/api/v1/event/{event_id}")
 async def get_event(request, event_id: str) -> Event:
@@ -24,38 +37,86 @@ async def get_event(request, event_id: str) -> Event:
     returns the event stored in the db given its id
     :param request: the request object
     :param event_id: the unique id corresponding to the event
-    :return: Event object
+    :return: Event object, with its version as the strong ETag header
     """
-    event = await request.app["db"].event.find_by_id(event_id)
-    return event
+    event, version, update_time = \
+        await request.app["db"].event.find_by_id_with_update_time(event_id)
+    # an event deleted and written again starts over at version 1,
+    # so the ETag also depends on when it was written.
+    etag = '"{0}.{1}"'.format(version, _timestamp(update_time))
+    return _not_modified(request, etag) or _json_response(
+        request, event, headers={"ETag": etag})
 
 
 @aiohttp_transmute.describe(methods="GET",
                             paths="/api/v1/event/{event_id}/children")
-async def get_children_events(request, event_id: str) -> [Event]:
+async def get_children_events(request, event_id: str,
+                              stream: bool = False,
+                              since: datetime = None,
+                              fields: str = None) -> [Event]:
     """
      returns a event's children events given the parent's event id
      :param request: the request object
      :param event_id: the unique id corresponding to the parent event
+     :param stream: write the children as they are read from the
+            database. Also enabled by accepting application/x-ndjson.
+     :param since: only return the children written since then, and
+            the ids of the ones deleted since, see _changes_response.
+     :param fields: the comma-separated fields of the events to return,
+            among id, source_id, parent_id, start_time, end_time,
+            description, detail_urls, tags, and tags.<key> for a single
+            tag key. Events always have their id. default=None, for
+            all of them.
      :return: parent event's children as a list
     """
+    fields = _get_fields(fields)
+    if since is not None:
+        return await _changes_response(
+            request, {"tags": "parent_id:{0}".format(event_id)}, since,
+            fields=fields)
+    # fingerprinted before the children are read, so that the
+    # fingerprint is never newer than the children returned.
+    etag = _etag(_with_fields(
+        await request.app["db"].event.fingerprint_children(event_id), fields))
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    docs = await request.app["db"].event.find_by_parent_id(event_id, fields)
+    if wants_stream(request, stream):
+        response = stream_events(request, docs, fields=fields)
+        response.headers["ETag"] = etag
+        return response
     result = []
-    async for doc in await request.app["db"].event.find_by_parent_id(event_id):
+    async for doc in docs:
         result.append(doc)
-    return result
+    return _json_response(request, result, headers={"ETag": etag}, fields=fields)
 
 
 @aiohttp_transmute.describe(methods="GET",
                             paths="/api/v1/event/{event_id}/trace")
-async def get_parent_events_until_source(request, event_id: str) -> [Event]:
+async def get_parent_events_until_source(request, event_id: str,
+                                         traversal: str = None) -> [Event]:
     """
      returns the whole branch of events up until the source
      given the child's event id
      :param request: the request object
      :param event_id: the unique id corresponding to the child event
+     :param traversal: the strategy used to walk the events, one of
+            "bfs", "graph_lookup", "ancestors" or "source_id".
+            defaults to the configured traversal.
      :return: list of parents until the source as a list
     """
-    return (await request.app["db"].event.trace(event_id))
+    traversal = _get_traversal(request, traversal)
+    fingerprint = await request.app["db"].event.fingerprint_trace(event_id)
+    if fingerprint is None:
+        return _json_response(
+            request, await request.app["db"].event.trace(event_id, traversal))
+    etag = _etag("{0}.{1}".format(traversal, fingerprint))
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    result = await request.app["db"].event.trace(event_id, traversal)
+    return _json_response(request, result, headers={"ETag": etag})
 
 
 @aiohttp_transmute.describe(methods="GET",
@@ -63,7 +124,12 @@ async def get_parent_events_until_source(request, event_id: str) -> [Event]:
 async def get_events(request, count: int = 100,
                      frm: datetime = None, to: datetime = None,
                      use_update_time: bool = False,
-                     tag: [str] = None, page: int = 1) -> EventListWithCount:
+                     tag: [str] = None, page: int = 1,
+                     tag_prefix: [str] = None,
+                     after: str = None,
+                     stream: bool = False,
+                     since: datetime = None,
+                     fields: str = None) -> EventListWithCount:
     """
     return events based on query parameters
     :param request: the client request object
@@ -85,30 +151,90 @@ async def get_events(request, count: int = 100,
     :param tag: the list of other query parameters, including
          environment, services and description, default=None
 
+    :param tag_prefix: the list of key:prefix, only returning the
+         events with a value of key starting with prefix, e.g.
+         services:checkout matches the checkout-api and checkout-web
+         services. default=None
+
+    :param after: the cursor returned in the 'after' field of the
+             previous page. Resumes the listing right after the last
+             event of that page, and can't be combined with page.
+             default=None
+
+    :param stream: write the events as they are read from the
+             database, instead of loading all of them first. Also
+             enabled by accepting application/x-ndjson, which writes
+             one event per line. default=False
+
+    :param since: only return up to count events written since then,
+             oldest first, and the ids of the ones deleted since,
+             see _changes_response. Can't be combined with frm, to
+             or page, and only with the after cursor returned along
+             with the changes. default=None
+
+    :param fields: the comma-separated fields of the events to return,
+             see get_children_events. default=None
+
     :return: The 'EventListwithCount' object, which has the list
              of events to be returned in its 'result' field,
-             and the number of results in its 'count' field
+             the number of results in its 'count' field, and
+             the cursor to the next page in its 'after' field
+             when the page is full.
     """
+    fields = _get_fields(fields)
+    if since is not None:
+        if frm or to or page != 1:
+            raise APIException(
+                "since can not be combined with frm, to or page.")
+        if count < 0:
+            raise APIException("Count must be greater than or equal to zero.")
+        query = {}
+        if tag is not None or tag_prefix:
+            try:
+                query = request.app["db"].event.tags_query(tag, tag_prefix)
+            except ValueError as e:
+                raise APIException(str(e))
+        return await _changes_response(request, query, since, count, fields, after)
+
     result = []
-    qry = {"tags": tag, "count": count, "page": page,
-           "use_update_time": use_update_time}
+    qry = {"tags": tag, "tag_prefixes": tag_prefix, "count": count, "page": page,
+           "use_update_time": use_update_time, "after": after,
+           "fields": fields}
 
     for param in ['frm', 'to']:
         value = eval(param)
         if value:
             qry.update({param: value})
 
-    docs = await request.app["db"].event.find(**qry)
+    try:
+        docs = await request.app["db"].event.find(**qry)
+    except ValueError as e:
+        raise APIException(str(e))
+
+    if wants_stream(request, stream):
+        def on_end(result_count):
+            if count and result_count == count:
+                return {"after": request.app["db"].event.next_after(
+                    docs, use_update_time)}
+            return {"after": None}
+        return stream_events(request, docs, on_end, fields)
+
     async for doc in docs:
         result.append(doc)
-    count = len(result)
-    event_with_count = EventListWithCount(result=result, count=count)
-    return event_with_count
+    next_after = None
+    if count and len(result) == count:
+        next_after = request.app["db"].event.next_after(docs, use_update_time)
+    event_with_count = EventListWithCount(result=result, count=len(result),
+                                          after=next_after)
+    return _json_response(request, event_with_count, fields=fields)
 
 
 @aiohttp_transmute.describe(methods="GET",
                             paths="/api/v1/event/{event_id}/impact")
-async def get_event_impact(request, event_id: str) -> EventNode:
+async def get_event_impact(request, event_id: str,
+                           traversal: str = None,
+                           since: datetime = None,
+                           fields: str = None) -> EventNode:
     """
     gets the whole impact of an event given its id.
     Eg:
@@ -126,10 +252,35 @@ async def get_event_impact(request, event_id: str) -> EventNode:
 
     :param request: the object representing the client request
     :param event_id: the id corresponding to the source
+    :param traversal: the strategy used to walk the events, one of
+           "bfs", "graph_lookup", "ancestors" or "source_id".
+           defaults to the configured traversal.
+    :param since: only return the events of the tree written since then,
+           and the ids of the ones deleted since, see _changes_response.
+           Relies on the ancestors stored on every event.
+    :param fields: the comma-separated fields of the events to return,
+           see get_children_events.
     :return: the impact of the source node.
     """
-    event = await request.app["db"].event.get_tree(event_id)
-    return event
+    traversal = _get_traversal(request, traversal)
+    fields = _get_fields(fields)
+    if since is not None:
+        return await _changes_response(
+            request, {"$or": [{"_id": event_id}, {"ancestors": event_id}]}, since,
+            fields=fields)
+    # a cheap probe of the events in the tree, so that an unchanged
+    # tree is neither built nor sent again.
+    fingerprint = await request.app["db"].event.fingerprint_tree(event_id)
+    if fingerprint is None:
+        return _json_response(
+            request, await request.app["db"].event.get_tree(event_id, traversal, fields),
+            fields=fields)
+    etag = _etag(_with_fields("{0}.{1}".format(traversal, fingerprint), fields))
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    event = await request.app["db"].event.get_tree(event_id, traversal, fields)
+    return _json_response(request, event, headers={"ETag": etag}, fields=fields)
 
 
 @aiohttp_transmute.describe(methods="PUT", paths="/api/v1/event/")
@@ -175,115 +326,206 @@ async def post_event(request, event: Event,
              raise an exception whenever merge isn't possible
            - update will update the values in the existing event with
              the new values given by the post request and add new values
+        When the If-Match header is passed, the event must still be at
+        that version, as returned in the ETag header of get_event.
+        Otherwise, the request fails with a 412.
         :return: the updated/merged event
     """
     if operation != "merge" and operation != "update":
         raise APIException(
             "only update and merge operation are supported, {0} passed".format(operation))
 
-    try:
-        existing_event = await request.app["db"].event.find_by_id(event.id)
-        if operation == "merge":
-            _merge(existing_event, event)
-        else:
-            _update(existing_event, event)
-    except HTTPNotFound:
-        existing_event = event
+    # with If-Match, the event must exist and still be at that version.
+    if_match = _get_if_match(request)
+    if if_match is not None:
+        insert = False
+
+    if operation == "merge":
+        if request.app["config"].log_events:
+            LOG.info(json.dumps(event.to_primitive()))
+        # merged on the database itself, so concurrent merges of
+        # the same event do not overwrite each other.
+        try:
+            merged_event = await request.app["db"].event.merge_by_id(
+                event.id, event, insert, version=if_match)
+        except VersionConflict as e:
+            raise APIException(str(e), code=412)
+        except ValueError as e:
+            raise APIException(str(e))
+        if merged_event is None:
+            if if_match is not None:
+                raise APIException(
+                    "cannot find event {0}".format(event.id), code=412)
+            return event
+        return merged_event
 
     if request.app["config"].log_events:
         LOG.info(json.dumps(event.to_primitive()))
-    await request.app["db"].event.update_by_id(event.id, existing_event, insert)
-    return existing_event
+    # the event is only written if nobody else wrote it since it was
+    # read. Otherwise, the update is applied again to the new event.
+    retries = MAX_UPDATE_RETRIES
+    while True:
+        try:
+            existing_event, version = \
+                await request.app["db"].event.find_by_id_with_version(
+                    event.id, cached=False)
+            _update(existing_event, event)
+        except HTTPNotFound:
+            existing_event, version = event, UNVERSIONED
+        if if_match is not None and if_match != version:
+            raise APIException(
+                "event {0} is at version {1}, not {2}".format(
+                    event.id, version, if_match), code=412)
+        try:
+            await request.app["db"].event.update_by_id(
+                event.id, existing_event, insert, version=version)
+            return existing_event
+        except VersionConflict as e:
+            if if_match is not None:
+                raise APIException(str(e), code=412)
+            if retries == 0:
+                raise APIException(str(e), code=409)
+            retries -= 1
+            metrics.increment("event.update.version_conflicts")
+
+
+def _get_if_match(request):
+    """
+    A helper function that returns the version passed in the If-Match
+    header, as returned in the ETag header of get_event. If-Match
+    compares ETags strongly, so a weak one never matches.
+    """
+    value = request.headers.get("If-Match")
+    if value is None or value.strip() == "*":
+        return None
+    value = value.strip()
+    if value.startswith("W/"):
+        raise APIException(
+            "If-Match must be a strong ETag, {0} passed".format(value), code=412)
+    # the ETag of get_event is the version followed by the update time.
+    version = without_encoding(value).strip('"').split(".")[0]
+    try:
+        return int(version)
+    except ValueError:
+        raise APIException(
+            "If-Match must be an event version, {0} passed".format(value))
 
 
-def _merge(existing_event, new_event):
+async def _changes_response(request, query, since, count=0, fields=None, after=None):
+    """
+    A helper function that returns the events matching query written
+    since then, oldest first, as:
+
+    - result: the events written since then
+    - deleted: the ids of the events deleted since then
+    - count: the number of events in result
+    - until: the time to pass as since to get the changes that
+      follow. The same change may be returned twice.
+    - after: when count events were returned, the cursor to pass
+      along with until, to carry on right after the last event.
     """
-    A helper function to merge the existing event with the
-    new values given by the new_eventionary
+    try:
+        events, deleted, until, next_after = await request.app["db"].event.find_changes(
+            query, since, count, fields, after)
+    except ValueError as e:
+        raise APIException(str(e))
+    return web.json_response({
+        "result": encoder.to_primitive(events, fields),
+        "deleted": deleted,
+        "count": len(events),
+        "until": until.isoformat(),
+        "after": next_after,
+    })
+
+
+def _json_response(request, result, headers=None, fields=None):
+    """
+    A helper function that returns result as json, encoded straight
+    from the models by tycho.models.encoder rather than through the
+    generic serializers of transmute. Clients asking for another
+    content type still get it from transmute, with every field.
+    """
+    if "yaml" in request.content_type:
+        return Response(result, headers=headers or {})
+    return web.Response(body=encoder.dumps(result, fields), headers=headers,
+                        content_type="application/json")
 
-    :param: existing_event: The event that's already in the database
-    :param: the dictionary with new attributes to merge with the existing event
-    :modifies: existing_event with the merged values
+
+def _get_fields(fields):
     """
-    new_event_dict = attr.asdict(new_event)
-    for key in new_event_dict:
-        if new_event_dict.get(key):
-            # try merging the values which share the same keys
-            if getattr(existing_event, key):
-                if key != "tags":
-                    _merge_reserved_keys(key, existing_event, new_event)
-                else:
-                    # merge the values so that the resulting value is a dict
-                    _add_to_dict(key, existing_event, new_event)
-            # else just add the new values to our event
-            else:
-                setattr(existing_event, key, new_event_dict[key])
-
-
-def _merge_reserved_keys(key, existing_event, new_event):
-    """
-    A helper function that merges the reserved keys or raises an exception
-    when merge not possible
-    :param key: The key to be merged
-    :param existing_event: The event that's already in the database
-    :param new_event: the new event to be merged
-    :return: the dictionary with new attributes to merge with
-             the existing event
-    """
-    # change the start time to be the earlier
-    # of the two keys
-    if key == "start_time":
-        if new_event.start_time is not None:
-            existing_event.start_time = min(
-                new_event.start_time, existing_event.start_time)
-
-    elif key == "end_time":
-        # change the end time to be the later
-        # of the two keys
-        if new_event.end_time is not None:
-            existing_event.end_time = max(
-                new_event.end_time, existing_event.end_time)
-
-    elif key == "description":
-        # append the new_event's description to the already existing one
-        str1 = existing_event.description.strip()
-        str2 = new_event.description.strip()
-        if str2 and str2 not in str1:
-            # Adding new line as a separator of events description
-            existing_event.description = str1 + "\n" + str2
-
-    elif key == "detail_urls":
-        # merge two detail_urls lists given by new_event and existing_event
-        for k in new_event.detail_urls:
-            if new_event.detail_urls.get(k) is not None:
-                existing_event.detail_urls[k] = new_event.detail_urls[k]
-    else:
-        # raise exception if the other reserved vals don't match
-        if getattr(existing_event, key) != getattr(new_event, key):
-            raise ValueError("Merge not possible:"
-                             "reserved keys have clashing values.")
-
-
-def _add_to_dict(key, existing_event, new_event):
-    """
-    A helper function that merges the keys whose values is a list
-    :param key: the key corresponding to the values to be added
-    :param existing_event: the already existing event in the db
-    :param new_event: the new db to be merged
-    :modifies the existing_event with the merged values
-    """
-    prev = getattr(existing_event, key)
-    new = getattr(new_event, key)
-
-    for k in new:
-        if k not in prev:
-            prev[k] = new[k]
-        else:
-            for elem in new[k]:
-                if elem not in prev[k]:
-                    prev[k].append(elem)
-
-    setattr(existing_event, key, prev)
+    A helper function that returns the list of fields passed as a
+    comma-separated string, or None when every field is wanted.
+    """
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    try:
+        check_fields(fields)
+    except ValueError as e:
+        raise APIException(str(e))
+    return fields or None
+
+
+def _with_fields(value, fields):
+    """
+    A helper function that adds the fields returned to the value of
+    an ETag, as the same events with other fields are another
+    representation.
+    """
+    if not fields:
+        return value
+    digest = hashlib.sha1(",".join(fields).encode("utf-8")).hexdigest()
+    return "{0}.{1}".format(value, digest)
+
+
+def _etag(value):
+    """
+    A helper function that returns a weak ETag, for the listings and
+    trees whose fingerprint does not tell apart every representation.
+    """
+    return 'W/"{0}"'.format(value)
+
+
+def _not_modified(request, etag):
+    """
+    A helper function that returns a 304 response when the If-None-Match
+    header of the request matches etag, and None otherwise.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is None:
+        return None
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value == "*" or _opaque_tag(value) == _opaque_tag(etag):
+            return web.Response(status=304, headers={"ETag": etag})
+    return None
+
+
+def _opaque_tag(etag):
+    # ETags are compared weakly, regardless of the W/ prefix and of
+    # the content encoding the compression middleware added.
+    return without_encoding(etag[2:] if etag.startswith("W/") else etag)
+
+
+def _timestamp(time):
+    # the milliseconds since the epoch, as stored by MongoDB.
+    if time is None:
+        return 0
+    return int(time.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _get_traversal(request, traversal):
+    """
+    A helper function that validates the traversal requested by the
+    client, falling back to the one configured for the app.
+    """
+    if traversal is None:
+        return request.app["config"].traversal
+    if traversal not in TRAVERSALS:
+        raise APIException(
+            "traversal must be one of {0}, {1} passed".format(
+                ", ".join(TRAVERSALS), traversal))
+    return traversal
 
 
 def _update(existing_event, new_event):
@@ -309,15 +551,16 @@ async def get_event_root_and_impact_diagram(request):
     of that event.
     """
     event_id = request.match_info['event_id']
-    event_tree = (await request.app["db"].event.trace(event_id))
+    traversal = request.app["config"].traversal
+    event_tree = (await request.app["db"].event.trace(event_id, traversal))
     if not event_tree:
         raise HTTPNotFound(
             text='Event ID {} is not available in DB'.format(event_id))
     root_event = event_tree[-1]
-    event = await request.app["db"].event.get_tree(root_event.id)
+    event = await request.app["db"].event.get_tree(root_event.id, traversal)
 
     body = get_template("diagrams.html").render(
-        config=request.app["config"], rawData=json.dumps(event.to_primitive())
+        config=request.app["config"], rawData=encoder.dumps(event).decode("utf-8")
     ).encode("UTF-8")
 
     return web.Response(body=body, content_type="text/html")
@@ -0,0 +1,14 @@
+from aiohttp import web
+
+from .. import metrics
+
+
+async def get_metrics(request):
+    """
+    returns the counters collected by this process since it started.
+    """
+    return web.json_response(metrics.get_metrics())
+
+
+def add_metrics_api(app):
+    app.router.add_route('GET', "/api/v1/metrics", get_metrics)
@@ -0,0 +1,84 @@
+import json
+from aiohttp import web
+
+from ..models.encoder import event_to_primitive
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+JSON_CONTENT_TYPE = "application/json"
+# events are buffered into chunks of roughly this many bytes,
+# rather than written to the socket one at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+def wants_stream(request, stream: bool) -> bool:
+    """
+    whether the client asked for a streamed response, either
+    with the stream flag or by accepting newline-delimited json.
+    """
+    return stream or NDJSON_CONTENT_TYPE in request.headers.get("Accept", "")
+
+
+def stream_events(request, events, on_end=None, fields=None) -> web.Response:
+    """
+    returns a response that writes events as they are read from the
+    database, instead of loading all of them in memory first.
+
+    events are written as newline-delimited json when the client
+    accepts it, and as a json list otherwise. When on_end is passed,
+    the list is wrapped in an object with the result and its count,
+    along with the fields returned by on_end once every event is written.
+    As newline-delimited json, the fields returned by on_end that are
+    set, such as the after cursor of a full page, are written as a last
+    line, without an id.
+    With fields, events only have their id and those fields.
+    """
+    if NDJSON_CONTENT_TYPE in request.headers.get("Accept", ""):
+        return web.Response(body=_chunked(_ndjson(events, on_end, fields)),
+                            content_type=NDJSON_CONTENT_TYPE)
+    return web.Response(body=_chunked(_json_list(events, on_end, fields)),
+                        content_type=JSON_CONTENT_TYPE)
+
+
+async def _ndjson(events, on_end=None, fields=None):
+    count = 0
+    async for event in events:
+        yield json.dumps(event_to_primitive(event, fields)) + "\n"
+        count += 1
+    if on_end is not None:
+        extra_fields = {key: value for key, value in on_end(count).items()
+                        if value is not None}
+        if extra_fields:
+            yield json.dumps(extra_fields) + "\n"
+
+
+async def _json_list(events, on_end, fields=None):
+    if on_end is not None:
+        yield '{"result": '
+    yield "["
+    count = 0
+    async for event in events:
+        if count:
+            yield ", "
+        yield json.dumps(event_to_primitive(event, fields))
+        count += 1
+    yield "]"
+    if on_end is not None:
+        extra_fields = {"count": count}
+        extra_fields.update(on_end(count))
+        for key, value in extra_fields.items():
+            yield ", {0}: {1}".format(json.dumps(key), json.dumps(value))
+        yield "}"
+
+
+async def _chunked(parts):
+    buffer = []
+    size = 0
+    async for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
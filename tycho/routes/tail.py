@@ -0,0 +1,82 @@
+import asyncio
+import json
+from aiohttp import web, WSCloseCode
+
+from ..models.encoder import event_to_primitive
+
+EVENT_STREAM_CONTENT_TYPE = "text/event-stream"
+# how often idle connections are pinged, so that proxies keep them open.
+HEARTBEAT_SECONDS = 15
+
+
+async def tail_events(request):
+    """
+    pushes the events written from now on, and matching all the
+    tag parameters, until the client disconnects.
+
+    events are sent as json messages over a WebSocket when the client
+    asks for one, and as server-sent events otherwise. Clients that fall
+    too far behind are disconnected: they then get an overflow event, or
+    a WebSocket closed with code 1013, and should read what they missed
+    with the since parameter of the event APIs before tailing again.
+    """
+    tags = request.query.getall("tag", [])
+    websocket = web.WebSocketResponse(heartbeat=HEARTBEAT_SECONDS)
+    if websocket.can_prepare(request).ok:
+        return await _tail_websocket(request, websocket, tags)
+    return await _tail_event_stream(request, tags)
+
+
+async def _tail_event_stream(request, tags):
+    response = web.StreamResponse(headers={"Cache-Control": "no-cache"})
+    response.content_type = EVENT_STREAM_CONTENT_TYPE
+    await response.prepare(request)
+    tail = request.app["event_tail"]
+    subscription = tail.subscribe(tags)
+    try:
+        while True:
+            try:
+                event = await subscription.get(HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b": keep-alive\n\n")
+                continue
+            if event is None:
+                break
+            data = json.dumps(event_to_primitive(event))
+            await response.write("data: {0}\n\n".format(data).encode("utf-8"))
+        if subscription.overflowed:
+            await response.write(b"event: overflow\ndata: {}\n\n")
+    finally:
+        tail.unsubscribe(subscription)
+    return response
+
+
+async def _tail_websocket(request, websocket, tags):
+    await websocket.prepare(request)
+    tail = request.app["event_tail"]
+    subscription = tail.subscribe(tags)
+    # messages from the client are ignored, but have to be read
+    # to notice when it goes away.
+    reader = asyncio.ensure_future(_read_until_closed(websocket, subscription))
+    try:
+        async for event in subscription:
+            await websocket.send_json(event_to_primitive(event))
+        if subscription.overflowed:
+            await websocket.close(code=WSCloseCode.TRY_AGAIN_LATER,
+                                  message=b"overflow")
+        else:
+            await websocket.close()
+    finally:
+        reader.cancel()
+        tail.unsubscribe(subscription)
+    return websocket
+
+
+async def _read_until_closed(websocket, subscription):
+    async for _ in websocket:
+        pass
+    subscription.close()
+
+
+def add_tail_api(app):
+    app.router.add_route('GET', "/api/v1/tail", tail_events)
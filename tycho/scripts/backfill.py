@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import pymongo
+import sys
+
+from tycho.app import init_app
+from tycho.db.event.tag_kv import tag_kv_expression
+from tycho.db.event.tag_time import tag_time_expression
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+PARENT_ID_TAG_PREFIX = "parent_id:"
+BATCH_SIZE = 1000
+
+
+async def backfill_parent_id(app):
+    """
+    copy the parent id out of the tags of every event stored before
+    the top-level parent_id field was introduced.
+    """
+    prefix_length = len(PARENT_ID_TAG_PREFIX)
+    parent_id_tags = {"$filter": {
+        "input": {"$ifNull": ["$tags", []]},
+        "cond": {"$eq": [
+            {"$substrCP": ["$$this", 0, prefix_length]}, PARENT_ID_TAG_PREFIX
+        ]},
+    }}
+    # events without a parent fall back to the bare prefix,
+    # which leaves an empty parent id.
+    parent_id = {"$substrCP": [
+        {"$ifNull": [
+            {"$arrayElemAt": [parent_id_tags, 0]}, PARENT_ID_TAG_PREFIX
+        ]},
+        prefix_length,
+        1000,
+    ]}
+    result = await app['db'].event.collection.update_many(
+        {"parent_id": {"$exists": False}},
+        [{"$set": {"parent_id": parent_id}}],
+    )
+    LOGGER.info("Backfilled parent_id on {0} events".format(result.modified_count))
+
+
+async def backfill_ancestors(app, batch_size=BATCH_SIZE):
+    """
+    materialize the ancestors of every event stored before they were
+    maintained on write. Batches can be processed in any order: an
+    event whose parent has not been backfilled yet is repaired once
+    the parent is.
+    """
+    event = app['db'].event
+    cursor = event.collection.find(
+        {"ancestors": {"$exists": False}}, {"parent_id": 1}
+    )
+    backfilled = 0
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            backfilled += await _backfill_ancestors_batch(event, batch)
+            batch = []
+    if batch:
+        backfilled += await _backfill_ancestors_batch(event, batch)
+    LOGGER.info("Backfilled ancestors on {0} events".format(backfilled))
+
+
+async def _backfill_ancestors_batch(event, batch):
+    await event.set_ancestors(batch)
+    await event.collection.bulk_write([
+        pymongo.UpdateOne({"_id": doc["_id"]}, {"$set": {
+            "ancestors": doc["ancestors"], "depth": doc["depth"]
+        }})
+        for doc in batch
+    ], ordered=False)
+    await event.repair_descendants(batch)
+    return len(batch)
+
+
+async def backfill_tag_time(app):
+    """
+    pair the tags and times of every event written while tag_time
+    was not enabled, so that the tag_time index covers them.
+    """
+    result = await app['db'].event.collection.update_many(
+        {"tag_time": {"$exists": False}},
+        [{"$set": {"tag_time": tag_time_expression()}}],
+    )
+    LOGGER.info("Backfilled tag_time on {0} events".format(result.modified_count))
+
+
+async def backfill_tag_kv(app):
+    """
+    split the tags of every event written while tag_kv was not
+    enabled, so that the tag_kv index covers them.
+    The tombstones of deleted events are split as well.
+    """
+    result = await app['db'].event.collection.update_many(
+        {"tag_kv": {"$exists": False}},
+        [{"$set": {"tag_kv": tag_kv_expression()}}],
+    )
+    LOGGER.info("Backfilled tag_kv on {0} events".format(result.modified_count))
+    result = await app['db'].event.deletions.collection.update_many(
+        {"tag_kv": {"$exists": False}},
+        [{"$set": {"tag_kv": tag_kv_expression()}}],
+    )
+    LOGGER.info("Backfilled tag_kv on {0} tombstones".format(result.modified_count))
+
+
+async def backfill(app):
+    # the ancestors are resolved through the parent_id field.
+    await backfill_parent_id(app)
+    await backfill_ancestors(app)
+    await backfill_tag_time(app)
+    await backfill_tag_kv(app)
+
+
+def main(argv=sys.argv[1:]):
+    '''
+    Script to add fields introduced by newer versions of tycho
+    to the events already stored in the given DB
+
+    Usage:
+        backfill_events
+    '''
+
+    loop = asyncio.get_event_loop()
+
+    from tycho.main import app
+
+    loop.run_until_complete(init_app(app, app['config']))
+
+    loop.run_until_complete(backfill(app))
@@ -0,0 +1,51 @@
+import argparse
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from tycho.db.event.deserialize import deserialize_db_event
+from tycho.db.event.serialize import serialize_to_db_event
+from tycho.scripts.benchmark_encoder import make_event
+
+
+def make_document(index: int):
+    """
+    returns the document of an event, as read back from MongoDB:
+    with naive UTC times, to the millisecond.
+    """
+    document = serialize_to_db_event(make_event(index))
+    now = datetime.utcnow().replace(microsecond=0)
+    document["time"] = [now, now + timedelta(minutes=1)]
+    return document
+
+
+def main(argv=sys.argv[1:]):
+    '''
+    Compares the time taken to build events from DB documents
+    with and without running the validators of Event again.
+
+    Usage:
+        python -m tycho.scripts.benchmark_deserialize [--size 1000]
+    '''
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--size", type=int, default=1000,
+                        help="the number of documents read at once.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    documents = [make_document(index) for index in range(args.size)]
+    assert [deserialize_db_event(d) for d in documents] == \
+        [deserialize_db_event(d, trusted=False) for d in documents]
+
+    validated = min(timeit.repeat(
+        lambda: [deserialize_db_event(d, trusted=False) for d in documents],
+        number=1, repeat=args.repeat))
+    trusted = min(timeit.repeat(
+        lambda: [deserialize_db_event(d) for d in documents],
+        number=1, repeat=args.repeat))
+    print("{0} documents: validated {1:.2f}ms, trusted {2:.2f}ms, {3:.1f}x".format(
+        args.size, validated * 1000, trusted * 1000, validated / trusted))
+
+
+if __name__ == "__main__":
+    main()
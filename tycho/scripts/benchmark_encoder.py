@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+import timeit
+
+from tycho.models import encoder
+from tycho.models.event import Event, CATTRS_CONVERTER
+from tycho.models.eventnode import EventNode
+from tycho.models.events_with_count import EventListWithCount
+
+
+def make_event(index: int) -> Event:
+    return Event(
+        id="event-{0}".format(index),
+        source_id="event-0",
+        parent_id="event-{0}".format(max(index - 1, 0) // 4),
+        description="This is a trigger_deploy event.",
+        detail_urls={"jira": "http://jira", "graphite": "http://graphite"},
+        tags={
+            "source": ["deploy"],
+            "type": ["deploy/deploy_all"],
+            "author": ["user@example.com"],
+            "environment": ["monitor_candidate", "monitor_live"],
+            "services": ["tycho"],
+            "status": ["success"],
+        },
+    )
+
+
+def make_tree(size: int) -> EventNode:
+    """
+    returns a tree of size events, where every event has 4 children.
+    """
+    nodes = [EventNode(event=make_event(index)) for index in range(size)]
+    for index, node in enumerate(nodes[1:], 1):
+        nodes[(index - 1) // 4].children.append(node)
+    return nodes[0]
+
+
+def cattrs_dumps(value) -> bytes:
+    """
+    encodes value the way transmute does: unstructured by cattrs,
+    then dumped by the json module.
+    """
+    return json.dumps(_cattrs_primitive(value)).encode("utf-8")
+
+
+def _cattrs_primitive(value):
+    if isinstance(value, EventNode):
+        # unstructured by node, as the children of an EventNode are
+        # typed as events.
+        return {"event": CATTRS_CONVERTER.unstructure(value.event),
+                "children": [_cattrs_primitive(child) for child in value.children]}
+    return CATTRS_CONVERTER.unstructure(value)
+
+
+def main(argv=sys.argv[1:]):
+    '''
+    Compares the time taken to encode events as json by
+    tycho.models.encoder, and by cattrs and the json module.
+
+    Usage:
+        python -m tycho.scripts.benchmark_encoder [--size 5000]
+    '''
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--size", type=int, default=5000,
+                        help="the number of events encoded at once.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    events = [make_event(index) for index in range(args.size)]
+    payloads = {
+        "EventNode": make_tree(args.size),
+        "EventListWithCount": EventListWithCount(count=len(events), result=events),
+    }
+    for name, payload in payloads.items():
+        assert json.loads(encoder.dumps(payload)) == json.loads(cattrs_dumps(payload))
+        baseline = min(timeit.repeat(lambda: cattrs_dumps(payload),
+                                     number=1, repeat=args.repeat))
+        fast = min(timeit.repeat(lambda: encoder.dumps(payload),
+                                 number=1, repeat=args.repeat))
+        print("{0} of {1} events: cattrs {2:.2f}ms, encoder {3:.2f}ms, {4:.1f}x".format(
+            name, args.size, baseline * 1000, fast * 1000, baseline / fast))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import aiohttp
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from aiohttp.test_utils import TestServer
+
+from tycho.app import create_app
+from tycho.db.event import TRAVERSALS
+from tycho.models.config import Config
+from tycho.models.event import Event
+from tycho.scripts.create_indexes import create_indexes
+from tycho.scripts.synthetic_events import make_dataset, save_dataset
+
+# how often every route is requested, relative to the others.
+DEFAULT_MIX = {
+    "get_event": 20,
+    "listing": 20,
+    "children": 10,
+    "impact": 10,
+    "trace": 10,
+    "put": 15,
+    "merge": 15,
+}
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """
+    returns the nearest-rank percentile of values sorted in ascending order.
+    """
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict:
+    """
+    returns the throughput and the latency percentiles, in milliseconds,
+    of the requests to a route that took latencies seconds.
+    """
+    values = sorted(latencies)
+    summary = {
+        "requests": len(values),
+        "errors": errors,
+        "throughput": len(values) / duration if duration else 0,
+        "mean_ms": sum(values) * 1000 / len(values) if values else None,
+        "max_ms": values[-1] * 1000 if values else None,
+    }
+    for percent in PERCENTILES:
+        value = percentile(values, percent)
+        summary["p{0}_ms".format(percent)] = value * 1000 if value is not None else None
+    return summary
+
+
+def compare(current: Dict, previous: Dict) -> Dict:
+    """
+    returns, for every route in both results and their total, the ratio
+    of the current throughput and latency percentiles to the previous ones.
+    """
+    ratios = {}
+    before_by_route = dict(previous["routes"], total=previous["total"])
+    for route, summary in dict(current["routes"], total=current["total"]).items():
+        before = before_by_route.get(route)
+        if before is None:
+            continue
+        ratios[route] = {
+            key: summary[key] / before[key]
+            for key in ["throughput"] + ["p{0}_ms".format(p) for p in PERCENTILES]
+            if summary.get(key) and before.get(key)
+        }
+    return ratios
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """
+    parses a mix formatted as route=weight,route=weight.
+    """
+    mix = {}
+    for item in value.split(","):
+        route, _, weight = item.partition("=")
+        if route not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError("routes must be among {0}: {1} passed".format(
+                ", ".join(DEFAULT_MIX), route))
+        mix[route] = int(weight or 1)
+    return mix
+
+
+class Workload:
+    """
+    the requests of the mixed workload, against the synthetic dataset
+    of tycho.scripts.synthetic_events.
+    """
+
+    def __init__(self, events: List[Event], depth: int, seed: int = 0):
+        self.random = random.Random(seed)
+        self.ids = [event.id for event in events]
+        self.tagged_ids = [id for id in self.ids if id.startswith("tagged-")]
+        self.trace_id = "chain-{0}".format(depth - 1)
+        self.written = 0
+
+    def request(self, route: str):
+        """
+        returns the method, path and json body of a request to route.
+        """
+        if route == "get_event":
+            return "GET", "/api/v1/event/{0}".format(self.random.choice(self.ids)), None
+        if route == "listing":
+            environment = self.random.choice(["prod", "stage", "qa", "dev"])
+            return "GET", "/api/v1/event/?tag=environment:{0}".format(environment), None
+        if route == "children":
+            return "GET", "/api/v1/event/deploy-root/children", None
+        if route == "impact":
+            return "GET", "/api/v1/event/deploy-root/impact", None
+        if route == "trace":
+            return "GET", "/api/v1/event/{0}/trace".format(self.trace_id), None
+        now = datetime.utcnow()
+        if route == "put":
+            self.written += 1
+            event = Event(id="written-{0}-{1}".format(os.getpid(), self.written),
+                          start_time=now, end_time=now,
+                          tags={"environment": ["prod"], "source": ["benchmark"]})
+            return "PUT", "/api/v1/event/", event.to_primitive()
+        if route == "merge":
+            event = Event(id=self.random.choice(self.tagged_ids),
+                          start_time=now - timedelta(days=30), end_time=now,
+                          tags={"status": [self.random.choice(["success", "failed"])]})
+            return "POST", "/api/v1/event/?operation=merge", event.to_primitive()
+        raise ValueError("unknown route {0}".format(route))
+
+
+async def run_workload(base_url: str, workload: Workload, mix: Dict[str, int],
+                       duration: float, concurrency: int, warmup: float = 0):
+    """
+    sends requests of the mix with concurrency clients for warmup and
+    then duration seconds. Returns the latencies and errors per route,
+    of the requests sent after the warmup.
+    """
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    latencies = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    start = time.perf_counter()
+    measured_from = start + warmup
+    deadline = measured_from + duration
+
+    async def client(session):
+        while True:
+            sent = time.perf_counter()
+            if sent >= deadline:
+                return
+            route = workload.random.choices(routes, weights)[0]
+            method, path, body = workload.request(route)
+            try:
+                async with session.request(method, base_url + path, json=body) as response:
+                    await response.read()
+                failed = response.status >= 400
+            except aiohttp.ClientError:
+                # e.g. a dropped connection, which only fails this request.
+                failed = True
+            if sent < measured_from:
+                continue
+            latencies[route].append(time.perf_counter() - sent)
+            if failed:
+                errors[route] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+    return latencies, errors
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(__file__)).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args) -> Dict:
+    config = Config({
+        "mongo": {"uri": args.mongo_uri, "db_name": args.db_name},
+        "application": {"host": "127.0.0.1", "port": 0},
+        "log_events": False,
+        "traversal": args.traversal,
+        # a standalone mongod has no change streams to watch.
+        "cache": {"enabled": not args.no_cache, "watch": False},
+    })
+    app = create_app(config)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        db = app["db"]
+        # fails before anything is written when mongod is not reachable.
+        await db.command("ping")
+        try:
+            await create_indexes(app)
+            events = make_dataset(args.width, args.depth, args.count)
+            await save_dataset(db.event, events)
+            workload = Workload(events, args.depth, args.seed)
+            latencies, errors = await run_workload(
+                str(server.make_url("")).rstrip("/"), workload, args.mix,
+                args.duration, args.concurrency, args.warmup)
+        finally:
+            if not args.keep_db:
+                await db.command("dropDatabase")
+    finally:
+        await server.close()
+
+    routes = {route: summarize(latencies[route], errors[route], args.duration)
+              for route in args.mix}
+    total = summarize([latency for route in args.mix for latency in latencies[route]],
+                      sum(errors.values()), args.duration)
+    return {
+        "commit": _commit(),
+        "time": datetime.utcnow().isoformat(),
+        "options": {
+            "concurrency": args.concurrency, "duration": args.duration,
+            "width": args.width, "depth": args.depth, "count": args.count,
+            "traversal": args.traversal, "cache": not args.no_cache, "mix": args.mix,
+        },
+        "total": total,
+        "routes": routes,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    '''
+    Starts tycho against a local mongod, seeds it with synthetic events,
+    and measures the throughput and latency percentiles of every route
+    under a mixed read and write workload. The results are saved as json,
+    and can be compared with the ones of another commit.
+
+    Usage:
+        python -m tycho.scripts.benchmark_routes [--duration 30] [--concurrency 16]
+            [--output results.json] [--compare previous.json]
+    '''
+    parser = argparse.ArgumentParser(description=main.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="tycho-benchmark-{0}".format(os.getpid()))
+    parser.add_argument("--keep-db", action="store_true",
+                        help="do not drop the database once done.")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="how many seconds requests are measured for.")
+    parser.add_argument("--warmup", type=float, default=2,
+                        help="how many seconds requests are sent before being measured.")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="the number of requests in flight.")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                        help="the weight of every route, e.g. listing=3,put=1. "
+                             "default: {0}".format(",".join(
+                                 "{0}={1}".format(*item) for item in DEFAULT_MIX.items())))
+    parser.add_argument("--traversal", default="bfs", choices=TRAVERSALS,
+                        help="the traversal of the impact and trace routes.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="disable the event cache.")
+    parser.add_argument("--width", type=int, default=100,
+                        help="the number of children of the deploy event.")
+    parser.add_argument("--depth", type=int, default=30,
+                        help="the number of events in the traced chain.")
+    parser.add_argument("--count", type=int, default=1000,
+                        help="the number of events with many tag keys.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-routes.json",
+                        help="where to save the results.")
+    parser.add_argument("--compare", help="the results of a previous run to compare with.")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(benchmark(args))
+    with open(args.output, "w") as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+
+    ratios = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            ratios = compare(results, json.load(fh))
+    for route, summary in sorted(results["routes"].items()) + [("total", results["total"])]:
+        line = "{0:<10} {1:>8.1f} req/s  p50 {2}  p90 {3}  p99 {4}  errors {5}".format(
+            route, summary["throughput"], *[
+                _ms(summary["p{0}_ms".format(p)]) for p in PERCENTILES],
+            summary["errors"])
+        if route in ratios:
+            line += "  vs previous: " + ", ".join(
+                "{0} x{1:.2f}".format(key, value) for key, value in sorted(ratios[route].items()))
+        print(line)
+
+
+def _ms(value):
+    return "{0:>8.2f}ms".format(value) if value is not None else "       -  "
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import asyncio
+import attr
 import docopt
 import logging
 import pymongo
 import pymongo.errors
 import sys
+from typing import Dict, List, Tuple
 
 # from zonlib.scripts.utils import create_app, get_host_by_db_name
 from tycho.app import create_app
@@ -14,46 +16,203 @@ from tycho.app import init_app
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 
+# the options compared between the declared and the live indexes,
+# and their values when not set.
+COMPARED_OPTIONS = {
+    "unique": False,
+    "sparse": False,
+    "expireAfterSeconds": None,
+    "partialFilterExpression": None,
+    "collation": None,
+}
+# every collection has it, and it can not be dropped.
+ID_INDEX = "_id_"
 
-async def create_indexes(app):
+
+@attr.s
+class IndexDiff:
+    """
+    the differences between the declared and the live indexes of
+    a collection. Live indexes are listed by name.
+    """
+    # declared indexes missing from the collection.
+    missing = attr.ib(type=List[Dict], factory=list)
+    # declared indexes whose live counterpart has other options,
+    # as (declared index, live index name) pairs.
+    changed = attr.ib(type=List[Tuple[Dict, str]], factory=list)
+    # live indexes that are no longer declared.
+    obsolete = attr.ib(type=List[str], factory=list)
+    unchanged = attr.ib(type=List[str], factory=list)
+
+
+def diff_indexes(declared: List[Dict], live: Dict) -> IndexDiff:
+    """
+    compares the declared indexes, as in Event.indexes, to the live ones,
+    as returned by index_information. Indexes are matched on their keys,
+    then compared on COMPARED_OPTIONS.
+    """
+    diff = IndexDiff()
+    live_by_keys = {_keys(info["key"]): name
+                    for name, info in live.items() if name != ID_INDEX}
+    for index in declared:
+        name = live_by_keys.pop(_keys(index["keys"]), None)
+        if name is None:
+            diff.missing.append(index)
+        elif _options_match(index, live[name]):
+            diff.unchanged.append(name)
+        else:
+            diff.changed.append((index, name))
+    diff.obsolete.extend(sorted(live_by_keys.values()))
+    return diff
+
+
+def _keys(keys) -> Tuple:
+    # MongoDB may return the directions as floats.
+    return tuple((field, int(direction) if isinstance(direction, float) else direction)
+                 for field, direction in keys)
+
+
+def _options_match(index: Dict, info: Dict) -> bool:
+    for option, default in COMPARED_OPTIONS.items():
+        declared = index.get(option, default)
+        live = info.get(option, default)
+        if option == "collation" and declared and live:
+            # the server fills in every collation option left out.
+            live = {key: value for key, value in live.items() if key in declared}
+        if declared != live:
+            return False
+    return True
+
+
+async def index_stats(db_class) -> Dict[str, Dict]:
+    """
+    returns the $indexStats accesses of every index of the collection
+    by name: how many operations used it, and since when.
+    """
+    stats = {}
+    async for doc in db_class.collection.aggregate([{"$indexStats": {}}]):
+        stats[doc["name"]] = doc["accesses"]
+    return stats
+
+
+async def create_indexes(app, drop=False, dry_run=False, stats=False):
+    for db_class in [app['db'].event, app['db'].event.deletions]:
+        await _create_indexes(db_class, drop, dry_run)
+        if stats:
+            await _report_stats(db_class)
+
+
+async def _create_indexes(db_class, drop=False, dry_run=False):
+    """
+    creates the declared indexes missing from the collection. With drop,
+    also drops the live indexes that are no longer declared, and
+    rebuilds the ones whose options changed. With dry_run, only logs
+    the differences.
+    """
+    name = db_class._collection
     # the check can not be replaced with None check because
     # pymongo/motor returns collection object if any property is missing
     # hence explicitly checking its type as list
-    if not isinstance(app['db'].event.indexes, list):
-        LOGGER.warn("Collection {0} on {1} has no attribute 'indexes'".format(
-            'event', app.async_db.name))
+    if not isinstance(db_class.indexes, list):
+        LOGGER.warn("Collection {0} has no attribute 'indexes'".format(name))
         # not throwing exception here but continue to run script with other
         # valid collections
         return
 
-    for index in app['db'].event.indexes:
-        LOGGER.debug(
-            "Creating index {0} for {1} collection with unique constraint as {2} \n".format(
-                index['keys'], app['db'].event, index['unique'])
+    diff = diff_indexes(db_class.indexes, await db_class.collection.index_information())
+    for index in diff.missing:
+        LOGGER.info("Missing index {0} on {1} collection".format(index['keys'], name))
+    for index, index_name in diff.changed:
+        LOGGER.info("Index {0} on {1} collection has other options than {2}".format(
+            index_name, name, index))
+    for index_name in diff.obsolete:
+        LOGGER.info("Index {0} on {1} collection is no longer declared".format(
+            index_name, name))
+    if dry_run:
+        return diff
+
+    if drop:
+        for index, index_name in diff.changed:
+            await _drop_index(db_class, index_name)
+            await _create_index(db_class, index)
+        for index_name in diff.obsolete:
+            await _drop_index(db_class, index_name)
+    for index in diff.missing:
+        await _create_index(db_class, index)
+    return diff
+
+
+async def _create_index(db_class, index):
+    name = db_class._collection
+    LOGGER.debug(
+        "Creating index {0} for {1} collection with unique constraint as {2} \n".format(
+            index['keys'], name, index.get('unique', False))
+    )
+    # other options, such as expireAfterSeconds, are passed as is.
+    options = {key: value for key, value in index.items() if key != 'keys'}
+    # only holds an exclusive lock while the build starts and ends on
+    # MongoDB 4.2 and later, which ignore the option. Older servers
+    # build in the background instead of blocking reads.
+    options.setdefault('background', True)
+
+    try:
+        await db_class.collection.create_index(index['keys'], **options)
+    except pymongo.errors.OperationFailure as e:
+        LOGGER.exception(
+            "Error occured while creating the index {0} on collection {1}".format(
+                index, name)
         )
 
-        try:
-            await app['db'].event.collection.create_index(index['keys'],
-                                             unique=index['unique'])
-        except pymongo.errors.OperationFailure as e:
-            LOGGER.exception(
-                "Error occured while creating the index {0} on collection {1}".format(
-                    index, 'event')
-            )
+
+async def _drop_index(db_class, index_name):
+    name = db_class._collection
+    LOGGER.debug("Dropping index {0} of {1} collection".format(index_name, name))
+    try:
+        await db_class.collection.drop_index(index_name)
+    except pymongo.errors.OperationFailure as e:
+        LOGGER.exception(
+            "Error occured while dropping the index {0} on collection {1}".format(
+                index_name, name)
+        )
+
+
+async def _report_stats(db_class):
+    name = db_class._collection
+    try:
+        stats = await index_stats(db_class)
+    except pymongo.errors.OperationFailure as e:
+        LOGGER.exception("Error occured while reading the index stats of {0}".format(name))
+        return
+    for index_name, accesses in sorted(stats.items()):
+        LOGGER.info("Index {0} on {1} collection was used {2} times since {3}{4}".format(
+            index_name, name, accesses["ops"], accesses["since"],
+            "" if accesses["ops"] or index_name == ID_INDEX
+            else ", it only costs writes"))
 
 
 def main(argv=sys.argv[1:]):
     '''
-    Script to create indexes for collections in given DB
+    Script to sync the indexes of the collections in given DB with
+    the ones they declare. Missing indexes are created; indexes no
+    longer declared, or declared with other options, are reported.
 
     Usage:
-        create_indexes
+        create_indexes [--drop] [--dry-run] [--stats]
+
+    Options:
+        --drop      drop the indexes that are no longer declared, and
+                    rebuild the ones declared with other options.
+        --dry-run   only report the differences.
+        --stats     report how many operations used every index since
+                    the server started, from $indexStats.
     '''
+    args = docopt.docopt(main.__doc__, argv=argv)
 
     loop = asyncio.get_event_loop()
 
     from tycho.main import app
 
-    init_app(app, app['config'])
+    loop.run_until_complete(init_app(app, app['config']))
 
-    loop.run_until_complete(create_indexes(app))
+    loop.run_until_complete(create_indexes(
+        app, drop=args['--drop'], dry_run=args['--dry-run'], stats=args['--stats']))
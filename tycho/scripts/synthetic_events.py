@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import logging
+import random
+import sys
+from datetime import datetime, timedelta
+from typing import List
+
+from tycho.app import init_app
+from tycho.models.event import Event
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+BATCH_SIZE = 1000
+ENVIRONMENTS = ["prod", "stage", "qa", "dev"]
+
+
+def deploy_fanout(width: int, start: datetime, prefix: str = "deploy") -> List[Event]:
+    """
+    returns a deploy_all event, and one deploy event per service below it,
+    all sharing its source id.
+    """
+    root = Event(
+        id="{0}-root".format(prefix),
+        start_time=start,
+        end_time=start + timedelta(minutes=30),
+        description="deploy of {0} services".format(width),
+        tags={"source": ["deploy"], "type": ["deploy/deploy_all"],
+              "environment": ["prod"]},
+    )
+    events = [root]
+    for index in range(width):
+        time = start + timedelta(seconds=index)
+        events.append(Event(
+            id="{0}-{1}".format(prefix, index),
+            source_id=root.id,
+            parent_id=root.id,
+            start_time=time,
+            end_time=time + timedelta(minutes=5),
+            description="deploy of svc-{0}".format(index),
+            tags={"source": ["deploy"], "type": ["deploy/deploy_host"],
+                  "environment": ["prod"], "services": ["svc-{0}".format(index)]},
+        ))
+    return events
+
+
+def chain(depth: int, start: datetime, prefix: str = "chain") -> List[Event]:
+    """
+    returns depth events, each one the parent of the next.
+    """
+    events = []
+    for index in range(depth):
+        time = start + timedelta(seconds=index)
+        events.append(Event(
+            id="{0}-{1}".format(prefix, index),
+            source_id=events[0].id if events else "",
+            parent_id=events[-1].id if events else "",
+            start_time=time,
+            end_time=time,
+            description="step {0}".format(index),
+            tags={"source": ["pipeline"], "type": ["pipeline/step"]},
+        ))
+    return events
+
+
+def tagged_events(count: int, start: datetime, days: int = 30, keys: int = 10,
+                  values: int = 20, seed: int = 0, prefix: str = "tagged") -> List[Event]:
+    """
+    returns count unrelated events spread over days, each with a value
+    of every one of keys tag keys, picked among values.
+    """
+    rnd = random.Random(seed)
+    events = []
+    for index in range(count):
+        time = start + timedelta(seconds=rnd.randrange(days * 24 * 3600))
+        tags = {"key{0}".format(key): ["value{0}".format(rnd.randrange(values))]
+                for key in range(keys)}
+        tags["environment"] = [rnd.choice(ENVIRONMENTS)]
+        tags["services"] = ["svc-{0}".format(rnd.randrange(values))]
+        events.append(Event(
+            id="{0}-{1}".format(prefix, index),
+            start_time=time,
+            end_time=time + timedelta(minutes=rnd.randrange(60)),
+            description="event {0}".format(index),
+            tags=tags,
+        ))
+    return events
+
+
+def make_dataset(width: int = 100, depth: int = 30, count: int = 1000,
+                 days: int = 30, seed: int = 0, end: datetime = None) -> List[Event]:
+    """
+    returns a wide deploy fan-out, a deep chain of events and count
+    events with many tag keys, over the days before end.
+    """
+    end = end or datetime.utcnow()
+    start = end - timedelta(days=days)
+    return (deploy_fanout(width, end - timedelta(hours=1))
+            + chain(depth, end - timedelta(hours=2))
+            + tagged_events(count, start, days=days, seed=seed))
+
+
+async def save_dataset(event_db, events: List[Event], batch_size=BATCH_SIZE):
+    """
+    saves events in batches, parents first. Returns the errors of the
+    events that could not be saved, by index.
+    """
+    errors = {}
+    for offset in range(0, len(events), batch_size):
+        batch_errors = await event_db.save_many(events[offset:offset + batch_size])
+        errors.update({offset + index: error for index, error in batch_errors.items()})
+    return errors
+
+
+def main(argv=sys.argv[1:]):
+    '''
+    Script to fill the given DB with synthetic events: a wide deploy
+    fan-out, a deep chain of events, and events with many tag keys.
+
+    Usage:
+        python -m tycho.scripts.synthetic_events [--width 100] [--depth 30] [--count 1000]
+    '''
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--width", type=int, default=100,
+                        help="the number of children of the deploy event.")
+    parser.add_argument("--depth", type=int, default=30,
+                        help="the number of events in the chain.")
+    parser.add_argument("--count", type=int, default=1000,
+                        help="the number of events with many tag keys.")
+    parser.add_argument("--days", type=int, default=30,
+                        help="the number of days the tagged events span.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+
+    from tycho.main import app
+
+    loop.run_until_complete(init_app(app, app['config']))
+
+    events = make_dataset(args.width, args.depth, args.count, args.days, args.seed)
+    errors = loop.run_until_complete(save_dataset(app['db'].event, events))
+    LOGGER.info("Saved {0} of {1} events".format(len(events) - len(errors), len(events)))
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,8 @@ def collections():
 def config():
     config_json = Config.get_mock_object().to_primitive()
     config_json["mongo"] = DB_CONFIG.to_primitive()
+    config_json["traversal"] = "bfs"
+    config_json["cache"] = {"enabled": False}
     config_model = Config(config_json)
     return config_model
 
@@ -238,6 +240,7 @@ def eventdb(start_time, end_time, update_time):
         "description": "This is a trigger_deploy event.",
         "time": [start_time, end_time],
         "update_time": update_time,
+        "parent_id": "111f1f77bcf86cd799439011",
         "tags": [
             "parent_id:111f1f77bcf86cd799439011",
             "source_id:222f1f77bcf86cd799439011",
@@ -0,0 +1,77 @@
+import pytest
+
+from tycho.db.event.ancestry import (
+    lineage_ids, repair_descendants_filter, repair_descendants_pipeline,
+    resolve_ancestors)
+
+
+def test_resolve_ancestors_without_parent():
+    assert resolve_ancestors({"_id": "a", "parent_id": ""}, {}, {}, 10) == []
+
+
+def test_resolve_ancestors_with_missing_parent():
+    doc = {"_id": "b", "parent_id": "a"}
+    assert resolve_ancestors(doc, {}, {}, 10) == ["a"]
+
+
+def test_resolve_ancestors_with_stored_parent():
+    doc = {"_id": "c", "parent_id": "b"}
+    assert resolve_ancestors(doc, {}, {"b": ["root", "a"]}, 10) == \
+        ["root", "a", "b"]
+
+
+def test_resolve_ancestors_with_parents_in_same_batch():
+    docs_by_id = {
+        "a": {"_id": "a", "parent_id": "root"},
+        "b": {"_id": "b", "parent_id": "a"},
+    }
+    doc = {"_id": "c", "parent_id": "b"}
+    assert resolve_ancestors(doc, docs_by_id, {"root": []}, 10) == \
+        ["root", "a", "b"]
+
+
+def test_resolve_ancestors_stops_at_cycle():
+    docs_by_id = {
+        "a": {"_id": "a", "parent_id": "b"},
+        "b": {"_id": "b", "parent_id": "a"},
+    }
+    assert resolve_ancestors(docs_by_id["a"], docs_by_id, {}, 10) == ["b"]
+    doc = {"_id": "c", "parent_id": "b"}
+    assert resolve_ancestors(doc, {}, {"b": ["c", "a"]}, 10) == ["a", "b"]
+
+
+@pytest.mark.parametrize("max_length, expected", [
+    (1, ["b"]),
+    (2, ["a", "b"]),
+])
+def test_resolve_ancestors_keeps_closest_ancestors(max_length, expected):
+    doc = {"_id": "c", "parent_id": "b"}
+    assert resolve_ancestors(doc, {}, {"b": ["root", "a"]}, max_length) == \
+        expected
+
+
+def test_repair_descendants_pipeline_sets_depth():
+    pipeline = repair_descendants_pipeline(
+        {"_id": "b", "ancestors": ["a"]}, 10)
+    assert pipeline[0]["$set"]["ancestors"]["$slice"][0]["$concatArrays"][0] \
+        == {"$literal": ["a", "b"]}
+    assert pipeline[-1] == {"$set": {"depth": {"$size": "$ancestors"}}}
+
+
+def test_repair_descendants_filter_skips_matching_descendants():
+    assert repair_descendants_filter({"_id": "b", "ancestors": ["a"]}, 10) == {
+        "ancestors": "b",
+        "$nor": [{"ancestors.0": "a", "ancestors.1": "b"}],
+    }
+
+
+def test_repair_descendants_filter_past_max_length():
+    # the ancestors of the descendants no longer start with the prefix.
+    assert repair_descendants_filter({"_id": "b", "ancestors": ["a"]}, 1) == \
+        {"ancestors": "b"}
+
+
+def test_lineage_ids():
+    assert lineage_ids({"_id": "c", "parent_id": "b", "ancestors": ["a", "b"]}) == \
+        ["c", "b", "a", "b"]
+    assert lineage_ids({"_id": "a", "parent_id": ""}) == ["a"]
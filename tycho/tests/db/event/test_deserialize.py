@@ -1,4 +1,6 @@
 import bson
+import pytz
+from datetime import datetime
 import pytest
 import attr
 
@@ -120,3 +122,36 @@ def test_deserialize_db_event_with_dot_converter_in_detail_urls_key(eventdb):
     event = deserialize_db_event(event_db_dict)
     assert event
     assert event.detail_urls == {"foo.bar": "abcd"}
+
+
+def test_deserialize_db_event_trusted_matches_validated(eventdb):
+    document = eventdb.asdict()
+    document["time"] = [t.replace(microsecond=123000) for t in document["time"]]
+    assert deserialize_db_event(document) == \
+        deserialize_db_event(document, trusted=False)
+
+
+def test_deserialize_db_event_trusted_normalizes_time(eventdb):
+    document = eventdb.asdict()
+    document["time"] = [datetime(2020, 1, 1, microsecond=123456)]
+    event = deserialize_db_event(document)
+    assert event.start_time == datetime(2020, 1, 1, microsecond=123000, tzinfo=pytz.utc)
+    assert event.end_time == event.start_time
+
+
+def test_deserialize_db_event_trusted_skips_validators(eventdb):
+    document = eventdb.asdict()
+    # too long to be written now, but stored before the limit existed.
+    document["tags"] = ["environment:" + "x" * 300]
+    with pytest.raises(ValueError):
+        deserialize_db_event(document, trusted=False)
+    event = deserialize_db_event(document)
+    assert event.tags == {"environment": ["x" * 300]}
+
+
+def test_deserialize_db_event_with_tag_subdocuments(event, eventdb):
+    document = eventdb.asdict()
+    document["tags"] = [{"k": tag.split(":", 1)[0], "v": tag.split(":", 1)[1]}
+                        for tag in document["tags"]]
+    assert deserialize_db_event(document) == event
+    assert deserialize_db_event(document, trusted=False) == event
@@ -1,13 +1,20 @@
+import asyncio
 import pytest
 import attr
 
 from aiohttp.web import HTTPNotFound
 from asynctest import CoroutineMock, patch
 from copy import deepcopy
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pymongo.errors import DuplicateKeyError
 from tycho.models.event import Event
-from tycho.db.event import MAX_RECURSIVE_DEPTH
+from tycho import metrics
+from tycho.db.cache import LRUCache
+from tycho.db.event import MAX_RECURSIVE_DEPTH, TRAVERSALS
+from tycho.db.event.tag_kv import tag_kv
+from tycho.db.event.tag_time import tag_time
+from tycho.db.event.version import UNVERSIONED, VersionConflict
+from tycho.scripts.backfill import backfill_tag_kv, backfill_tag_time
 
 
 async def test_save_data(app, event):
@@ -23,6 +30,54 @@ async def test_save_data_with_dot_in_detail_urls_key(app, event):
     assert attr.asdict(result) == attr.asdict(event)
 
 
+async def test_save_many(app, source_event, parent_event, event):
+    errors = await app["db"].event.save_many([event, parent_event, source_event])
+    assert errors == {}
+    document = await app["db"].event.collection.find_one({"_id": event.id})
+    assert document["ancestors"] == [source_event.id, parent_event.id]
+
+
+async def test_save_many_continues_after_duplicate(app, event):
+    await app["db"].event.save(event)
+    new_event = deepcopy(event)
+    new_event.id = "new-event"
+    errors = await app["db"].event.save_many([event, new_event])
+    assert list(errors) == [0]
+    assert errors[0]["code"] == 11000
+    assert (await app["db"].event.find_by_id(new_event.id)) == new_event
+
+
+async def test_save_many_without_events(app):
+    assert (await app["db"].event.save_many([])) == {}
+
+
+async def test_find_by_ids(app, source_event_in_db, parent_event_in_db):
+    result = await app["db"].event.find_by_ids(
+        [source_event_in_db.id, parent_event_in_db.id, "missing"])
+    assert result == {source_event_in_db.id: source_event_in_db,
+                      parent_event_in_db.id: parent_event_in_db}
+
+
+async def test_find_by_ids_with_version(app, event_in_db):
+    result = await app["db"].event.find_by_ids_with_version([event_in_db.id, "missing"])
+    assert result == {event_in_db.id: (event_in_db, 1)}
+
+
+async def test_update_many_by_id(app, event_in_db, event):
+    event_in_db.tags["status"] = ["Fail"]
+    new_event = deepcopy(event)
+    new_event.id = "new-event"
+    errors = await app["db"].event.update_many_by_id([event_in_db, new_event])
+    assert errors == {}
+    result = await app["db"].event.find_by_id(event_in_db.id)
+    assert result.tags["status"] == ["Fail"]
+    with pytest.raises(HTTPNotFound):
+        await app["db"].event.find_by_id(new_event.id)
+
+    await app["db"].event.update_many_by_id([new_event], insert=True)
+    assert (await app["db"].event.find_by_id(new_event.id)) == new_event
+
+
 async def test_find_one_data_exists(app, event):
     await app["db"].event.save(event)
     result = await app["db"].event.find_one()
@@ -89,6 +144,15 @@ async def test_event_trace_with_max_recursive_depth(app, event):
     result = await app["db"].event.trace(event.id)
     assert len(result) == MAX_RECURSIVE_DEPTH
 
+    result = await app["db"].event.trace(event.id, traversal="graph_lookup")
+    assert len(result) == MAX_RECURSIVE_DEPTH
+
+    result = await app["db"].event.trace(event.id, traversal="ancestors")
+    assert len(result) == MAX_RECURSIVE_DEPTH
+
+    result = await app["db"].event.trace(event.id, traversal="source_id")
+    assert len(result) == MAX_RECURSIVE_DEPTH
+
 
 async def test_update_by_id(app, event):
     await app["db"].event.save(event)
@@ -100,6 +164,53 @@ async def test_update_by_id(app, event):
     assert result.tags["status"] == ["Fail"]
 
 
+async def test_update_many_by_id_with_versions(app, event_in_db, event):
+    new_event = deepcopy(event)
+    new_event.id = "new-event"
+    # the first event was written again since it was read at version 1.
+    await app["db"].event.update_by_id(event_in_db.id, event_in_db)
+    event_in_db.tags["status"] = ["Fail"]
+    errors = await app["db"].event.update_many_by_id(
+        [event_in_db, new_event], insert=True, versions=[1, UNVERSIONED])
+    assert list(errors) == [0]
+    assert errors[0]["conflict"]
+    result = await app["db"].event.find_by_id(event_in_db.id)
+    assert "status" not in result.tags
+    assert await app["db"].event.find_by_id(new_event.id) == new_event
+
+    errors = await app["db"].event.update_many_by_id(
+        [new_event], insert=True, versions=[UNVERSIONED])
+    assert errors[0]["conflict"]
+
+
+async def test_merge_many_by_id(app, source_event_in_db, parent_event_in_db, event):
+    new_event = Event(id=parent_event_in_db.id, description="merged",
+                      start_time=parent_event_in_db.start_time,
+                      end_time=parent_event_in_db.end_time,
+                      tags={"author": ["orbital@example.com"]})
+    clashing_event = Event(id=parent_event_in_db.id, source_id="another-source",
+                           start_time=parent_event_in_db.start_time,
+                           end_time=parent_event_in_db.end_time)
+    statuses, errors = await app["db"].event.merge_many_by_id(
+        [new_event, clashing_event, event, new_event])
+    assert statuses == ["merged", "invalid", "not_found", "merged"]
+    assert errors == {}
+    result = await app["db"].event.find_by_id(parent_event_in_db.id)
+    assert result.description == parent_event_in_db.description.strip() + "\nmerged"
+    assert "orbital@example.com" in result.tags["author"]
+    assert result.source_id == parent_event_in_db.source_id
+
+
+async def test_merge_many_by_id_with_insert(app, source_event_in_db, parent_event, event):
+    statuses, errors = await app["db"].event.merge_many_by_id(
+        [event, parent_event, parent_event], insert=True)
+    assert statuses == ["created", "created", "merged"]
+    assert errors == {}
+    # the parent was written after its child.
+    document = await app["db"].event.collection.find_one({"_id": event.id})
+    assert document["ancestors"] == [source_event_in_db.id, parent_event.id]
+
+
 async def test_update_by_id_on_nothing(app, event):
     await app["db"].event.update_by_id(event.id, event)
     with pytest.raises(HTTPNotFound):
@@ -107,23 +218,71 @@ async def test_update_by_id_on_nothing(app, event):
 
 
 async def test_update_by_id_pymongo_raises_duplicate_key_error_successful_on_retry(app, event):
-    with patch.object(app["db"].event.collection, "find_one_and_replace", new=CoroutineMock())\
-            as mock_replace:
-        mock_replace.side_effect = [DuplicateKeyError("error_msg"), 1]
+    metrics.reset()
+    with patch.object(app["db"].event.collection, "find_one_and_update", new=CoroutineMock())\
+            as mock_update:
+        mock_update.side_effect = [DuplicateKeyError("error_msg"), {"_id": event.id}]
 
         await app["db"].event.update_by_id(event.id, event)
+    assert metrics.get_metrics()["event.update.retries"] == 1
 
 
 async def test_update_by_id_pymongo_raises_duplicate_key_error_failure_on_retry(app, event):
-    with patch.object(app["db"].event.collection, "find_one_and_replace", new=CoroutineMock())\
-            as mock_replace:
-        mock_replace.side_effect = [DuplicateKeyError("error after first run"),
-                                    DuplicateKeyError("error after second run")]
+    with patch.object(app["db"].event.collection, "find_one_and_update", new=CoroutineMock())\
+            as mock_update:
+        mock_update.side_effect = [DuplicateKeyError("error after first run"),
+                                   DuplicateKeyError("error after second run")]
 
         with pytest.raises(DuplicateKeyError, match="error after second run"):
             await app["db"].event.update_by_id(event.id, event)
 
 
+async def test_update_by_id_increments_version(app, event):
+    await app["db"].event.save(event)
+    _, version = await app["db"].event.find_by_id_with_version(event.id)
+    assert version == 1
+    await app["db"].event.update_by_id(event.id, event)
+    await app["db"].event.update_by_id(event.id, event, version=2)
+    _, version = await app["db"].event.find_by_id_with_version(event.id)
+    assert version == 3
+
+
+async def test_find_by_id_with_update_time(app, event):
+    await app["db"].event.save(event)
+    found, version, update_time = \
+        await app["db"].event.find_by_id_with_update_time(event.id)
+    assert (found.id, version) == (event.id, 1)
+    await app["db"].event.update_by_id(event.id, event)
+    _, version, updated_time = \
+        await app["db"].event.find_by_id_with_update_time(event.id)
+    assert version == 2
+    assert updated_time >= update_time
+
+
+async def test_update_by_id_with_stale_version(app, event):
+    await app["db"].event.save(event)
+    await app["db"].event.update_by_id(event.id, event)
+    with pytest.raises(VersionConflict):
+        await app["db"].event.update_by_id(event.id, event, version=1)
+    with pytest.raises(VersionConflict):
+        await app["db"].event.update_by_id(event.id, event, insert=True,
+                                           version=1)
+
+
+async def test_update_by_id_with_version_on_nothing(app, event):
+    await app["db"].event.update_by_id(event.id, event, version=UNVERSIONED)
+    with pytest.raises(HTTPNotFound):
+        await app["db"].event.find_by_id(event.id)
+
+
+async def test_merge_by_id_increments_version(app, event_in_db):
+    await app["db"].event.merge_by_id(event_in_db.id, event_in_db, version=1)
+    _, version = await app["db"].event.find_by_id_with_version(event_in_db.id)
+    assert version == 2
+    with pytest.raises(VersionConflict):
+        await app["db"].event.merge_by_id(event_in_db.id, event_in_db, version=1)
+
+
 async def test_find_by_parent_id(app, event):
     await app["db"].event.save(event)
     id = event.parent_id
@@ -239,6 +398,65 @@ async def test_get_events_by_count_and_page(app, source_event_in_db,
     assert attr.asdict(result[1]) == attr.asdict(event_list[3])
 
 
+async def test_get_events_with_after_cursor(app, source_event_in_db,
+                                            child_event_of_source_in_db,
+                                            parent_event_in_db,
+                                            event_in_db):
+    event_list = [
+                  child_event_of_source_in_db,
+                  source_event_in_db,
+                  parent_event_in_db,
+                  event_in_db
+                  ]
+    result = []
+    after = None
+    for i in range(2):
+        docs = await app["db"].event.find(count=2, after=after)
+        async for doc in docs:
+            result.append(doc)
+        after = app["db"].event.next_after(docs)
+    assert result == event_list
+
+    docs = await app["db"].event.find(count=2, after=after)
+    assert [doc async for doc in docs] == []
+
+
+async def test_get_events_with_after_cursor_on_same_time(app, event):
+    """ events sharing the same time are paged through by id """
+    ids = ["event-{0}".format(i) for i in range(5)]
+    for id in ids:
+        event.id = id
+        await app["db"].event.save(event)
+    result = []
+    after = None
+    for i in range(3):
+        docs = await app["db"].event.find(count=2, after=after)
+        async for doc in docs:
+            result.append(doc.id)
+        after = app["db"].event.next_after(docs)
+    assert result == list(reversed(ids))
+
+
+async def test_get_events_with_after_cursor_by_update_time(
+        app, source_event_in_db, update_event_in_db):
+    docs = await app["db"].event.find(count=1, use_update_time=True)
+    first = [doc async for doc in docs]
+    after = app["db"].event.next_after(docs, use_update_time=True)
+    docs = await app["db"].event.find(count=1, use_update_time=True,
+                                      after=after)
+    second = [doc async for doc in docs]
+    assert {first[0].id, second[0].id} == {source_event_in_db.id,
+                                           update_event_in_db.id}
+
+
+async def test_after_cursor_with_page_raises_exception(app, event_in_db):
+    docs = await app["db"].event.find(count=1)
+    [doc async for doc in docs]
+    after = app["db"].event.next_after(docs)
+    with pytest.raises(ValueError):
+        await app["db"].event.find(count=1, page=2, after=after)
+
+
 async def test_page_count_less_than_one_raises_exception(app,
                                                          event_in_db):
     with pytest.raises(ValueError):
@@ -365,6 +583,657 @@ async def test_bfs_traversal_on_leaf(app, event_in_db):
     assert leaf_node.children == []
 
 
+async def test_get_tree_queries_once_per_level(app, source_event_in_db,
+                                              child_event_of_source_in_db,
+                                              parent_event_in_db,
+                                              event_in_db):
+    event_db = app["db"].event
+    find_by_parent_ids = event_db.find_by_parent_ids
+    calls = []
+
+    async def counting_find_by_parent_ids(ids, fields=None):
+        calls.append(ids)
+        return await find_by_parent_ids(ids, fields)
+
+    with patch.object(event_db, "find_by_parent_ids",
+                      new=counting_find_by_parent_ids):
+        source_node = await event_db.get_tree(source_event_in_db.id)
+    # source -> (child_of_source, parent) -> event -> no children
+    assert len(calls) == 3
+    assert len(source_node.children) == 2
+
+
+async def test_get_tree_with_cycle(app, event):
+    first = deepcopy(event)
+    first.id = "cycle-first"
+    first.parent_id = "cycle-second"
+    second = deepcopy(event)
+    second.id = "cycle-second"
+    second.parent_id = "cycle-first"
+    await app["db"].event.save(first)
+    await app["db"].event.save(second)
+
+    root = await app["db"].event.get_tree(first.id)
+    assert root.children[0].event.id == second.id
+    assert root.children[0].children == []
+
+
+async def test_find_by_parent_ids(app, source_event_in_db,
+                                  child_event_of_source_in_db,
+                                  parent_event_in_db,
+                                  event_in_db):
+    ids = [source_event_in_db.id, parent_event_in_db.id]
+    result = []
+    async for doc in await app["db"].event.find_by_parent_ids(ids):
+        result.append(doc.id)
+    assert sorted(result) == sorted([child_event_of_source_in_db.id,
+                                     parent_event_in_db.id,
+                                     event_in_db.id])
+
+
+async def test_get_tree_with_graph_lookup(app, source_event_in_db,
+                                         child_event_of_source_in_db,
+                                         parent_event_in_db,
+                                         event_in_db):
+    source_node = await app["db"].event.get_tree(
+        source_event_in_db.id, traversal="graph_lookup")
+    assert source_node.event == source_event_in_db
+    # siblings are ordered by start time.
+    assert [c.event for c in source_node.children] == [
+        parent_event_in_db, child_event_of_source_in_db]
+    assert source_node.children[0].children[0].event == event_in_db
+    assert source_node.children[0].children[0].children == []
+
+
+async def test_trace_with_graph_lookup(app, source_event_in_db,
+                                       parent_event_in_db,
+                                       event_in_db):
+    result = await app["db"].event.trace(event_in_db.id,
+                                         traversal="graph_lookup")
+    assert result == [event_in_db, parent_event_in_db, source_event_in_db]
+
+
+async def test_trace_with_graph_lookup_on_missing_event(app):
+    result = await app["db"].event.trace("missing", traversal="graph_lookup")
+    assert result == []
+
+
+async def test_unknown_traversal_raises_exception(app, event_in_db):
+    with pytest.raises(ValueError):
+        await app["db"].event.get_tree(event_in_db.id, traversal="dfs")
+    with pytest.raises(ValueError):
+        await app["db"].event.trace(event_in_db.id, traversal="dfs")
+
+
+async def test_save_materializes_ancestors(app, source_event_in_db,
+                                           parent_event_in_db,
+                                           event_in_db):
+    document = await app["db"].event.collection.find_one(
+        {"_id": event_in_db.id})
+    assert document["ancestors"] == [source_event_in_db.id,
+                                     parent_event_in_db.id]
+    assert document["depth"] == 2
+
+
+async def test_save_parent_after_child_repairs_ancestors(app, source_event,
+                                                         parent_event, event):
+    await app["db"].event.save(event)
+    await app["db"].event.save(parent_event)
+    document = await app["db"].event.collection.find_one({"_id": event.id})
+    assert document["ancestors"] == [source_event.id, parent_event.id]
+
+    await app["db"].event.save(source_event)
+    document = await app["db"].event.collection.find_one({"_id": event.id})
+    assert document["ancestors"] == [source_event.id, parent_event.id]
+
+
+async def test_update_by_id_moves_descendants(app, source_event_in_db,
+                                              parent_event_in_db,
+                                              event_in_db):
+    parent_event_in_db.parent_id = ""
+    await app["db"].event.update_by_id(parent_event_in_db.id,
+                                       parent_event_in_db)
+    document = await app["db"].event.collection.find_one(
+        {"_id": event_in_db.id})
+    assert document["ancestors"] == [parent_event_in_db.id]
+    assert document["depth"] == 1
+
+
+async def test_update_by_id_keeps_descendants_when_lineage_did_not_move(
+        app, source_event_in_db, parent_event_in_db, event_in_db):
+    parent_event_in_db.description = "updated"
+    with patch.object(app["db"].event.collection, "update_many",
+                      new=CoroutineMock()) as mock_update_many:
+        await app["db"].event.update_by_id(parent_event_in_db.id,
+                                           parent_event_in_db)
+    assert not mock_update_many.called
+
+
+async def test_merge_by_id_keeps_descendants_when_lineage_did_not_move(
+        app, source_event_in_db, parent_event_in_db, event_in_db):
+    update_many = app["db"].event.collection.update_many
+    results = []
+
+    async def recording_update_many(*args, **kwargs):
+        results.append(await update_many(*args, **kwargs))
+        return results[-1]
+
+    new_event = Event(id=parent_event_in_db.id,
+                      parent_id=parent_event_in_db.parent_id,
+                      tags={"author": ["orbital@example.com"]})
+    with patch.object(app["db"].event.collection, "update_many",
+                      new=recording_update_many):
+        await app["db"].event.merge_by_id(parent_event_in_db.id, new_event)
+    assert [result.modified_count for result in results] in ([], [0])
+    document = await app["db"].event.collection.find_one(
+        {"_id": event_in_db.id})
+    assert document["ancestors"] == [source_event_in_db.id,
+                                     parent_event_in_db.id]
+
+
+async def test_merge_by_id(app, event_in_db):
+    new_event = Event(
+        id=event_in_db.id,
+        start_time=event_in_db.start_time - timedelta(seconds=50),
+        end_time=event_in_db.end_time,
+        description="deployed",
+        tags={"author": ["orbital@example.com"]},
+    )
+    result = await app["db"].event.merge_by_id(event_in_db.id, new_event)
+    assert result.start_time == new_event.start_time
+    assert result.end_time == event_in_db.end_time
+    assert result.description == event_in_db.description.strip() + "\ndeployed"
+    assert "orbital@example.com" in result.tags["author"]
+    assert result == await app["db"].event.find_by_id(event_in_db.id)
+
+
+async def test_merge_by_id_applies_concurrent_merges(app, event_in_db):
+    new_events = [
+        Event(id=event_in_db.id, start_time=event_in_db.start_time,
+              end_time=event_in_db.end_time, tags={"author": [str(i)]})
+        for i in range(10)
+    ]
+    await asyncio.gather(*[
+        app["db"].event.merge_by_id(event_in_db.id, new_event)
+        for new_event in new_events
+    ])
+    result = await app["db"].event.find_by_id(event_in_db.id)
+    assert set(str(i) for i in range(10)) <= set(result.tags["author"])
+
+
+async def test_merge_by_id_on_nothing(app, event):
+    assert await app["db"].event.merge_by_id(event.id, event) is None
+    with pytest.raises(HTTPNotFound):
+        await app["db"].event.find_by_id(event.id)
+
+
+async def test_merge_by_id_with_insert(app, event):
+    result = await app["db"].event.merge_by_id(event.id, event, insert=True)
+    assert result.to_primitive() == event.to_primitive()
+
+
+async def test_merge_by_id_with_clashing_reserved_keys(app, event_in_db):
+    new_event = Event(id=event_in_db.id, parent_id="another-parent")
+    with pytest.raises(ValueError):
+        await app["db"].event.merge_by_id(event_in_db.id, new_event, insert=True)
+
+
+async def test_merge_by_id_sets_ancestors_of_new_parent(app, source_event_in_db,
+                                                        event):
+    await app["db"].event.save(attr.evolve(event, parent_id=""))
+    new_event = Event(id=event.id, parent_id=source_event_in_db.id,
+                      start_time=event.start_time, end_time=event.end_time)
+    await app["db"].event.merge_by_id(event.id, new_event)
+    document = await app["db"].event.collection.find_one({"_id": event.id})
+    assert document["parent_id"] == source_event_in_db.id
+    assert document["ancestors"] == [source_event_in_db.id]
+
+
+async def test_find_descendants(app, source_event_in_db,
+                                child_event_of_source_in_db,
+                                parent_event_in_db,
+                                event_in_db):
+    result = []
+    async for doc in await app["db"].event.find_descendants(
+            parent_event_in_db.id):
+        result.append(doc)
+    assert result == [event_in_db]
+
+
+async def test_get_tree_with_ancestors(app, source_event_in_db,
+                                       child_event_of_source_in_db,
+                                       parent_event_in_db,
+                                       event_in_db):
+    source_node = await app["db"].event.get_tree(
+        source_event_in_db.id, traversal="ancestors")
+    assert source_node.event == source_event_in_db
+    # siblings are ordered by start time.
+    assert [c.event for c in source_node.children] == [
+        parent_event_in_db, child_event_of_source_in_db]
+    assert source_node.children[0].children[0].event == event_in_db
+
+
+async def test_trace_with_ancestors(app, source_event_in_db,
+                                    parent_event_in_db,
+                                    event_in_db):
+    result = await app["db"].event.trace(event_in_db.id,
+                                         traversal="ancestors")
+    assert result == [event_in_db, parent_event_in_db, source_event_in_db]
+
+
+async def test_trace_with_ancestors_stops_at_nonexistent_parent(app, event):
+    await app["db"].event.save(event)
+    result = await app["db"].event.trace(event.id, traversal="ancestors")
+    assert result == [event]
+
+
+async def test_trace_with_ancestors_falls_back_to_walk(app, source_event_in_db,
+                                                      parent_event_in_db,
+                                                      event_in_db):
+    await app["db"].event.collection.update_many(
+        {}, {"$unset": {"ancestors": "", "depth": ""}})
+    result = await app["db"].event.trace(event_in_db.id,
+                                         traversal="ancestors")
+    assert result == [event_in_db, parent_event_in_db, source_event_in_db]
+
+
+async def test_find_by_source_id(app, source_event_in_db,
+                                 child_event_of_source_in_db,
+                                 parent_event_in_db,
+                                 event_in_db):
+    result = []
+    async for doc in await app["db"].event.find_by_source_id(
+            source_event_in_db.id):
+        result.append(doc.id)
+    assert sorted(result) == sorted([source_event_in_db.id,
+                                     child_event_of_source_in_db.id,
+                                     parent_event_in_db.id,
+                                     event_in_db.id])
+
+
+async def test_get_tree_with_source_id(app, source_event_in_db,
+                                       child_event_of_source_in_db,
+                                       parent_event_in_db,
+                                       event_in_db):
+    source_node = await app["db"].event.get_tree(
+        source_event_in_db.id, traversal="source_id")
+    assert source_node.event == source_event_in_db
+    assert [c.event for c in source_node.children] == [
+        child_event_of_source_in_db, parent_event_in_db]
+    assert source_node.children[1].children[0].event == event_in_db
+
+    parent_node = await app["db"].event.get_tree(
+        parent_event_in_db.id, traversal="source_id")
+    assert [c.event for c in parent_node.children] == [event_in_db]
+
+
+async def test_trace_with_source_id(app, source_event_in_db,
+                                    parent_event_in_db,
+                                    event_in_db):
+    event_db = app["db"].event
+    result = await event_db.trace(event_in_db.id, traversal="source_id")
+    assert result == [event_in_db, parent_event_in_db, source_event_in_db]
+
+
+async def test_trace_with_source_id_outside_of_family(app, event):
+    """
+    parents that do not share the source id are still followed.
+    """
+    parent = deepcopy(event)
+    parent.id = event.parent_id
+    parent.parent_id = ""
+    parent.source_id = ""
+    await app["db"].event.save(parent)
+    await app["db"].event.save(event)
+    result = await app["db"].event.trace(event.id, traversal="source_id")
+    assert result == [event, parent]
+
+
+@pytest.fixture
+def event_cache(app):
+    app["db"].event.cache = LRUCache(10, 60, name="event_cache")
+    yield app["db"].event.cache
+    app["db"].event.cache = None
+
+
+async def test_find_by_id_with_cache(app, event_cache, event_in_db):
+    metrics.reset()
+    assert await app["db"].event.find_by_id(event_in_db.id) == event_in_db
+    result = await app["db"].event.find_by_id(event_in_db.id)
+    assert result == event_in_db
+    # every read returns its own copy of the event.
+    result.tags["status"] = ["Fail"]
+    assert await app["db"].event.find_by_id(event_in_db.id) == event_in_db
+    assert metrics.get_metrics()["event_cache.hits"] == 2
+    assert metrics.get_metrics()["event_cache.misses"] == 1
+
+
+@pytest.mark.parametrize("write", ["update", "merge", "delete"])
+async def test_writes_invalidate_cache(app, event_cache, event_in_db, write):
+    await app["db"].event.find_by_id(event_in_db.id)
+    new_event = attr.evolve(event_in_db, description="new description",
+                            tags={"status": ["Fail"]})
+    if write == "update":
+        await app["db"].event.update_by_id(event_in_db.id, new_event)
+    elif write == "merge":
+        await app["db"].event.merge_by_id(event_in_db.id, new_event)
+    else:
+        await app["db"].event.delete_by_id(event_in_db.id)
+        with pytest.raises(HTTPNotFound):
+            await app["db"].event.find_by_id(event_in_db.id)
+        return
+    result = await app["db"].event.find_by_id(event_in_db.id)
+    assert "Fail" in result.tags["status"]
+
+
+async def test_save_many_invalidates_cache(app, event_cache, event):
+    with pytest.raises(HTTPNotFound):
+        await app["db"].event.find_by_id(event.id)
+    await app["db"].event.save_many([event])
+    assert await app["db"].event.find_by_id(event.id) == event
+
+
+async def test_find_by_parent_id_with_cache(app, event_cache, parent_event_in_db,
+                                            event_in_db):
+    for _ in range(2):
+        result = []
+        async for doc in await app["db"].event.find_by_parent_id(parent_event_in_db.id):
+            result.append(doc)
+        assert result == [event_in_db]
+    assert metrics.get_metrics()["event_cache.hits"] >= 1
+
+
+async def test_new_child_invalidates_cached_children(app, event_cache,
+                                                     parent_event_in_db,
+                                                     event_in_db):
+    async for _ in await app["db"].event.find_by_parent_id(parent_event_in_db.id):
+        pass
+    sibling = attr.evolve(event_in_db, id="sibling")
+    await app["db"].event.save(sibling)
+    result = []
+    async for doc in await app["db"].event.find_by_parent_id(parent_event_in_db.id):
+        result.append(doc.id)
+    assert set(result) == {event_in_db.id, "sibling"}
+
+
+@pytest.mark.parametrize("traversal", TRAVERSALS)
+async def test_get_tree_with_cache(app, event_cache, source_event_in_db,
+                                   parent_event_in_db, event_in_db, traversal):
+    tree = await app["db"].event.get_tree(source_event_in_db.id, traversal)
+    assert await app["db"].event.get_tree(source_event_in_db.id, traversal) == tree
+    child = attr.evolve(event_in_db, id="new-child")
+    await app["db"].event.save(child)
+    tree = await app["db"].event.get_tree(source_event_in_db.id, traversal)
+    grandchildren = tree.children[0].children
+    assert "new-child" in [node.event.id for node in grandchildren]
+
+
+@pytest.mark.parametrize("traversal", TRAVERSALS)
+async def test_get_tree_with_fields(app, source_event_in_db, parent_event_in_db,
+                                    event_in_db, traversal):
+    tree = await app["db"].event.get_tree(
+        source_event_in_db.id, traversal, fields=["id", "tags.environment"])
+    parent = tree.children[0].event
+    assert parent.id == parent_event_in_db.id
+    assert parent.parent_id == source_event_in_db.id
+    assert parent.tags == {"environment": parent_event_in_db.tags["environment"]}
+    assert parent.description == ""
+    assert tree.children[0].children[0].event.id == event_in_db.id
+
+
+@pytest.mark.parametrize("frm_offset, to_offset", [
+    (timedelta(hours=-1), timedelta(hours=1)),
+    (timedelta(hours=-1), None),
+    (None, timedelta(hours=1)),
+    (timedelta(days=2), timedelta(days=3)),
+])
+async def test_find_with_tag_time(app, event_in_db, parent_event_in_db,
+                                  frm_offset, to_offset):
+    frm = event_in_db.start_time + frm_offset if frm_offset else None
+    to = event_in_db.start_time + to_offset if to_offset else None
+    query = {"tags": ["environment:monitor_live", "services:tycho"],
+             "frm": frm, "to": to}
+
+    expected = [e.id async for e in await app["db"].event.find(**query)]
+    app["db"].event.tag_time = True
+    await backfill_tag_time(app)
+    assert [e.id async for e in await app["db"].event.find(**query)] == expected
+
+
+async def test_merge_keeps_tag_time(app, event_in_db):
+    app["db"].event.tag_time = True
+    new_event = Event(id=event_in_db.id, tags={"status": ["failed"]},
+                      start_time=event_in_db.start_time - timedelta(days=1),
+                      end_time=event_in_db.end_time)
+    await app["db"].event.merge_by_id(event_in_db.id, new_event)
+    document = await app["db"].event.collection.find_one({"_id": event_in_db.id})
+    assert sorted(document["tag_time"], key=lambda p: (p["t"], p["time"])) == \
+        tag_time(document["tags"], document["time"])
+
+
+@pytest.mark.parametrize(["tag_kv", "tag_time"], [
+    (False, False), (True, False), (True, True),
+])
+async def test_find_with_tag_prefixes(app, event_in_db, parent_event_in_db,
+                                      tag_kv, tag_time):
+    app["db"].event.tag_kv = tag_kv
+    app["db"].event.tag_time = tag_time
+    await backfill_tag_time(app)
+    await backfill_tag_kv(app)
+    docs = await app["db"].event.find(
+        tags=["environment:monitor_live"], tag_prefixes=["services:ty"],
+        frm=event_in_db.start_time - timedelta(days=1))
+    assert event_in_db.id in [e.id async for e in docs]
+    docs = await app["db"].event.find(tag_prefixes=["services:tychoo"])
+    assert [e.id async for e in docs] == []
+
+
+async def test_find_with_tag_kv(app, event_in_db, parent_event_in_db):
+    query = {"tags": ["environment:monitor_live", "services:tycho"]}
+    expected = [e.id async for e in await app["db"].event.find(**query)]
+    app["db"].event.tag_kv = True
+    await backfill_tag_kv(app)
+    assert [e.id async for e in await app["db"].event.find(**query)] == expected
+
+
+async def test_merge_keeps_tag_kv(app, event_in_db):
+    app["db"].event.tag_kv = True
+    new_event = Event(id=event_in_db.id, tags={"status": ["failed"]},
+                      start_time=event_in_db.start_time,
+                      end_time=event_in_db.end_time)
+    await app["db"].event.merge_by_id(event_in_db.id, new_event)
+    document = await app["db"].event.collection.find_one({"_id": event_in_db.id})
+    assert document["tag_kv"] == tag_kv(document["tags"])
+
+
+async def test_find_with_fields(app, parent_event_in_db, event_in_db):
+    result = []
+    async for event in await app["db"].event.find(
+            fields=["source_id", "description"]):
+        result.append(event)
+    assert [e.id for e in result] == [parent_event_in_db.id, event_in_db.id]
+    assert result[1].source_id == event_in_db.source_id
+    assert result[1].parent_id == event_in_db.parent_id
+    assert result[1].description == event_in_db.description
+    assert result[1].tags == {}
+    assert result[1].detail_urls == {}
+
+
+async def test_find_by_parent_id_with_fields_and_cache(app, event_cache,
+                                                       parent_event_in_db,
+                                                       event_in_db):
+    docs = await app["db"].event.find_by_parent_id(
+        parent_event_in_db.id, fields=["tags.services"])
+    assert [e.tags async for e in docs] == [{"services": ["tycho"]}]
+    # children read with fields are not cached.
+    assert len(event_cache) == 0
+
+
+async def test_moving_event_invalidates_cached_tree(app, event_cache,
+                                                    source_event_in_db,
+                                                    parent_event_in_db,
+                                                    event_in_db):
+    await app["db"].event.get_tree(parent_event_in_db.id)
+    await app["db"].event.update_by_id(
+        event_in_db.id, attr.evolve(event_in_db, parent_id=source_event_in_db.id))
+    tree = await app["db"].event.get_tree(parent_event_in_db.id)
+    assert tree.children == []
+
+
+async def test_fingerprint_tree(app, source_event_in_db, parent_event_in_db,
+                                event):
+    fingerprint = await app["db"].event.fingerprint_tree(source_event_in_db.id)
+    assert await app["db"].event.fingerprint_tree(source_event_in_db.id) == fingerprint
+    await app["db"].event.save(event)
+    after_save = await app["db"].event.fingerprint_tree(source_event_in_db.id)
+    assert after_save != fingerprint
+    await app["db"].event.update_by_id(event.id, event)
+    assert await app["db"].event.fingerprint_tree(source_event_in_db.id) != after_save
+    await app["db"].event.delete_by_id(event.id)
+    assert await app["db"].event.fingerprint_tree(source_event_in_db.id) != after_save
+
+
+async def test_fingerprint_tree_without_ancestors(app, source_event_in_db,
+                                                 parent_event_in_db, event_in_db):
+    await app["db"].event.collection.update_one(
+        {"_id": event_in_db.id}, {"$unset": {"ancestors": ""}})
+    assert await app["db"].event.fingerprint_tree(source_event_in_db.id) is None
+
+
+async def test_fingerprint_tree_past_max_depth(app, source_event_in_db,
+                                               parent_event_in_db):
+    await app["db"].event.collection.update_one(
+        {"_id": parent_event_in_db.id},
+        {"$set": {"depth": MAX_RECURSIVE_DEPTH - 1}})
+    assert await app["db"].event.fingerprint_tree(source_event_in_db.id) is None
+
+
+async def test_fingerprint_trace_without_ancestors(app, event_in_db):
+    await app["db"].event.collection.update_one(
+        {"_id": event_in_db.id}, {"$unset": {"ancestors": ""}})
+    assert await app["db"].event.fingerprint_trace(event_in_db.id) is None
+    assert await app["db"].event.fingerprint_trace("nonexistent") is None
+
+
+async def test_delete_by_id_records_tombstone(app, event_in_db):
+    assert await app["db"].event.delete_by_id(event_in_db.id)
+    tombstone = await app["db"].event.deletions.collection.find_one(
+        {"_id": event_in_db.id})
+    assert tombstone["parent_id"] == event_in_db.parent_id
+    assert "parent_id:{0}".format(event_in_db.parent_id) in tombstone["tags"]
+    assert "tag_kv" not in tombstone
+
+
+async def test_delete_by_id_records_tombstone_with_tag_kv(app, event_in_db):
+    app["db"].event.tag_kv = True
+    assert await app["db"].event.delete_by_id(event_in_db.id)
+    tombstone = await app["db"].event.deletions.collection.find_one(
+        {"_id": event_in_db.id})
+    assert tombstone["tag_kv"] == tag_kv(tombstone["tags"])
+
+
+async def test_writes_without_tag_time_nor_tag_kv(app, event_in_db):
+    document = await app["db"].event.collection.find_one({"_id": event_in_db.id})
+    assert "tag_time" not in document
+    assert "tag_kv" not in document
+    app["db"].event.tag_kv = True
+    await app["db"].event.update_by_id(event_in_db.id, event_in_db)
+    document = await app["db"].event.collection.find_one({"_id": event_in_db.id})
+    assert document["tag_kv"] == tag_kv(document["tags"])
+    # merges drop the fields no longer maintained, for backfill to redo.
+    app["db"].event.tag_kv = False
+    await app["db"].event.merge_by_id(event_in_db.id, event_in_db)
+    document = await app["db"].event.collection.find_one({"_id": event_in_db.id})
+    assert "tag_kv" not in document
+
+
+async def test_find_changes(app, source_event_in_db, parent_event_in_db,
+                            event_in_db):
+    since = datetime.utcnow() - timedelta(minutes=1)
+    query = {"ancestors": source_event_in_db.id}
+    events, deleted, until, _ = await app["db"].event.find_changes(query, since)
+    assert [e.id for e in events] == [parent_event_in_db.id, event_in_db.id]
+    assert deleted == []
+
+    # reported right away, along with the events written since.
+    await app["db"].event.delete_by_id(event_in_db.id)
+    events, deleted, _, _ = await app["db"].event.find_changes(query, until)
+    assert deleted == [event_in_db.id]
+
+    # written again after it was deleted.
+    with patch("tycho.db.event.serialize.datetime") as mock_datetime:
+        mock_datetime.utcnow.return_value = datetime.utcnow() + timedelta(seconds=1)
+        await app["db"].event.save(event_in_db)
+    events, deleted, _, _ = await app["db"].event.find_changes(query, until)
+    assert event_in_db.id in [e.id for e in events]
+    assert deleted == []
+
+
+async def test_find_changes_with_count(app, source_event_in_db,
+                                       parent_event_in_db, event_in_db):
+    since = datetime.utcnow() - timedelta(minutes=1)
+    events, _, until, _ = await app["db"].event.find_changes({}, since, count=1)
+    assert len(events) == 1
+    assert until > since
+
+
+async def test_find_changes_with_count_pages_through_same_update_time(app, event):
+    since = datetime.utcnow() - timedelta(minutes=1)
+    events = []
+    for i in range(5):
+        new_event = deepcopy(event)
+        new_event.id = "event-{0}".format(i)
+        events.append(new_event)
+    # saved with a single write, all within the same millisecond.
+    with patch("tycho.db.event.serialize.datetime") as mock_datetime:
+        mock_datetime.utcnow.return_value = datetime.utcnow()
+        assert await app["db"].event.save_many(events) == {}
+
+    ids = []
+    after = None
+    for _ in range(len(events) + 1):
+        page, _, until, after = await app["db"].event.find_changes(
+            {}, since, count=2, after=after)
+        ids.extend(e.id for e in page)
+        if after is None:
+            break
+        since = until
+    assert after is None
+    assert ids == [e.id for e in events]
+
+
+async def test_find_changes_with_count_defers_later_deletions(
+        app, source_event_in_db, parent_event_in_db, event_in_db):
+    since = datetime.utcnow() - timedelta(minutes=1)
+    await app["db"].event.delete_by_id(event_in_db.id)
+    events, deleted, until, _ = await app["db"].event.find_changes({}, since, count=1)
+    # deleted after the last event of the full page.
+    assert deleted == []
+    events, deleted, _, _ = await app["db"].event.find_changes({}, until)
+    assert deleted == [event_in_db.id]
+
+
+async def test_find_changes_with_tag_kv_reports_deletions(app, event_in_db):
+    app["db"].event.tag_kv = True
+    since = datetime.utcnow() - timedelta(minutes=1)
+    query = app["db"].event.tags_query(["services:tycho"])
+    await app["db"].event.delete_by_id(event_in_db.id)
+    events, deleted, _, _ = await app["db"].event.find_changes(query, since)
+    assert events == []
+    assert deleted == [event_in_db.id]
+
+
+async def test_find_changes_since_aware_time(app, event_in_db):
+    since = datetime.now(timezone.utc) - timedelta(minutes=1)
+    events, _, _, _ = await app["db"].event.find_changes({}, since)
+    assert event_in_db.id in [e.id for e in events]
+
+
+async def test_find_changes_since_forgotten_deletions(app):
+    with pytest.raises(ValueError):
+        await app["db"].event.find_changes({}, datetime(2000, 1, 1))
+
+
 async def test_delete_event(app, event_in_db):
     result = await app["db"].event.delete_by_id(event_in_db.id)
     assert True == result
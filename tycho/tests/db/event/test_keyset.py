@@ -0,0 +1,53 @@
+import pytest
+from datetime import datetime
+
+from tycho.db.event.keyset import (
+    after_query, changes_after_query, decode_after, encode_after, encode_changes_after)
+
+
+def test_encode_after_uses_latest_time():
+    start_time = datetime(2018, 12, 31, 18, 38, 52, 345000)
+    end_time = datetime(2018, 12, 31, 18, 58, 52, 345000)
+    after = encode_after({"_id": "abc", "time": [start_time, end_time]},
+                         "time")
+    assert decode_after(after, "time") == (end_time, "abc")
+
+
+def test_encode_after_update_time():
+    update_time = datetime(2018, 12, 31, 18, 38, 52, 345000)
+    after = encode_after({"_id": "abc", "update_time": update_time},
+                         "update_time")
+    assert decode_after(after, "update_time") == (update_time, "abc")
+
+
+@pytest.mark.parametrize("after", ["", "not a cursor", "e30="])
+def test_decode_after_invalid_cursor(after):
+    with pytest.raises(ValueError):
+        decode_after(after, "time")
+
+
+def test_decode_after_for_another_time_field():
+    after = encode_after({"_id": "abc", "update_time": datetime.utcnow()},
+                         "update_time")
+    with pytest.raises(ValueError):
+        decode_after(after, "time")
+
+
+def test_after_query():
+    time = datetime(2018, 12, 31, 18, 38, 52, 345000)
+    after = encode_after({"_id": "abc", "time": [time]}, "time")
+    time_condition, condition = after_query(after, "time")
+    assert time_condition == {"$not": {"$gt": time}}
+    assert condition == {"$nor": [{"time": time, "_id": {"$gte": "abc"}}]}
+
+
+def test_changes_after_query():
+    update_time = datetime(2018, 12, 31, 18, 38, 52, 345000)
+    after = encode_changes_after({"_id": "abc", "update_time": update_time})
+    assert changes_after_query(after) == {
+        "update_time": {"$gte": update_time},
+        "$nor": [{"update_time": update_time, "_id": {"$lte": "abc"}}],
+    }
+    # not a cursor of a listing sorted on update_time.
+    with pytest.raises(ValueError):
+        decode_after(after, "update_time")
@@ -0,0 +1,41 @@
+import re
+
+from tycho.db.event.merge import merge_filter, merge_pipeline
+from tycho.db.event.serialize import serialize_to_db_event
+from tycho.models.event import Event
+
+
+def test_merge_filter_without_reserved_keys():
+    assert merge_filter(Event(id="a")) == {}
+
+
+def test_merge_filter_with_reserved_keys():
+    conditions = merge_filter(Event(id="a", source_id="s", parent_id="p"))["$and"]
+    assert conditions[0]["$or"][0] == {"tags": "source_id:s"}
+    assert conditions[1]["$or"][0] == {"tags": "parent_id:p"}
+    assert conditions[1]["$or"][1] == {"tags": {"$not": re.compile("^parent_id:")}}
+
+
+def test_merge_pipeline_protects_values():
+    new_event = serialize_to_db_event(
+        Event(id="a", description="$description", tags={"k": ["$v"]}))
+    new_event["ancestors"], new_event["depth"] = [], 0
+    merge = merge_pipeline(new_event)[0]["$set"]
+    assert merge["description"]["$cond"][1] == {"$literal": "$description"}
+    assert merge["tags"]["$concatArrays"][1]["$filter"]["input"] == \
+        {"$literal": ["k:$v"]}
+
+
+def test_merge_pipeline_without_description_keeps_it():
+    new_event = serialize_to_db_event(Event(id="a"))
+    new_event["ancestors"], new_event["depth"] = [], 0
+    merge = merge_pipeline(new_event)[0]["$set"]
+    assert merge["description"] == {"$ifNull": ["$description", ""]}
+
+
+def test_merge_pipeline_removes_derived_fields_not_written():
+    new_event = serialize_to_db_event(Event(id="a"), with_tag_kv=True)
+    new_event["ancestors"], new_event["depth"] = [], 0
+    pipeline = merge_pipeline(new_event)
+    assert list(pipeline[1]["$set"]) == ["tag_kv"]
+    assert pipeline[2] == {"$unset": ["tag_time"]}
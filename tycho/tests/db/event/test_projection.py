@@ -0,0 +1,38 @@
+import pytest
+
+from tycho.db.event.projection import REQUIRED_PROJECTION, check_fields, projection
+
+
+def _tag_prefixes(result):
+    return [condition["$eq"][1] for condition in result["tags"]["$filter"]["cond"]["$or"]]
+
+
+def test_projection_without_fields():
+    assert projection(None) is None
+    assert projection([]) is None
+
+
+def test_projection_of_top_level_fields():
+    result = projection(["id", "start_time", "description", "detail_urls"])
+    assert {k: v for k, v in result.items() if k != "tags"} == dict(
+        REQUIRED_PROJECTION, description=1, detail_urls=1)
+    # the parent id is always read, to assemble trees.
+    assert _tag_prefixes(result) == ["parent_id:"]
+
+
+def test_projection_of_some_tags():
+    result = projection(["source_id", "tags.environment", "tags.type"])
+    assert "description" not in result
+    assert sorted(_tag_prefixes(result)) == sorted(
+        ["parent_id:", "environment:", "type:", "source_id:"])
+
+
+def test_projection_of_every_tag():
+    result = projection(["tags", "tags.environment"])
+    assert result["tags"] == 1
+
+
+@pytest.mark.parametrize("fields", [["time"], ["_id"], ["tags."], ["ancestors"]])
+def test_check_fields_rejects_unknown_fields(fields):
+    with pytest.raises(ValueError):
+        check_fields(fields)
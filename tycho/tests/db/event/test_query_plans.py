@@ -0,0 +1,229 @@
+"""
+Checks that every query the event DB issues is served by an index.
+
+Each query shape runs against a synthetic dataset, see
+tycho.scripts.synthetic_events, while the queries sent to MongoDB are
+recorded. Every one of them is then explained, and fails when MongoDB
+scans the whole collection, sorts without a limit in memory, or
+examines more than MAX_EXAMINED_RATIO documents per document returned.
+"""
+import pytest
+from datetime import datetime, timedelta
+
+from tycho.db.event import Event, TRAVERSALS
+from tycho.scripts.create_indexes import create_indexes
+from tycho.scripts.synthetic_events import make_dataset, save_dataset
+
+MAX_EXAMINED_RATIO = 10
+WIDTH = 100
+DEPTH = 30
+COUNT = 1000
+
+
+class RecordingCollection:
+    """
+    forwards every call to collection, and records the reads, to
+    explain them once they ran.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.cursors = []
+        self.pipelines = []
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, *args, **kwargs):
+        cursor = self._collection.find(*args, **kwargs)
+        self.cursors.append(cursor)
+        return cursor
+
+    def find_one(self, filter=None, *args, **kwargs):
+        self.cursors.append(self._collection.find(filter, *args, **kwargs).limit(1))
+        return self._collection.find_one(filter, *args, **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return self._collection.aggregate(pipeline, **kwargs)
+
+
+@pytest.fixture
+def dataset(loop, db):
+    loop.run_until_complete(create_indexes({"db": db}))
+    events = make_dataset(WIDTH, DEPTH, COUNT)
+    # stored for the shapes that query through them, see _find_with.
+    db.event.tag_time = db.event.tag_kv = True
+    assert loop.run_until_complete(save_dataset(db.event, events)) == {}
+    db.event.tag_time = db.event.tag_kv = False
+    return events
+
+
+@pytest.fixture
+def recorded(db, dataset):
+    collections = [RecordingCollection(db.event.collection),
+                   RecordingCollection(db.event.deletions.collection)]
+    db.event.collection, db.event.deletions.collection = collections
+    return collections
+
+
+async def _read(result):
+    if hasattr(result, "__aiter__"):
+        return [item async for item in result]
+    return result
+
+
+async def _find_after(event):
+    docs = await event.find(count=10)
+    await _read(docs)
+    return await event.find(count=10, after=event.next_after(docs))
+
+
+async def _find_with(event, flag, **query):
+    setattr(event, flag, True)
+    return await event.find(**query)
+
+
+def _last_day():
+    return {"frm": datetime.utcnow() - timedelta(days=1), "to": datetime.utcnow()}
+
+
+# the query shapes issued by the service, and whether they are allowed
+# to sort in memory, bounded by their limit. Events are sorted on their
+# time, an array, which an index can only sort when the times are not
+# bounded; tags and tag_time are not indexed along with the time at all.
+SHAPES = [
+    pytest.param(lambda event: event.find(), False, id="find"),
+    pytest.param(lambda event: event.find(tags=["environment:qa"]), True,
+                 id="find_by_tag"),
+    pytest.param(lambda event: event.find(tags=["environment:qa", "key0:value1"]), True,
+                 id="find_by_tags"),
+    pytest.param(lambda event: event.find(**_last_day()), True,
+                 id="find_by_time"),
+    pytest.param(lambda event: event.find(tags=["key0:value1"], **_last_day()), True,
+                 id="find_by_tags_and_time", marks=pytest.mark.xfail(
+                     reason="either the tag or the time range bounds the scan, "
+                            "see find_by_tag_time")),
+    pytest.param(lambda event: _find_with(event, "tag_time", tags=["key0:value1"],
+                                          **_last_day()), True,
+                 id="find_by_tag_time"),
+    pytest.param(lambda event: event.find(tag_prefixes=["services:svc-1"]), True,
+                 id="find_by_tag_prefix"),
+    pytest.param(lambda event: _find_with(event, "tag_kv", tags=["key0:value1"],
+                                          tag_prefixes=["services:svc-1"]), True,
+                 id="find_by_tag_kv"),
+    pytest.param(lambda event: event.find(
+        use_update_time=True, frm=datetime.utcnow() - timedelta(hours=1)), False,
+        id="find_by_update_time"),
+    pytest.param(_find_after, True, id="find_after"),
+    pytest.param(lambda event: event.find_by_id("chain-0"), False, id="find_by_id"),
+    pytest.param(lambda event: event.find_by_parent_id("deploy-root"), False,
+                 id="find_by_parent_id"),
+    pytest.param(lambda event: event.find_by_parent_id(
+        "deploy-root", fields=["tags.services"]), False,
+        id="find_by_parent_id_with_fields"),
+    pytest.param(lambda event: event.find_by_source_id("deploy-root"), False,
+                 id="find_by_source_id"),
+    pytest.param(lambda event: event.find_descendants("chain-0"), False,
+                 id="find_descendants"),
+    pytest.param(lambda event: event.fingerprint_children("deploy-root"), False,
+                 id="fingerprint_children"),
+    pytest.param(lambda event: event.fingerprint_tree("deploy-root"), False,
+                 id="fingerprint_tree"),
+    pytest.param(lambda event: event.fingerprint_trace("chain-{0}".format(DEPTH - 1)),
+                 False, id="fingerprint_trace"),
+    pytest.param(lambda event: event.find_changes(
+        {"tags": "parent_id:deploy-root"}, datetime.utcnow() - timedelta(hours=1), 100),
+        True, id="find_changes"),
+] + [
+    pytest.param(lambda event, traversal=traversal: event.get_tree(
+        "deploy-root", traversal), False, id="get_tree_" + traversal)
+    for traversal in TRAVERSALS
+] + [
+    pytest.param(lambda event, traversal=traversal: event.trace(
+        "chain-{0}".format(DEPTH - 1), traversal), False, id="trace_" + traversal)
+    for traversal in TRAVERSALS
+]
+
+
+@pytest.mark.parametrize(["run", "sorts_in_memory"], SHAPES)
+async def test_query_plan(loop, db, recorded, run, sorts_in_memory):
+    await _read(await run(db.event))
+    explained = 0
+    for collection in recorded:
+        for cursor in collection.cursors:
+            explain = await cursor.explain()
+            assert _plan_problems(explain, sorts_in_memory) == [], \
+                explain["queryPlanner"]["parsedQuery"]
+            explained += 1
+        for pipeline in collection.pipelines:
+            assert _pipeline_problems(pipeline, Event.indexes) == [], pipeline
+            # the stages after the $match read the matched events only.
+            cursor = collection._collection.find(pipeline[0]["$match"])
+            assert _plan_problems(await cursor.explain(), sorts_in_memory) == [], pipeline
+            explained += 1
+    assert explained
+
+
+def _plan_problems(explain, sorts_in_memory=False):
+    problems = []
+    plan = explain["queryPlanner"]["winningPlan"]
+    for stage in _stages(plan.get("queryPlan", plan)):
+        if stage["stage"] == "COLLSCAN":
+            problems.append("COLLSCAN")
+        if stage["stage"] == "SORT" and not (sorts_in_memory and stage.get("limitAmount")):
+            problems.append("in-memory SORT")
+    stats = explain["executionStats"]
+    if stats["totalDocsExamined"] > MAX_EXAMINED_RATIO * max(stats["nReturned"], 1):
+        problems.append("{0} documents examined for {1} returned".format(
+            stats["totalDocsExamined"], stats["nReturned"]))
+    return problems
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def _pipeline_problems(pipeline, indexes):
+    """
+    explain does not tell how $graphLookup finds the documents it
+    connects to, so the field it connects to must lead an index.
+    """
+    problems = []
+    if "$match" not in pipeline[0]:
+        problems.append("the pipeline does not start with $match")
+    leading_fields = {"_id"} | {index["keys"][0][0] for index in indexes}
+    for stage in pipeline:
+        lookup = stage.get("$graphLookup")
+        if lookup and lookup["connectToField"] not in leading_fields:
+            problems.append("$graphLookup connects to {0}, which is not indexed".format(
+                lookup["connectToField"]))
+    return problems
+
+
+def test_plan_problems():
+    explain = {
+        "queryPlanner": {"winningPlan": {"stage": "SORT", "limitAmount": 10, "inputStage": {
+            "stage": "COLLSCAN"}}},
+        "executionStats": {"totalDocsExamined": 1000, "nReturned": 10},
+    }
+    assert _plan_problems(explain, sorts_in_memory=True) == [
+        "COLLSCAN", "1000 documents examined for 10 returned"]
+    assert "in-memory SORT" in _plan_problems(explain)
+
+
+def test_pipeline_problems():
+    pipeline = [{"$match": {"_id": "a"}}, {"$graphLookup": {
+        "from": "event", "startWith": "$_id", "connectFromField": "_id",
+        "connectToField": "parent", "as": "descendant"}}]
+    assert _pipeline_problems(pipeline, Event.indexes) == [
+        "$graphLookup connects to parent, which is not indexed"]
+    pipeline[1]["$graphLookup"]["connectToField"] = "parent_id"
+    assert _pipeline_problems(pipeline, Event.indexes) == []
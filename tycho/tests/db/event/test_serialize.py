@@ -46,6 +46,13 @@ def test_serialize_to_db_event_tag_fields(patch_update_time, update_time):
     assert event_db_dict["update_time"] == update_time
 
 
+def test_serialize_to_db_event_parent_id(patch_update_time, update_time):
+    event_db_dict = serialize_to_db_event(Event(parent_id="123"))
+    assert event_db_dict["tags"] == ["parent_id:123"]
+    assert event_db_dict["parent_id"] == "123"
+    assert serialize_to_db_event(Event())["parent_id"] == ""
+
+
 def test_serialize_to_db_event_tag_field_array_tag(patch_update_time,
                                                    update_time):
     event_db_dict = serialize_to_db_event(
@@ -94,7 +101,7 @@ def test_serialize_to_db_detail_urls_donot_exist():
 
 
 def test_serialize_to_db_event_all_fields(app, event, eventdb, patch_update_time):
-    result = serialize_to_db_event(event)
+    result = serialize_to_db_event(event, with_tag_time=True, with_tag_kv=True)
     result["tags"] = sorted(result["tags"])
     eventdb.tags = sorted(eventdb.tags)
     assert result == eventdb.asdict()
@@ -104,3 +111,27 @@ def test_serialize_to_db_event_with_dot_in_detail_urls_key(event):
     event.detail_urls["foo.bar"] = "abcd"
     result = serialize_to_db_event(event)
     assert result["detail_urls"]["foo~dot~bar"] == "abcd"
+
+
+def test_serialize_to_db_event_version():
+    assert serialize_to_db_event(Event())["version"] == 1
+
+
+def test_serialize_to_db_event_without_tag_time_nor_tag_kv(event):
+    result = serialize_to_db_event(event)
+    assert "tag_time" not in result
+    assert "tag_kv" not in result
+
+
+def test_serialize_to_db_event_tag_time(event):
+    result = serialize_to_db_event(event, with_tag_time=True)
+    assert {"t": "services:tycho", "time": event.start_time} in result["tag_time"]
+    assert {"t": "services:tycho", "time": event.end_time} in result["tag_time"]
+    assert len(result["tag_time"]) == 2 * len(result["tags"])
+
+
+def test_serialize_to_db_event_tag_kv(event):
+    result = serialize_to_db_event(event, with_tag_kv=True)
+    assert {"k": "services", "v": "tycho"} in result["tag_kv"]
+    assert {"k": "parent_id", "v": event.parent_id} in result["tag_kv"]
+    assert len(result["tag_kv"]) == len(result["tags"])
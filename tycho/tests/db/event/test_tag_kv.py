@@ -0,0 +1,41 @@
+import pytest
+
+from tycho.db.event.tag_kv import (
+    prefix_regex, split_tag, tag_kv, tag_kv_query, tags_query)
+
+
+def test_tag_kv_splits_on_the_first_colon():
+    assert tag_kv(["a:1", "url:http://host"]) == [
+        {"k": "a", "v": "1"},
+        {"k": "url", "v": "http://host"},
+    ]
+
+
+def test_split_tag_without_value():
+    with pytest.raises(ValueError):
+        split_tag("services")
+
+
+def test_prefix_regex_escapes_the_prefix():
+    regex = prefix_regex("a.b")
+    assert regex.match("a.b-c")
+    assert not regex.match("axb")
+    assert not regex.match("c-a.b")
+
+
+def test_tag_kv_query():
+    query = tag_kv_query(["a:1"], ["services:check"])
+    assert query == {"tag_kv": {"$all": [
+        {"$elemMatch": {"k": "a", "v": "1"}},
+        {"$elemMatch": {"k": "services", "v": prefix_regex("check")}},
+    ]}}
+
+
+def test_tags_query():
+    assert tags_query(["a:1"], ["services:check"]) == {"tags": {"$all": [
+        "a:1", prefix_regex("services:check")]}}
+
+
+def test_tags_query_with_invalid_prefix():
+    with pytest.raises(ValueError):
+        tags_query(None, ["services"])
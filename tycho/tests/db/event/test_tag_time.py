@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from tycho.db.event.tag_kv import prefix_regex
+from tycho.db.event.tag_time import tag_time, tag_time_query
+
+START = datetime(2020, 1, 1)
+END = datetime(2020, 1, 2)
+
+
+def test_tag_time_pairs_every_tag_with_both_times():
+    assert tag_time(["b:2", "a:1"], [START, END]) == [
+        {"t": "a:1", "time": START},
+        {"t": "a:1", "time": END},
+        {"t": "b:2", "time": START},
+        {"t": "b:2", "time": END},
+    ]
+
+
+def test_tag_time_of_instant_event():
+    assert tag_time(["a:1"], [START, START]) == [{"t": "a:1", "time": START}]
+
+
+def test_tag_time_without_tags():
+    assert tag_time([], [START, END]) == []
+
+
+def test_tag_time_query():
+    assert tag_time_query(["a:1", "b:2"], START, END) == {"tag_time": {"$all": [
+        {"$elemMatch": {"t": "a:1", "time": {"$gte": START, "$lt": END}}},
+        {"$elemMatch": {"t": "b:2", "time": {"$gte": START, "$lt": END}}},
+    ]}}
+
+
+def test_tag_time_query_with_open_range():
+    assert tag_time_query(["a:1"], frm=START) == {"tag_time": {"$all": [
+        {"$elemMatch": {"t": "a:1", "time": {"$gte": START}}},
+    ]}}
+
+
+def test_tag_time_query_with_prefixes():
+    query = tag_time_query(["a:1"], frm=START, prefixes=["services:check"])
+    assert query == {"tag_time": {"$all": [
+        {"$elemMatch": {"t": "a:1", "time": {"$gte": START}}},
+        {"$elemMatch": {"t": prefix_regex("services:check"), "time": {"$gte": START}}},
+    ]}}
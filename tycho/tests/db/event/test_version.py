@@ -0,0 +1,18 @@
+from tycho.db.event.version import (
+    UNVERSIONED, replace_pipeline, version_filter)
+
+
+def test_version_filter():
+    assert version_filter(3) == {"version": 3}
+
+
+def test_version_filter_for_unversioned_events():
+    assert version_filter(UNVERSIONED) == {"version": {"$exists": False}}
+
+
+def test_replace_pipeline_moves_to_next_version():
+    doc = {"_id": "a", "description": "$description", "version": 1}
+    pipeline = replace_pipeline(doc)
+    merged = pipeline[0]["$replaceWith"]["$mergeObjects"]
+    assert merged[0] == {"$literal": doc}
+    assert merged[1] == {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}
@@ -0,0 +1,100 @@
+import pytest
+
+from tycho import metrics
+from tycho.db.cache import LRUCache, create_cache
+from tycho.models.config import Cache
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(clock):
+    metrics.reset()
+    return LRUCache(2, 10, name="test_cache", clock=clock)
+
+
+def test_get_and_set(cache):
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert metrics.get_metrics() == {"test_cache.hits": 1, "test_cache.misses": 1}
+
+
+def test_evicts_least_recently_used(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert metrics.get_metrics()["test_cache.evictions"] == 1
+
+
+def test_expires_values(cache, clock):
+    cache.set("a", 1)
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert metrics.get_metrics()["test_cache.expirations"] == 1
+
+
+def test_delete(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.delete("a", "c")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_set_after_invalidation_is_ignored(cache):
+    token = cache.token()
+    cache.delete("a")
+    cache.set("a", 1, token)
+    assert cache.get("a") is None
+    cache.set("a", 1, cache.token())
+    assert cache.get("a") == 1
+
+
+def test_create_cache():
+    assert create_cache(None, "event_cache") is None
+    assert create_cache(Cache({"enabled": False}), "event_cache") is None
+    # opt-in.
+    assert create_cache(Cache({}), "event_cache") is None
+    cache = create_cache(Cache({"enabled": True, "max_size": 5, "ttl_seconds": 1}),
+                         "event_cache")
+    assert cache.max_size == 5
+    assert cache.ttl_seconds == 1
+
+
+def test_invalidate_drops_dependent_values(cache):
+    cache.set("children:a", 1, depends_on=["a", "b"])
+    cache.set("event:b", 2, depends_on=["b"])
+    cache.invalidate("b")
+    assert cache.get("children:a") is None
+    assert cache.get("event:b") is None
+    assert len(cache) == 0
+
+
+def test_invalidate_ignores_evicted_values(cache):
+    cache.set("a", 1, depends_on=["x"])
+    cache.set("b", 2, depends_on=["y"])
+    cache.set("c", 3, depends_on=["y"])
+    cache.invalidate("x")
+    assert cache.get("b") == 2
+    cache.invalidate("y")
+    assert len(cache) == 0
@@ -0,0 +1,120 @@
+import pytest
+
+from tycho import metrics
+from tycho.db.cache import create_cache
+from tycho.db.shared_cache import SharedCache
+from tycho.models.config import Cache
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def open_cache(tmpdir, clock):
+    caches = []
+
+    def open_cache(ways=2, size_bytes=1024 * 4, slot_size=1024):
+        cache = SharedCache(str(tmpdir.join("cache")), size_bytes, slot_size, 10,
+                            name="test_cache", ways=ways, generations=64,
+                            clock=clock)
+        caches.append(cache)
+        return cache
+
+    metrics.reset()
+    yield open_cache
+    for cache in caches:
+        cache.close()
+
+
+def test_get_and_set(open_cache):
+    cache = open_cache()
+    assert cache.get("a") is None
+    cache.set("a", b"1")
+    assert cache.get("a") == b"1"
+    assert len(cache) == 1
+    assert metrics.get_metrics() == {"test_cache.hits": 1, "test_cache.misses": 1}
+
+
+def test_values_are_shared(open_cache):
+    cache, other_cache = open_cache(), open_cache()
+    cache.set("a", b"1", depends_on=["x"])
+    assert other_cache.get("a") == b"1"
+    other_cache.invalidate("x")
+    assert cache.get("a") is None
+
+
+def test_evicts_least_recently_used_of_set(open_cache, clock):
+    cache = open_cache(ways=2, size_bytes=2048)
+    cache.set("a", b"1")
+    clock.now += 1
+    cache.set("b", b"2")
+    clock.now += 1
+    cache.get("a")
+    cache.set("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1"
+    assert cache.get("c") == b"3"
+    assert metrics.get_metrics()["test_cache.evictions"] == 1
+
+
+def test_expires_values(open_cache, clock):
+    cache = open_cache()
+    cache.set("a", b"1")
+    clock.now += 10
+    assert cache.get("a") is None
+    assert metrics.get_metrics()["test_cache.expirations"] == 1
+
+
+def test_does_not_store_large_values(open_cache):
+    cache = open_cache(slot_size=128)
+    cache.set("a", bytes(range(256)) * 4)
+    assert cache.get("a") is None
+    assert metrics.get_metrics()["test_cache.too_large"] == 1
+
+
+def test_delete_and_clear(open_cache):
+    cache = open_cache()
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    cache.delete("a")
+    assert cache.get("a") is None
+    assert cache.get("b") == b"2"
+    cache.clear()
+    assert cache.get("b") is None
+    assert len(cache) == 0
+
+
+def test_set_after_invalidation_is_ignored(open_cache):
+    cache = open_cache()
+    token = cache.token()
+    cache.invalidate("x")
+    cache.set("a", b"1", token)
+    assert cache.get("a") is None
+
+
+def test_reopening_keeps_values(open_cache):
+    open_cache().set("a", b"1")
+    assert open_cache().get("a") == b"1"
+
+
+def test_create_shared_cache(tmpdir):
+    cache = create_cache(Cache({
+        "enabled": True, "backend": "shared", "shared_path": str(tmpdir.join("cache")),
+        "shared_size_mb": 1, "shared_slot_kb": 4,
+    }), "event_cache")
+    try:
+        assert isinstance(cache, SharedCache)
+        assert cache.nsets * cache.ways * cache.slot_size == 1024 * 1024
+    finally:
+        cache.close()
@@ -0,0 +1,95 @@
+import asyncio
+from unittest import mock
+
+from tycho import metrics
+from tycho.db.tail import EventTail, Subscription
+
+
+def _document(id, *tags):
+    return {"_id": id, "tags": list(tags), "description": id}
+
+
+def _tail(queue_size=10):
+    tail = EventTail(mock.Mock(), queue_size=queue_size)
+    # no change stream, events are dispatched by the tests.
+    tail._watch = mock.Mock(side_effect=lambda: asyncio.sleep(3600))
+    return tail
+
+
+async def _read(subscription):
+    events = []
+    while True:
+        try:
+            event = await subscription.get(0.01)
+        except asyncio.TimeoutError:
+            return events
+        if event is None:
+            return events
+        events.append(event)
+
+
+async def test_dispatch_to_matching_subscriptions(loop):
+    tail = _tail()
+    everything = tail.subscribe()
+    deploys = tail.subscribe(["type:deploy"])
+    staging_deploys = tail.subscribe(["type:deploy", "env:staging"])
+
+    tail.dispatch(_document("a", "type:deploy", "env:prod"))
+    tail.dispatch(_document("b", "type:deploy", "env:staging"))
+    tail.dispatch(_document("c", "type:alert", "env:staging"))
+
+    assert [e.id for e in await _read(everything)] == ["a", "b", "c"]
+    assert [e.id for e in await _read(deploys)] == ["a", "b"]
+    assert [e.id for e in await _read(staging_deploys)] == ["b"]
+    await tail.close()
+
+
+async def test_subscriptions_share_one_stream(loop):
+    tail = _tail()
+    first = tail.subscribe()
+    tail.subscribe()
+    assert tail._watch.call_count == 1
+
+    tail.unsubscribe(first)
+    assert tail._task is not None
+    await tail.close()
+    assert tail._task is None
+
+
+async def test_last_unsubscribe_stops_stream(loop):
+    tail = _tail()
+    subscription = tail.subscribe()
+    task = tail._task
+    tail.unsubscribe(subscription)
+    await asyncio.sleep(0)
+    assert task.cancelled()
+    assert tail._task is None
+
+
+async def test_slow_subscriber_is_dropped(loop):
+    metrics.reset()
+    tail = _tail(queue_size=2)
+    slow = tail.subscribe()
+    for id in "abc":
+        tail.dispatch(_document(id))
+    assert slow.overflowed
+    assert slow not in tail.subscriptions
+    assert await _read(slow) == []
+    assert metrics.get_metrics()["event_tail.overflows"] == 1
+    await tail.close()
+
+
+async def test_close_ends_subscriptions(loop):
+    tail = _tail()
+    subscription = tail.subscribe()
+    tail.dispatch(_document("a"))
+    await tail.close()
+    assert [event async for event in subscription] == []
+    assert not subscription.overflowed
+
+
+def test_subscription_matches_all_tags():
+    subscription = Subscription(["a:1", "b:2"])
+    assert subscription.matches({"a:1", "b:2", "c:3"})
+    assert not subscription.matches({"a:1"})
+    assert Subscription().matches(set())
@@ -0,0 +1,15 @@
+from tycho.db.utils import async_list, recorded
+
+
+async def test_recorded_passes_documents_on_end(loop):
+    ended = []
+    docs = [doc async for doc in recorded(async_list([1, 2, 3]), ended.append, limit=3)]
+    assert docs == [1, 2, 3]
+    assert ended == [[1, 2, 3]]
+
+
+async def test_recorded_stops_keeping_documents_past_limit(loop):
+    ended = []
+    docs = [doc async for doc in recorded(async_list([1, 2, 3]), ended.append, limit=2)]
+    assert docs == [1, 2, 3]
+    assert ended == []
@@ -0,0 +1,28 @@
+from tycho.db.watcher import changed_ids
+
+
+def test_changed_ids_of_written_event():
+    change = {
+        "operationType": "update",
+        "documentKey": {"_id": "c"},
+        "fullDocument": {"_id": "c", "parent_id": "b", "ancestors": ["a", "b"]},
+    }
+    assert changed_ids(change) == ["c", "b", "a", "b"]
+
+
+def test_changed_ids_of_event_without_parent():
+    change = {
+        "operationType": "insert",
+        "documentKey": {"_id": "a"},
+        "fullDocument": {"_id": "a", "parent_id": ""},
+    }
+    assert changed_ids(change) == ["a"]
+
+
+def test_changed_ids_of_deleted_event():
+    change = {"operationType": "delete", "documentKey": {"_id": "a"}}
+    assert changed_ids(change) == ["a"]
+
+
+def test_changed_ids_of_dropped_collection():
+    assert changed_ids({"operationType": "drop"}) is None
@@ -0,0 +1,68 @@
+import json
+import pytest
+from unittest import mock
+
+from tycho.models import encoder
+from tycho.models.event import CATTRS_CONVERTER
+from tycho.models.eventnode import EventNode
+from tycho.models.events_with_count import EventListWithCount
+
+
+def test_event_to_primitive_matches_cattrs(event):
+    assert encoder.event_to_primitive(event) == CATTRS_CONVERTER.unstructure(event)
+
+
+def test_dumps_event_list_with_count(event, parent_event):
+    value = EventListWithCount(count=2, result=[event, parent_event], after="cursor")
+    assert json.loads(encoder.dumps(value)) == {
+        "count": 2,
+        "result": [event.to_primitive(), parent_event.to_primitive()],
+        "after": "cursor",
+    }
+
+
+def test_dumps_event_node(event, parent_event):
+    tree = EventNode(event=parent_event, children=[EventNode(event=event)])
+    assert json.loads(encoder.dumps(tree)) == {
+        "event": parent_event.to_primitive(),
+        "children": [{"event": event.to_primitive(), "children": []}],
+    }
+
+
+def test_dumps_keeps_order_of_children(event, parent_event):
+    tree = EventNode(event=parent_event, children=[
+        EventNode(event=event), EventNode(event=parent_event)])
+    children = json.loads(encoder.dumps(tree))["children"]
+    assert [child["event"]["id"] for child in children] == [event.id, parent_event.id]
+
+
+@pytest.mark.parametrize("orjson", [encoder.orjson, None])
+def test_dumps_deep_tree(orjson, event):
+    tree = node = EventNode(event=event)
+    for _ in range(200):
+        child = EventNode(event=event)
+        node.children.append(child)
+        node = child
+    with mock.patch.object(encoder, "orjson", orjson):
+        primitive = json.loads(encoder.dumps(tree))
+    depth = 0
+    while primitive["children"]:
+        primitive = primitive["children"][0]
+        depth += 1
+    assert depth == 200
+
+
+def test_dumps_selected_fields(event, parent_event):
+    tree = EventNode(event=parent_event, children=[EventNode(event=event)])
+    primitive = json.loads(encoder.dumps(tree, ["parent_id", "tags.environment", "tags.missing"]))
+    assert primitive["event"] == {
+        "id": parent_event.id,
+        "parent_id": parent_event.parent_id,
+        "tags": {"environment": parent_event.tags["environment"]},
+    }
+    assert primitive["children"][0]["event"]["id"] == event.id
+
+
+def test_dumps_every_tag_with_selected_fields(event):
+    primitive = json.loads(encoder.dumps([event], ["tags", "tags.environment"]))
+    assert primitive == [{"id": event.id, "tags": event.tags}]
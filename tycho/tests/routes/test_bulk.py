@@ -0,0 +1,179 @@
+import asyncio
+import json
+from copy import deepcopy
+
+import pytest
+from unittest.mock import patch
+
+from tycho import metrics
+
+
+async def test_put_events(event, cli, app):
+    second_event = deepcopy(event)
+    second_event.id = "second-event"
+    resp = await cli.put('/api/v1/event/bulk',
+                         headers={"content-type": "application/json"},
+                         data=json.dumps([event.to_primitive(),
+                                          second_event.to_primitive()]))
+    assert resp.status == 200
+    assert (await resp.json()) == {
+        "count": 2, "created": 2, "results": [
+            {"id": event.id, "status": "created"},
+            {"id": second_event.id, "status": "created"},
+        ]
+    }
+    assert (await app["db"].event.find_by_id(event.id)) == event
+    assert (await app["db"].event.find_by_id(second_event.id)) == second_event
+
+
+async def test_put_events_ndjson(event, cli, app):
+    resp = await cli.put('/api/v1/event/bulk',
+                         headers={"content-type": "application/x-ndjson"},
+                         data=json.dumps(event.to_primitive()) + "\n")
+    assert resp.status == 200
+    assert (await resp.json())["created"] == 1
+    assert (await app["db"].event.find_by_id(event.id)) == event
+
+
+async def test_put_events_reports_failures_per_event(event_in_db, event, cli):
+    new_event = deepcopy(event)
+    new_event.id = "new-event"
+    resp = await cli.put('/api/v1/event/bulk',
+                         headers={"content-type": "application/json"},
+                         data=json.dumps({"events": [
+                             event_in_db.to_primitive(),
+                             {"id": ""},
+                             new_event.to_primitive(),
+                         ]}))
+    assert resp.status == 200
+    result = await resp.json()
+    assert result["count"] == 3
+    assert result["created"] == 1
+    assert [r["status"] for r in result["results"]] == [
+        "duplicate", "invalid", "created"]
+    assert result["results"][0]["error"] == \
+        "Error: id '{0}' already exists".format(event_in_db.id)
+
+
+@pytest.mark.parametrize("body", ["not json", json.dumps({"event": {}})])
+async def test_put_events_invalid_body(body, cli):
+    resp = await cli.put('/api/v1/event/bulk',
+                         headers={"content-type": "application/json"},
+                         data=body)
+    assert resp.status == 400
+
+
+async def test_post_events_merge(event_in_db, event, cli, app):
+    new_event = deepcopy(event)
+    new_event.id = "new-event"
+    resp = await cli.post('/api/v1/event/bulk',
+                          headers={"content-type": "application/json"},
+                          data=json.dumps({"operation": "merge", "events": [
+                              {"id": event_in_db.id,
+                               "tags": {"author": ["orbital@example.com"]}},
+                              new_event.to_primitive(),
+                          ]}))
+    assert resp.status == 200
+    result = await resp.json()
+    assert result["merged"] == 1
+    assert [r["status"] for r in result["results"]] == ["merged", "not_found"]
+
+    merged_event = await app["db"].event.find_by_id(event_in_db.id)
+    assert set(merged_event.tags["author"]) == {
+        "user@example.com", "orbital@example.com"}
+
+
+async def test_post_events_merge_with_insert(event, cli, app):
+    resp = await cli.post('/api/v1/event/bulk?insert=true',
+                          headers={"content-type": "application/json"},
+                          data=json.dumps([
+                              event.to_primitive(),
+                              {"id": event.id, "tags": {"author": ["orbital@example.com"]}},
+                          ]))
+    assert resp.status == 200
+    result = await resp.json()
+    assert [r["status"] for r in result["results"]] == ["created", "merged"]
+    merged_event = await app["db"].event.find_by_id(event.id)
+    assert "orbital@example.com" in merged_event.tags["author"]
+
+
+async def test_post_events_merge_applies_concurrent_merges(event_in_db, cli, app):
+    # every batch is merged by MongoDB, rather than written back
+    # over the ones applied in the meantime.
+    responses = await asyncio.gather(*[
+        cli.post('/api/v1/event/bulk',
+                 headers={"content-type": "application/json"},
+                 data=json.dumps([{"id": event_in_db.id, "tags": {"author": [str(i)]}}]))
+        for i in range(10)
+    ])
+    assert [resp.status for resp in responses] == [200] * 10
+    merged_event = await app["db"].event.find_by_id(event_in_db.id)
+    assert set(str(i) for i in range(10)) <= set(merged_event.tags["author"])
+
+
+async def test_post_events_update_with_insert(event_in_db, event, cli, app):
+    new_event = deepcopy(event)
+    new_event.id = "new-event"
+    resp = await cli.post('/api/v1/event/bulk?operation=update&insert=true',
+                          headers={"content-type": "application/x-ndjson"},
+                          data="\n".join([
+                              json.dumps({"id": event_in_db.id,
+                                          "tags": {"author": ["orbital@example.com"]}}),
+                              json.dumps(new_event.to_primitive()),
+                          ]))
+    assert resp.status == 200
+    result = await resp.json()
+    assert [r["status"] for r in result["results"]] == ["updated", "created"]
+
+    updated_event = await app["db"].event.find_by_id(event_in_db.id)
+    assert updated_event.tags == {"author": ["orbital@example.com"]}
+    assert (await app["db"].event.find_by_id(new_event.id)) == new_event
+
+
+async def test_post_events_update_retries_on_version_conflict(event_in_db, cli, app):
+    metrics.reset()
+    update_many_by_id = app["db"].event.update_many_by_id
+    concurrent_writes = [deepcopy(event_in_db)]
+
+    async def update_after_concurrent_write(*args, **kwargs):
+        if concurrent_writes:
+            concurrent_event = concurrent_writes.pop()
+            concurrent_event.description = "written meanwhile"
+            await app["db"].event.update_by_id(concurrent_event.id, concurrent_event)
+        return await update_many_by_id(*args, **kwargs)
+
+    with patch.object(app["db"].event, "update_many_by_id",
+                      new=update_after_concurrent_write):
+        resp = await cli.post('/api/v1/event/bulk?operation=update',
+                              headers={"content-type": "application/json"},
+                              data=json.dumps([{"id": event_in_db.id,
+                                                "tags": {"status": ["done"]}}]))
+    assert resp.status == 200
+    result = await resp.json()
+    assert [r["status"] for r in result["results"]] == ["updated"]
+    assert metrics.get_metrics()["event.update.version_conflicts"] == 1
+    # applied again on top of the concurrent write.
+    updated_event, version = await app["db"].event.find_by_id_with_version(event_in_db.id)
+    assert updated_event.tags == {"status": ["done"]}
+    assert version == 3
+
+
+async def test_post_events_merge_conflict(event_in_db, cli, app):
+    resp = await cli.post('/api/v1/event/bulk',
+                          headers={"content-type": "application/json"},
+                          data=json.dumps([
+                              {"id": event_in_db.id, "source_id": "another-source"},
+                              {"id": event_in_db.id, "description": "merged"},
+                          ]))
+    assert resp.status == 200
+    result = await resp.json()
+    assert [r["status"] for r in result["results"]] == ["invalid", "merged"]
+    merged_event = await app["db"].event.find_by_id(event_in_db.id)
+    assert merged_event.source_id == event_in_db.source_id
+
+
+async def test_post_events_invalid_operation(cli):
+    resp = await cli.post('/api/v1/event/bulk?operation=replace',
+                          headers={"content-type": "application/json"},
+                          data=json.dumps([]))
+    assert resp.status == 400
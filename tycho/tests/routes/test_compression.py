@@ -0,0 +1,100 @@
+import gzip
+import json
+import pytest
+from aiohttp import web
+
+from tycho.models.config import Compression
+from tycho.routes import compression
+from tycho.routes.compression import (choose_encoding, compression_middleware,
+                                      without_encoding)
+
+BODY = {"result": [{"tags": {"environment": ["monitor_live"]}}] * 1000}
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate", "gzip"),
+    ("GZIP;q=0.5", "gzip"),
+    ("gzip;q=0", None),
+    ("*", compression.ENCODINGS[0][0]),
+    ("*, gzip;q=0", compression.ENCODINGS[0][0]
+     if compression.ENCODINGS[0][0] != "gzip" else None),
+])
+def test_choose_encoding(accept_encoding, expected):
+    encoding = choose_encoding(accept_encoding)
+    assert (encoding and encoding[0]) == expected
+
+
+def test_choose_encoding_prefers_client_quality(monkeypatch):
+    monkeypatch.setattr(compression, "ENCODINGS", [
+        ("zstd", None), ("br", None), ("gzip", None)])
+    assert choose_encoding("gzip, br, zstd")[0] == "zstd"
+    assert choose_encoding("gzip, br;q=0.9, zstd;q=0.8")[0] == "gzip"
+
+
+@pytest.fixture
+def compressed_cli(loop, aiohttp_client):
+    async def large(request):
+        return web.json_response(BODY, headers={"ETag": request.query.get("etag", '"1"')})
+
+    async def small(request):
+        return web.json_response({"count": 0})
+
+    async def streamed(request):
+        async def parts():
+            yield json.dumps(BODY).encode("utf-8")
+        return web.Response(body=parts(), content_type="application/json")
+
+    config = Compression({"executor_min_size": 0})
+    app = web.Application(middlewares=[compression_middleware(config)])
+    app.router.add_route("GET", "/large", large)
+    app.router.add_route("GET", "/small", small)
+    app.router.add_route("GET", "/streamed", streamed)
+    return loop.run_until_complete(aiohttp_client(app))
+
+
+@pytest.mark.parametrize("path", ["/large", "/streamed"])
+async def test_compress_large_response(path, compressed_cli):
+    resp = await compressed_cli.get(path, headers={"Accept-Encoding": "gzip"},
+                                    auto_decompress=False)
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in resp.headers["Vary"]
+    assert json.loads(gzip.decompress(await resp.read())) == BODY
+
+
+async def test_small_response_not_compressed(compressed_cli):
+    resp = await compressed_cli.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
+    assert await resp.json() == {"count": 0}
+
+
+async def test_response_not_compressed_without_accept_encoding(compressed_cli):
+    resp = await compressed_cli.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in resp.headers
+    assert await resp.json() == BODY
+
+
+@pytest.mark.parametrize("etag, expected", [
+    ('"1.2"', '"1.2-gzip"'),
+    ('W/"1.2"', 'W/"1.2"'),
+])
+async def test_compressed_strong_etag_depends_on_encoding(etag, expected,
+                                                         compressed_cli):
+    resp = await compressed_cli.get("/large", params={"etag": etag},
+                                    headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["ETag"] == expected
+    resp = await compressed_cli.get("/large", params={"etag": etag},
+                                    headers={"Accept-Encoding": "identity"})
+    assert resp.headers["ETag"] == etag
+
+
+@pytest.mark.parametrize("etag, expected", [
+    ('"1.2-gzip"', '"1.2"'),
+    ('"1.2-br"', '"1.2"'),
+    ('"1.2"', '"1.2"'),
+    ('"gzip"', '"gzip"'),
+])
+def test_without_encoding(etag, expected):
+    assert without_encoding(etag) == expected
@@ -5,7 +5,9 @@ from unittest.mock import patch
 import pytest
 
 from aiohttp.web import HTTPNotFound
-from tycho.routes.event import _merge, _update
+from tycho import metrics
+from tycho.db.event.version import VersionConflict
+from tycho.routes.event import _update
 from tycho.models.event import Event
 from schematics.exceptions import DataError
 
@@ -32,6 +34,66 @@ async def test_get_children_events(event_in_db, cli):
     assert resp.status == 200
 
 
+async def test_get_children_events_stream(event_in_db, cli):
+    resp = await cli.get('/api/v1/event/{0}/children'.format(
+        event_in_db.parent_id
+    ), params={"stream": "true"})
+    assert resp.status == 200
+    retrieved_event_json = (await resp.json())
+    assert retrieved_event_json == [event_in_db.to_primitive()]
+
+
+async def test_get_events_stream(source_event_in_db,
+                                 parent_event_in_db,
+                                 event_in_db,
+                                 cli):
+    resp = await cli.get('/api/v1/event/', params={"stream": "true",
+                                                   "count": 2})
+    assert resp.status == 200
+    retrieved_event_json = (await resp.json())
+    assert retrieved_event_json["count"] == 2
+    assert retrieved_event_json["result"] == [
+        source_event_in_db.to_primitive(), parent_event_in_db.to_primitive()]
+
+    resp = await cli.get('/api/v1/event/', params={
+        "stream": "true", "count": 2, "after": retrieved_event_json["after"]})
+    retrieved_event_json = (await resp.json())
+    assert retrieved_event_json["result"] == [event_in_db.to_primitive()]
+    assert retrieved_event_json["after"] is None
+
+
+async def test_get_events_ndjson(source_event_in_db,
+                                 parent_event_in_db,
+                                 event_in_db,
+                                 cli):
+    resp = await cli.get('/api/v1/event/',
+                         headers={"Accept": "application/x-ndjson"})
+    assert resp.status == 200
+    assert resp.content_type == "application/x-ndjson"
+    lines = (await resp.text()).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        source_event_in_db.to_primitive(),
+        parent_event_in_db.to_primitive(),
+        event_in_db.to_primitive()]
+
+
+async def test_get_events_ndjson_with_after(source_event_in_db,
+                                            parent_event_in_db,
+                                            event_in_db,
+                                            cli):
+    resp = await cli.get('/api/v1/event/', params={"count": 2},
+                         headers={"Accept": "application/x-ndjson"})
+    lines = [json.loads(line) for line in (await resp.text()).splitlines()]
+    assert [line["id"] for line in lines[:2]] == [source_event_in_db.id,
+                                                  parent_event_in_db.id]
+    assert list(lines[2]) == ["after"]
+
+    resp = await cli.get('/api/v1/event/', params={"after": lines[2]["after"]},
+                         headers={"Accept": "application/x-ndjson"})
+    lines = [json.loads(line) for line in (await resp.text()).splitlines()]
+    assert lines == [event_in_db.to_primitive()]
+
+
 async def test_get_event_with_no_query_parameters(source_event_in_db,
                                                   parent_event_in_db,
                                                   event_in_db,
@@ -69,6 +131,35 @@ async def test_get_event_with_page_parameters(source_event_in_db,
     assert retrieved_event_json["count"] == 0
 
 
+async def test_get_event_with_after_parameter(source_event_in_db,
+                                              parent_event_in_db,
+                                              event_in_db,
+                                              cli):
+    resp = await cli.get('/api/v1/event/', params={"count": 2})
+    assert resp.status == 200
+    retrieved_event_json = (await resp.json())
+    assert retrieved_event_json["count"] == 2
+    assert retrieved_event_json["after"] is not None
+
+    resp = await cli.get('/api/v1/event/', params={
+        "count": 2, "after": retrieved_event_json["after"]})
+    assert resp.status == 200
+    retrieved_event_json = (await resp.json())
+    assert retrieved_event_json["count"] == 1
+    assert retrieved_event_json["result"][0] == event_in_db.to_primitive()
+    # the last page is not full.
+    assert retrieved_event_json["after"] is None
+
+
+@pytest.mark.parametrize("params", [
+    {"after": "not a cursor"},
+    {"after": "e30=", "page": 2},
+])
+async def test_get_event_with_invalid_after_parameter(params, cli):
+    resp = await cli.get('/api/v1/event/', params=params)
+    assert resp.status == 400
+
+
 async def test_get_events_with_timestamp_queries(parent_event_in_db,
                                                  event_in_db,
                                                  cli):
@@ -209,6 +300,46 @@ async def test_get_event_impact(cli,
     assert child_of_leaf == []
 
 
+@pytest.mark.parametrize("traversal", ["bfs", "graph_lookup",
+                                       "ancestors", "source_id"])
+async def test_get_event_impact_with_traversal(cli, traversal,
+                                               source_event_in_db,
+                                               parent_event_in_db,
+                                               event_in_db):
+    resp = await cli.get('/api/v1/event/{0}/impact'.format(
+        source_event_in_db.id
+    ), params={"traversal": traversal})
+    assert resp.status == 200
+
+    source_node = (await resp.json())
+    assert source_node["children"][0]["event"] == \
+        parent_event_in_db.to_primitive()
+    assert source_node["children"][0]["children"][0]["event"] == \
+        event_in_db.to_primitive()
+
+
+@pytest.mark.parametrize("traversal", ["bfs", "graph_lookup",
+                                       "ancestors", "source_id"])
+async def test_get_trace_with_traversal(cli, traversal,
+                                        source_event_in_db,
+                                        parent_event_in_db,
+                                        event_in_db):
+    resp = await cli.get('/api/v1/event/{0}/trace'.format(
+        event_in_db.id
+    ), params={"traversal": traversal})
+    assert resp.status == 200
+    event_json = (await resp.json())
+    assert [e["id"] for e in event_json] == [
+        event_in_db.id, parent_event_in_db.id, source_event_in_db.id]
+
+
+async def test_get_event_impact_with_invalid_traversal(cli, event_in_db):
+    resp = await cli.get('/api/v1/event/{0}/impact'.format(
+        event_in_db.id
+    ), params={"traversal": "dfs"})
+    assert resp.status == 400
+
+
 async def test_get_event_impact_diagram(cli, event_in_db):
     resp = await cli.get('/event/{0}/'.format(
         event_in_db.id
@@ -330,6 +461,15 @@ async def test_post_dont_allow_invalid_opers(event, cli):
     assert resp.status == 400
 
 
+async def test_post_event_merge_with_clashing_reserved_keys(event_in_db, cli):
+    new_event = attr.evolve(event_in_db, source_id="5498d53c5f2d60095267a0bc")
+    resp = await cli.post('/api/v1/event/',
+                          headers={"content-type": "application/json"},
+                          data=json.dumps({"operation": "merge",
+                                           "event": new_event.to_primitive()}))
+    assert resp.status == 400
+
+
 @pytest.mark.parametrize("log", [False, True])
 async def test_post_event_merge(event, cli, app, log):
     with patch("tycho.routes.event.LOG") as mock_log:
@@ -449,16 +589,22 @@ async def test_merge_description_with_post_existing_event(new_description, shoul
             == event_in_db.description) != should_merge
 
 
-def test_merge_empty_event_with_new_one():
-    existing_event = Event()
+async def _merge(app, existing_event, new_event):
+    # merges go through the same atomic update as the routes.
+    await app["db"].event.save(existing_event)
+    return await app["db"].event.merge_by_id(existing_event.id, new_event)
+
+
+async def test_merge_empty_event_with_new_one(app):
+    time = datetime(2020, 1, 1)
+    existing_event = Event.from_dict({"start_time": time, "end_time": time})
     new_event = Event.from_dict({"id": existing_event.id,
                                  "source_id": "5498d53c5f2d60095267a0bc",
-                                 "end_time": existing_event.end_time + timedelta(hours=2)})
-    _merge(existing_event, new_event)
-    assert existing_event.id == new_event.id
-    assert existing_event.source_id == new_event.source_id
-    assert existing_event.end_time == new_event.end_time
-    assert len(attr.asdict(existing_event)) == len(attr.asdict(new_event))
+                                 "end_time": time + timedelta(hours=2)})
+    merged_event = await _merge(app, existing_event, new_event)
+    assert merged_event.id == new_event.id
+    assert merged_event.source_id == new_event.source_id
+    assert merged_event.end_time == new_event.end_time
 
 
 def test_update_empty_event_with_new_one():
@@ -468,33 +614,35 @@ def test_update_empty_event_with_new_one():
     assert attr.asdict(existing_event) == attr.asdict(new_event)
 
 
-def test_merge_diff_values_of_reserved_keys_raises_exception():
+async def test_merge_diff_values_of_reserved_keys_raises_exception(app):
     existing_event = Event({"source_id": "5498d53c5f2d60095267a0bb"})
     new_event = Event(
         {"id": existing_event.id, "source_id": "5498d53c5f2d60095267a0bc"})
     with pytest.raises(ValueError):
-        _merge(existing_event, new_event)
+        await _merge(app, existing_event, new_event)
 
 
-def test_merge_two_start_times():
-    time = datetime.now()
-    existing_event = Event.from_dict({"start_time": time})
+async def test_merge_two_start_times(app):
+    time = datetime(2020, 1, 1)
+    existing_event = Event.from_dict({"start_time": time, "end_time": time})
     new_event = Event.from_dict(
-        {"id": existing_event.id, "start_time": time - timedelta(hours=2)})
-    _merge(existing_event, new_event)
-    assert existing_event.start_time == new_event.start_time
+        {"id": existing_event.id, "start_time": time - timedelta(hours=2),
+         "end_time": time})
+    merged_event = await _merge(app, existing_event, new_event)
+    assert merged_event.start_time == new_event.start_time
 
 
-def test_merge_two_end_times():
-    time = datetime.now()
-    existing_event = Event.from_dict({"end_time": time})
+async def test_merge_two_end_times(app):
+    time = datetime(2020, 1, 1)
+    existing_event = Event.from_dict({"start_time": time, "end_time": time})
     new_event = Event.from_dict(
-        {"id": existing_event.id, "end_time": time + timedelta(hours=2)})
-    _merge(existing_event, new_event)
-    assert existing_event.end_time == new_event.end_time
+        {"id": existing_event.id, "start_time": time,
+         "end_time": time + timedelta(hours=2)})
+    merged_event = await _merge(app, existing_event, new_event)
+    assert merged_event.end_time == new_event.end_time
 
 
-def test_merge_detail_urls():
+async def test_merge_detail_urls(app):
     existing_event = Event.from_dict({"source_id": "5498d53c5f2d60095267a0bb",
                                       "detail_urls":
                                       {"graphite": "http://graphite",
@@ -503,31 +651,31 @@ def test_merge_detail_urls():
     new_event = Event.from_dict({"id": existing_event.id,
                                  "detail_urls": {"graphite": "http://graphite",
                                                  "concrete": "http://concrete"}})
-    _merge(existing_event, new_event)
+    merged_event = await _merge(app, existing_event, new_event)
     ls = {"graphite": "http://graphite",
           "concrete": "http://concrete"}
-    assert existing_event.detail_urls == ls
+    assert merged_event.detail_urls == ls
 
 
-def test_merge_with_already_existing_keys():
+async def test_merge_with_already_existing_keys(app):
     existing_event = Event.from_dict({"source_id": "5498d53c5f2d60095267a0bb",
                                       "tags": {"author": ["Sean"]}})
     new_event = Event.from_dict({"id": existing_event.id,
                                  "source_id": "5498d53c5f2d60095267a0bb",
                                  "tags": {"author": ["Yusuke"]}})
-    _merge(existing_event, new_event)
-    assert existing_event.tags["author"] == ["Sean", "Yusuke"]
+    merged_event = await _merge(app, existing_event, new_event)
+    assert merged_event.tags["author"] == ["Sean", "Yusuke"]
 
 
-def test_merge_two_descriptions():
+async def test_merge_two_descriptions(app):
     existing_event = Event.from_dict({"source_id": "5498d53c5f2d60095267a0bb",
                                       "description":
                                       "This is a Concrete Event."})
     new_event = Event.from_dict({"id": existing_event.id,
                                  "description": "The version is 2.2.3."})
-    _merge(existing_event, new_event)
+    merged_event = await _merge(app, existing_event, new_event)
     test_str = "This is a Concrete Event.\nThe version is 2.2.3."
-    assert existing_event.description == test_str
+    assert merged_event.description == test_str
 
 
 async def test_post_event_update(event, cli):
@@ -565,6 +713,272 @@ async def test_post_existing_event_update(event_in_db, cli):
     assert retrieved_event.start_time == updated_time
 
 
+async def test_get_event_returns_version_as_etag(event_in_db, cli):
+    resp = await cli.get('/api/v1/event/{0}'.format(event_in_db.id))
+    assert resp.headers["ETag"].startswith('"1.')
+
+    event_in_db.description = "new description"
+    resp = await cli.post('/api/v1/event/',
+                          headers={"content-type": "application/json",
+                                   "If-Match": resp.headers["ETag"]},
+                          data=json.dumps({"operation": "update",
+                                           "event": event_in_db.to_primitive()}))
+    assert resp.status == 200
+
+
+async def test_recreated_event_changes_etag(app, event_in_db, cli):
+    path = '/api/v1/event/{0}'.format(event_in_db.id)
+    etag = (await cli.get(path)).headers["ETag"]
+    await app["db"].event.delete_by_id(event_in_db.id)
+    event_in_db.description = "new description"
+    await app["db"].event.save(event_in_db)
+    resp = await cli.get(path, headers={"If-None-Match": etag})
+    assert resp.status == 200
+    assert resp.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("operation", ["merge", "update"])
+@pytest.mark.parametrize("if_match, status", [
+    ('"1"', 200), ('"1.123"', 200), ('"1.123-gzip"', 200), ('W/"1"', 412),
+    ('W/"1.123"', 412), ('"2"', 412), ("*", 200), ("one", 400),
+])
+async def test_post_event_with_if_match(operation, if_match, status,
+                                        event_in_db, cli):
+    resp = await cli.post('/api/v1/event/',
+                          headers={"content-type": "application/json",
+                                   "If-Match": if_match},
+                          data=json.dumps({"operation": operation,
+                                           "event": event_in_db.to_primitive()}))
+    assert resp.status == status
+
+
+async def test_post_event_with_if_match_on_nothing(event, cli):
+    resp = await cli.post('/api/v1/event/',
+                          headers={"content-type": "application/json",
+                                   "If-Match": '"1"'},
+                          data=json.dumps({"operation": "merge",
+                                           "event": event.to_primitive(),
+                                           "insert": True}))
+    assert resp.status == 412
+
+
+async def test_post_event_update_retries_on_version_conflict(app, event_in_db, cli):
+    metrics.reset()
+    update_by_id = app["db"].event.update_by_id
+    conflicts = [VersionConflict(event_in_db.id, 1)]
+
+    async def update_with_conflict(*args, **kwargs):
+        if conflicts:
+            raise conflicts.pop()
+        return await update_by_id(*args, **kwargs)
+
+    with patch.object(app["db"].event, "update_by_id", new=update_with_conflict):
+        resp = await cli.post('/api/v1/event/',
+                              headers={"content-type": "application/json"},
+                              data=json.dumps({"operation": "update",
+                                               "event": event_in_db.to_primitive()}))
+    assert resp.status == 200
+    assert metrics.get_metrics()["event.update.version_conflicts"] == 1
+
+
+async def test_get_metrics(cli):
+    metrics.reset()
+    metrics.increment("event.update.retries")
+    resp = await cli.get('/api/v1/metrics')
+    assert resp.status == 200
+    assert (await resp.json()) == {"event.update.retries": 1}
+
+
+@pytest.mark.parametrize("path", [
+    "/api/v1/event/{0}",
+    "/api/v1/event/{0}/children",
+    "/api/v1/event/{0}/trace",
+    "/api/v1/event/{0}/impact",
+])
+async def test_get_with_if_none_match(path, source_event_in_db,
+                                      parent_event_in_db, cli):
+    path = path.format(parent_event_in_db.id)
+    resp = await cli.get(path)
+    assert resp.status == 200
+    etag = resp.headers["ETag"]
+
+    resp = await cli.get(path, headers={"If-None-Match": etag})
+    assert resp.status == 304
+    assert resp.headers["ETag"] == etag
+    assert (await resp.read()) == b""
+
+    # compared weakly, whether the W/ prefix is passed or not.
+    strong = etag[2:] if etag.startswith("W/") else etag
+    resp = await cli.get(path, headers={"If-None-Match": '"other", W/' + strong})
+    assert resp.status == 304
+
+    resp = await cli.get(path, headers={"If-None-Match": '"other"'})
+    assert resp.status == 200
+
+
+@pytest.mark.parametrize("path", [
+    "/api/v1/event/{0}/children",
+    "/api/v1/event/{0}/impact",
+])
+async def test_new_child_changes_etag(path, app, event, parent_event_in_db, cli):
+    path = path.format(parent_event_in_db.id)
+    etag = (await cli.get(path)).headers["ETag"]
+    await app["db"].event.save(event)
+    resp = await cli.get(path, headers={"If-None-Match": etag})
+    assert resp.status == 200
+    assert resp.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("path, params", [
+    ("/api/v1/event/{0}/children", {}),
+    ("/api/v1/event/{0}/children", {"stream": "true"}),
+    ("/api/v1/event/", {"tag": "services:tycho"}),
+])
+async def test_get_events_with_fields(path, params, parent_event_in_db,
+                                      event_in_db, cli):
+    params["fields"] = "parent_id,tags.environment"
+    resp = await cli.get(path.format(parent_event_in_db.id), params=params)
+    assert resp.status == 200
+    body = await resp.json()
+    events = body["result"] if isinstance(body, dict) else body
+    assert {
+        "id": event_in_db.id,
+        "parent_id": event_in_db.parent_id,
+        "tags": {"environment": event_in_db.tags["environment"]},
+    } in events
+
+
+async def test_get_event_impact_with_fields(source_event_in_db, parent_event_in_db,
+                                            event_in_db, cli):
+    path = "/api/v1/event/{0}/impact".format(source_event_in_db.id)
+    resp = await cli.get(path, params={"fields": "start_time"})
+    tree = await resp.json()
+    assert tree["event"] == {
+        "id": source_event_in_db.id,
+        "start_time": source_event_in_db.to_primitive()["start_time"],
+    }
+    assert tree["children"][0]["event"] == {
+        "id": parent_event_in_db.id,
+        "start_time": parent_event_in_db.to_primitive()["start_time"],
+    }
+    assert resp.headers["ETag"] != (await cli.get(path)).headers["ETag"]
+
+
+@pytest.mark.parametrize("path", [
+    "/api/v1/event/{0}/children",
+    "/api/v1/event/{0}/impact",
+    "/api/v1/event/",
+])
+async def test_get_events_with_invalid_fields(path, parent_event_in_db, cli):
+    resp = await cli.get(path.format(parent_event_in_db.id),
+                         params={"fields": "id,ancestors"})
+    assert resp.status == 400
+
+
+async def test_updated_parent_changes_trace_etag(app, source_event_in_db,
+                                                 parent_event_in_db,
+                                                 event_in_db, cli):
+    path = "/api/v1/event/{0}/trace".format(event_in_db.id)
+    etag = (await cli.get(path)).headers["ETag"]
+    source_event_in_db.description = "new description"
+    await app["db"].event.update_by_id(source_event_in_db.id, source_event_in_db)
+    resp = await cli.get(path, headers={"If-None-Match": etag})
+    assert resp.status == 200
+
+
+async def test_get_events_with_tag_prefix(app, event_in_db, cli):
+    resp = await cli.get('/api/v1/event/', params={"tag_prefix": "services:ty"})
+    assert resp.status == 200
+    assert event_in_db.id in [e["id"] for e in (await resp.json())["result"]]
+
+
+async def test_get_events_with_invalid_tag_prefix(app, cli):
+    resp = await cli.get('/api/v1/event/', params={"tag_prefix": "services"})
+    assert resp.status == 400
+
+
+async def test_impact_without_ancestors_has_no_etag(app, source_event_in_db,
+                                                    parent_event_in_db, cli):
+    await app["db"].event.collection.update_one(
+        {"_id": parent_event_in_db.id}, {"$unset": {"ancestors": ""}})
+    resp = await cli.get("/api/v1/event/{0}/impact".format(source_event_in_db.id))
+    assert resp.status == 200
+    assert "ETag" not in resp.headers
+
+
+async def test_impact_etag_depends_on_traversal(event_in_db, cli):
+    path = "/api/v1/event/{0}/impact".format(event_in_db.id)
+    etag = (await cli.get(path)).headers["ETag"]
+    resp = await cli.get(path + "?traversal=ancestors",
+                         headers={"If-None-Match": etag})
+    assert resp.status == 200
+
+
+@pytest.mark.parametrize("path", [
+    "/api/v1/event/{0}/children",
+    "/api/v1/event/{0}/impact",
+    "/api/v1/event/?tag=source:deploy&",
+])
+async def test_get_changes_since(path, app, parent_event_in_db, event_in_db, cli):
+    path = path.format(parent_event_in_db.id)
+    separator = "" if path.endswith("&") else "?"
+    since = datetime.utcnow() - timedelta(minutes=1)
+    resp = await cli.get(path + separator + "since=" + since.isoformat())
+    assert resp.status == 200
+    changes = await resp.json()
+    assert event_in_db.id in [e["id"] for e in changes["result"]]
+    assert changes["deleted"] == []
+
+    until = changes["until"]
+    await app["db"].event.delete_by_id(event_in_db.id)
+    resp = await cli.get(path + separator + "since=" + until)
+    changes = await resp.json()
+    assert event_in_db.id not in [e["id"] for e in changes["result"]]
+    assert changes["deleted"] == [event_in_db.id]
+
+
+async def test_get_changes_since_with_offset(app, parent_event_in_db, event_in_db, cli):
+    since = datetime.utcnow() - timedelta(minutes=1)
+    resp = await cli.get("/api/v1/event/{0}/children?since={1}Z".format(
+        parent_event_in_db.id, since.isoformat()))
+    assert resp.status == 200
+    assert event_in_db.id in [e["id"] for e in (await resp.json())["result"]]
+
+
+async def test_get_events_since_with_tag_kv_reports_deletions(app, event_in_db, cli):
+    app["db"].event.tag_kv = True
+    since = datetime.utcnow() - timedelta(minutes=1)
+    await app["db"].event.delete_by_id(event_in_db.id)
+    resp = await cli.get("/api/v1/event/", params={
+        "tag": "services:tycho", "since": since.isoformat()})
+    assert resp.status == 200
+    assert (await resp.json())["deleted"] == [event_in_db.id]
+
+
+async def test_get_events_since_returns_oldest_first(app, event_in_db,
+                                                     parent_event_in_db, cli):
+    since = datetime.utcnow() - timedelta(minutes=1)
+    resp = await cli.get("/api/v1/event/?count=1&since=" + since.isoformat())
+    changes = await resp.json()
+    assert changes["count"] == 1
+    first = changes["result"][0]["id"]
+    resp = await cli.get("/api/v1/event/", params={
+        "count": 1, "since": changes["until"], "after": changes["after"]})
+    changes = await resp.json()
+    assert changes["result"][0]["id"] != first
+    assert {first, changes["result"][0]["id"]} == {parent_event_in_db.id, event_in_db.id}
+
+
+@pytest.mark.parametrize("query", [
+    "since={0}&page=2", "since={0}&frm={0}", "since=2000-01-01T00:00:00",
+    "since={0}&after=not-a-cursor",
+])
+async def test_get_events_since_with_invalid_query(query, cli):
+    since = datetime.utcnow().isoformat()
+    resp = await cli.get("/api/v1/event/?" + query.format(since))
+    assert resp.status == 400
+
+
 async def test_delete_non_existing_event(cli):
     event_id = "event_not_exist"
     resp = await cli.delete("/api/v1/event/{0}/delete".format(event_id))
@@ -586,31 +1000,31 @@ async def test_delete_existing_event(cli, event_in_db):
     assert 404 == resp.status
 
 
-def test_same_values_not_added_twice():
+async def test_same_values_not_added_twice(app):
     existing_event = Event.from_dict({"source_id": "5498d53c5f2d60095267a0bb",
                                       "tags": {"author": ["Yusuke"]}})
     new_event = Event.from_dict({"id": existing_event.id,
                                  "tags": {"author": ["Yusuke"]}})
-    _merge(existing_event, new_event)
-    assert existing_event.tags["author"] == ["Yusuke"]
+    merged_event = await _merge(app, existing_event, new_event)
+    assert merged_event.tags["author"] == ["Yusuke"]
 
 
-def test_merge_two_attrs_of_type_lists_with_duplicates():
+async def test_merge_two_attrs_of_type_lists_with_duplicates(app):
     existing_event = Event.from_dict({"source_id": "5498d53c5f2d60095267a0bb",
                                       "tags": {"author": ["Yusuke", "Sean"]}})
     new_event = Event.from_dict({"id": existing_event.id,
                                  "tags": {"author": ["Yusuke", "Mayur"]}})
-    _merge(existing_event, new_event)
-    assert existing_event.tags["author"] == ["Yusuke", "Sean", "Mayur"]
+    merged_event = await _merge(app, existing_event, new_event)
+    assert merged_event.tags["author"] == ["Yusuke", "Sean", "Mayur"]
 
 
-def test_merge_new_attributes():
+async def test_merge_new_attributes(app):
     existing_event = Event.from_dict({"source_id": "5498d53c5f2d60095267a0bb",
                                       "tags": {"author": ["Saroj"]}})
     new_event = Event.from_dict({"id": existing_event.id,
                                  "tags": {"reviewer": ["Yusuke"]}})
-    _merge(existing_event, new_event)
-    assert existing_event.tags["reviewer"] == ["Yusuke"]
+    merged_event = await _merge(app, existing_event, new_event)
+    assert merged_event.tags["reviewer"] == ["Yusuke"]
 
 
 def test_update_non_existing_values():
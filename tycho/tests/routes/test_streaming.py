@@ -0,0 +1,16 @@
+import pytest
+from unittest import mock
+
+from tycho.routes.streaming import wants_stream
+
+
+@pytest.mark.parametrize("stream, accept, expected", [
+    (False, "application/json", False),
+    (False, "", False),
+    (True, "application/json", True),
+    (False, "application/x-ndjson", True),
+    (False, "application/x-ndjson, application/json;q=0.9", True),
+])
+def test_wants_stream(stream, accept, expected):
+    request = mock.Mock(headers={"Accept": accept})
+    assert wants_stream(request, stream) == expected
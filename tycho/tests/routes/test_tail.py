@@ -0,0 +1,52 @@
+import asyncio
+import json
+from unittest import mock
+
+import aiohttp
+
+
+async def _subscribed(app, count=1):
+    while len(app["event_tail"].subscriptions) < count:
+        await asyncio.sleep(0.01)
+
+
+async def test_tail_event_stream(app, cli):
+    app["event_tail"]._watch = mock.Mock(side_effect=lambda: asyncio.sleep(3600))
+    resp = await cli.get("/api/v1/tail?tag=type:deploy")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"].startswith("text/event-stream")
+    await _subscribed(app)
+
+    app["event_tail"].dispatch({"_id": "a", "tags": ["type:alert"]})
+    app["event_tail"].dispatch({"_id": "b", "tags": ["type:deploy"]})
+    line = await resp.content.readline()
+    assert line.startswith(b"data: ")
+    assert json.loads(line[len(b"data: "):])["id"] == "b"
+    resp.close()
+
+
+async def test_tail_websocket(app, cli):
+    app["event_tail"]._watch = mock.Mock(side_effect=lambda: asyncio.sleep(3600))
+    websocket = await cli.ws_connect("/api/v1/tail")
+    await _subscribed(app)
+
+    app["event_tail"].dispatch({"_id": "a", "tags": ["type:deploy"]})
+    message = await websocket.receive_json()
+    assert message["id"] == "a"
+
+    await websocket.close()
+    while app["event_tail"].subscriptions:
+        await asyncio.sleep(0.01)
+
+
+async def test_tail_websocket_overflow(app, cli):
+    app["event_tail"]._watch = mock.Mock(side_effect=lambda: asyncio.sleep(3600))
+    app["event_tail"].queue_size = 1
+    websocket = await cli.ws_connect("/api/v1/tail")
+    await _subscribed(app)
+
+    for id in "abc":
+        app["event_tail"].dispatch({"_id": id})
+    message = await websocket.receive()
+    assert message.type == aiohttp.WSMsgType.CLOSE
+    assert websocket.close_code == aiohttp.WSCloseCode.TRY_AGAIN_LATER
@@ -0,0 +1,58 @@
+import argparse
+import pytest
+
+from tycho.scripts.benchmark_routes import (
+    DEFAULT_MIX, Workload, compare, parse_mix, percentile, run_workload, summarize)
+from tycho.scripts.synthetic_events import make_dataset
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3], 90) == 3
+    assert percentile([], 50) is None
+
+
+def test_summarize():
+    summary = summarize([0.002, 0.001, 0.003, 0.004], errors=1, duration=2)
+    assert summary["requests"] == 4
+    assert summary["errors"] == 1
+    assert summary["throughput"] == 2
+    assert summary["p50_ms"] == pytest.approx(2)
+    assert summary["max_ms"] == pytest.approx(4)
+
+
+def test_compare():
+    previous = {"routes": {"put": summarize([0.002], 0, 1)},
+                "total": summarize([0.002], 0, 1)}
+    current = {"routes": {"put": summarize([0.001, 0.001], 0, 1),
+                          "trace": summarize([0.001], 0, 1)},
+               "total": summarize([0.001, 0.001, 0.001], 0, 1)}
+    ratios = compare(current, previous)
+    assert set(ratios) == {"put", "total"}
+    assert ratios["put"]["throughput"] == 2
+    assert ratios["put"]["p99_ms"] == pytest.approx(0.5)
+
+
+def test_parse_mix():
+    assert parse_mix("put=3,listing") == {"put": 3, "listing": 1}
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_mix("unknown=1")
+
+
+@pytest.mark.parametrize("route", list(DEFAULT_MIX))
+def test_workload_request(route):
+    workload = Workload(make_dataset(width=2, depth=3, count=5), depth=3)
+    method, path, body = workload.request(route)
+    assert path.startswith("/api/v1/event/")
+    assert (body is None) == (method == "GET")
+
+
+async def test_run_workload_counts_client_errors(loop, unused_tcp_port):
+    workload = Workload(make_dataset(width=2, depth=3, count=5), depth=3)
+    # nothing listens on the port, so every request fails to connect.
+    latencies, errors = await run_workload(
+        "http://127.0.0.1:{0}".format(unused_tcp_port), workload, {"listing": 1},
+        duration=0.05, concurrency=2)
+    assert errors["listing"] == len(latencies["listing"]) > 0
@@ -0,0 +1,91 @@
+import pymongo
+
+from tycho.db.event import Event
+from tycho.scripts.create_indexes import _create_indexes, diff_indexes
+
+TIME = [("time", pymongo.ASCENDING)]
+TAGS = [("tags", pymongo.ASCENDING)]
+
+
+class FakeCollection:
+
+    def __init__(self, live):
+        self.live = live
+        self.created = []
+        self.dropped = []
+
+    async def index_information(self):
+        return self.live
+
+    async def create_index(self, keys, **options):
+        self.created.append((keys, options))
+
+    async def drop_index(self, name):
+        self.dropped.append(name)
+
+
+class FakeDBClass:
+    _collection = "fake"
+
+    def __init__(self, indexes, live):
+        self.indexes = indexes
+        self.collection = FakeCollection(live)
+
+
+LIVE = {
+    "_id_": {"key": [("_id", 1)]},
+    "time_1": {"key": [("time", 1.0)], "expireAfterSeconds": 60},
+    "tags_1": {"key": [("tags", 1)]},
+    "old_1": {"key": [("old", 1)]},
+}
+
+
+def test_diff_indexes():
+    declared = [
+        {"unique": False, "keys": TIME, "expireAfterSeconds": 120},
+        {"unique": False, "keys": TAGS},
+        {"unique": False, "keys": [("parent_id", pymongo.ASCENDING)]},
+    ]
+    diff = diff_indexes(declared, LIVE)
+    assert diff.missing == [declared[2]]
+    assert diff.changed == [(declared[0], "time_1")]
+    assert diff.obsolete == ["old_1"]
+    assert diff.unchanged == ["tags_1"]
+
+
+def test_diff_indexes_compares_declared_collation_options():
+    declared = [{"keys": TAGS, "collation": {"locale": "en"}}]
+    live = {"tags_1": {"key": TAGS, "collation": {"locale": "en", "strength": 3}}}
+    assert diff_indexes(declared, live).unchanged == ["tags_1"]
+
+
+def test_diff_indexes_of_declared_event_indexes():
+    # as reported by index_information, with the options declared.
+    live = {"index_{0}".format(i): dict(index, key=index["keys"])
+            for i, index in enumerate(Event.indexes)}
+    diff = diff_indexes(Event.indexes, live)
+    assert len(diff.unchanged) == len(Event.indexes)
+    assert diff.missing == diff.changed == diff.obsolete == []
+
+
+async def test_create_indexes_only_creates_missing_ones(loop):
+    db_class = FakeDBClass([{"unique": False, "keys": TAGS},
+                            {"unique": False, "keys": [("parent_id", 1)]}], LIVE)
+    await _create_indexes(db_class)
+    assert db_class.collection.created == [
+        ([("parent_id", 1)], {"unique": False, "background": True})]
+    assert db_class.collection.dropped == []
+
+
+async def test_create_indexes_with_drop(loop):
+    db_class = FakeDBClass([{"unique": False, "keys": TIME}], LIVE)
+    await _create_indexes(db_class, drop=True)
+    assert db_class.collection.dropped == ["time_1", "old_1", "tags_1"]
+    assert db_class.collection.created == [(TIME, {"unique": False, "background": True})]
+
+
+async def test_create_indexes_dry_run(loop):
+    db_class = FakeDBClass([{"unique": False, "keys": [("parent_id", 1)]}], LIVE)
+    diff = await _create_indexes(db_class, drop=True, dry_run=True)
+    assert diff.obsolete == ["old_1", "tags_1", "time_1"]
+    assert db_class.collection.created == db_class.collection.dropped == []